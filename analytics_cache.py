@@ -0,0 +1,190 @@
+"""In-memory, array-backed cache of channel metrics for repeated lookups.
+
+Each channel is loaded from SQLite once, on first use, into one block of
+contiguous NumPy columns: the days as int64 microsecond timestamps
+(``datetime64[us]``, keeping the time of day the rows carry), int64 daily
+views, impressions and watch time and float32 CTR, about 36 bytes per
+metric day. A video's metrics are a slice of its channel's columns, so
+after the first load every lookup is a dict lookup plus an array view.
+
+Blocks are evicted least recently used first once their total size
+exceeds the memory budget. The cache is a read-through snapshot: call
+``invalidate`` after writing to a channel.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+from analytics_schema import CONSOLIDATED_LAYOUT, MAX_COMPOUND_SELECT, safe_id
+
+DEFAULT_BUDGET_MB = 256
+
+
+class ChannelBlock:
+    """Videos and metric columns of one channel (or of a single video)."""
+
+    __slots__ = ('videos', 'spans', 'days', 'day_views', 'impressions', 'ctr', 'watchtime', 'nbytes')
+
+    def __init__(self, videos, video_ids, rows):
+        self.videos = videos
+        rows.sort(key=lambda row: (row[0], row[1]))
+        columns = list(zip(*rows)) if rows else [()] * 6
+        self.days = np.array(columns[1], dtype='datetime64[us]')
+        self.day_views = np.array(columns[2], dtype=np.int64)
+        self.impressions = np.array(columns[3], dtype=np.int64)
+        self.ctr = np.array(columns[4], dtype=np.float32)
+        self.watchtime = np.array(columns[5], dtype=np.int64)
+
+        # video_id -> (start, stop) of its rows in the columns
+        self.spans = {video_id: (0, 0) for video_id in video_ids}
+        row_video_ids = columns[0]
+        start = 0
+        for stop in range(1, len(rows) + 1):
+            if stop == len(rows) or row_video_ids[stop] != row_video_ids[start]:
+                self.spans[row_video_ids[start]] = (start, stop)
+                start = stop
+
+        self.nbytes = sum(column.nbytes for column in (
+            self.days, self.day_views, self.impressions, self.ctr, self.watchtime
+        ))
+
+    def metric_arrays(self, video_id):
+        """Return (days, day_views) array views of one video's metrics."""
+        start, stop = self.spans.get(video_id, (0, 0))
+        return self.days[start:stop], self.day_views[start:stop]
+
+
+def _query_channel(conn, layout, user_id):
+    """Return a channel's (video_id, video_name, views) rows and all its metric rows."""
+    if layout == CONSOLIDATED_LAYOUT:
+        videos = conn.execute(
+            'SELECT video_id, video_name, views FROM videos WHERE user_id = ?', (user_id,)
+        ).fetchall()
+        rows = conn.execute('''
+            SELECT m.video_id, m.day, m.day_views, m.impressions, m.ctr, m.watchtime
+            FROM videos v
+            JOIN video_metrics m ON m.video_id = v.video_id
+            WHERE v.user_id = ?
+        ''', (user_id,)).fetchall()
+        return videos, rows
+
+    videos = conn.execute(f'SELECT video_id, video_name, views FROM user_{safe_id(user_id)}').fetchall()
+    return videos, _query_video_tables(conn, [video[0] for video in videos])
+
+
+def _query_video_tables(conn, video_ids):
+    """Return the metric rows of per-table layout videos, MAX_COMPOUND_SELECT tables per query."""
+    rows = []
+    for start in range(0, len(video_ids), MAX_COMPOUND_SELECT):
+        chunk = video_ids[start:start + MAX_COMPOUND_SELECT]
+        query = ' UNION ALL '.join(
+            f'SELECT ?, day, day_views, impressions, ctr, watchtime FROM video_metrics_{safe_id(video_id)}'
+            for video_id in chunk
+        )
+        rows += conn.execute(query, chunk).fetchall()
+    return rows
+
+
+def load_channel(conn, layout, user_id):
+    """Load one channel into a ChannelBlock, without caching it."""
+    videos, rows = _query_channel(conn, layout, user_id)
+    return ChannelBlock(videos, [video[0] for video in videos], rows)
+
+
+class AnalyticsCache:
+    """LRU cache of channel blocks, bounded by ``budget_mb`` of metric columns.
+
+    ``connection`` is a callable returning the (connection, layout) pair to
+    load from, such as graph_views.get_connection.
+    """
+
+    def __init__(self, connection, budget_mb=DEFAULT_BUDGET_MB):
+        self.connection = connection
+        self.budget = budget_mb * 2**20
+        self.blocks = OrderedDict()
+        # video_id -> key of the block holding it
+        self.video_blocks = {}
+        self.nbytes = 0
+        self.stats = {'hits': 0, 'loads': 0, 'evictions': 0}
+
+    def _store(self, key, block):
+        self.blocks[key] = block
+        self.nbytes += block.nbytes
+        for video_id in block.spans:
+            self.video_blocks[video_id] = key
+
+        # Never evict the block just loaded, even if it alone is over budget
+        while self.nbytes > self.budget and len(self.blocks) > 1:
+            old_key, old_block = self.blocks.popitem(last=False)
+            self._forget(old_key, old_block)
+            self.stats['evictions'] += 1
+        return block
+
+    def _forget(self, key, block):
+        self.nbytes -= block.nbytes
+        for video_id in block.spans:
+            if self.video_blocks.get(video_id) == key:
+                del self.video_blocks[video_id]
+
+    def _block(self, key):
+        block = self.blocks.get(key)
+        if block is not None:
+            self.blocks.move_to_end(key)
+            self.stats['hits'] += 1
+        return block
+
+    def channel(self, user_id):
+        """Return the block of a channel, loading it on first use."""
+        block = self._block(user_id)
+        if block is None:
+            block = self._store(user_id, load_channel(*self.connection(), user_id))
+            self.stats['loads'] += 1
+        return block
+
+    def _video_block(self, video_id):
+        """Return the block holding a video, loading its channel or the video alone."""
+        key = self.video_blocks.get(video_id)
+        if key is not None:
+            return self._block(key)
+
+        conn, layout = self.connection()
+        if layout == CONSOLIDATED_LAYOUT:
+            row = conn.execute('SELECT user_id FROM videos WHERE video_id = ?', (video_id,)).fetchone()
+            if row is not None:
+                return self.channel(row[0])
+
+        # The per-table layout has no video -> channel lookup, so cache just the video
+        block = self._store(('video', video_id), ChannelBlock(None, [video_id], _query_video_tables(conn, [video_id])))
+        self.stats['loads'] += 1
+        return block
+
+    def invalidate(self, user_id=None):
+        """Drop one channel's block, or everything."""
+        if user_id is None:
+            self.blocks.clear()
+            self.video_blocks.clear()
+            self.nbytes = 0
+            return
+        block = self.blocks.pop(user_id, None)
+        if block is not None:
+            self._forget(user_id, block)
+
+    def get_user_videos(self, user_id):
+        return self.channel(user_id).videos
+
+    def get_video_metric_arrays(self, video_id):
+        return self._video_block(video_id).metric_arrays(video_id)
+
+    def get_video_metrics(self, video_id):
+        days, day_views = self.get_video_metric_arrays(video_id)
+        return list(zip(np.datetime_as_string(days, unit='us').tolist(), day_views.tolist()))
+
+    def get_user_video_metric_arrays(self, user_id, video_ids):
+        block = self.channel(user_id)
+        return {video_id: block.metric_arrays(video_id) for video_id in video_ids}
+
+    def get_user_video_metrics(self, user_id, video_ids):
+        return {
+            video_id: list(zip(np.datetime_as_string(days, unit='us').tolist(), day_views.tolist()))
+            for video_id, (days, day_views) in self.get_user_video_metric_arrays(user_id, video_ids).items()
+        }
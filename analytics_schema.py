@@ -0,0 +1,90 @@
+"""Database locations and storage layouts shared by the Python scripts.
+
+The analytics database comes in two layouts:
+
+* ``per-table`` (the original, used by the Flutter app): one
+  ``user_<user_id>`` table of videos per channel and one
+  ``video_metrics_<video_id>`` table of daily metrics per video.
+* ``consolidated``: a single ``videos`` table keyed by video and indexed by
+  user, and a single ``video_metrics`` table keyed by (video_id, day).
+  ``video_metrics`` is a WITHOUT ROWID table, so its rows are stored in
+  key order: each video's days sit together in date order, and a date
+  range of one video is read as one contiguous range scan, without a sort.
+  ISO day strings sort in date order, so they serve as range keys as is.
+"""
+
+ANALYTICS_DB = 'lib/DB/youtube_analytics.db'
+LOGIN_DB = 'lib/login/login_users.db'
+
+PER_TABLE_LAYOUT = 'per-table'
+CONSOLIDATED_LAYOUT = 'consolidated'
+LAYOUTS = (PER_TABLE_LAYOUT, CONSOLIDATED_LAYOUT)
+
+# SQLite caps the number of SELECTs joined by UNION ALL in one statement,
+# so per-table layout queries and IN lists are issued in chunks of this size
+MAX_COMPOUND_SELECT = 500
+
+CONSOLIDATED_TABLES = (
+    '''
+    CREATE TABLE IF NOT EXISTS {prefix}videos (
+        video_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        video_name TEXT NOT NULL,
+        views INTEGER NOT NULL,
+        subs INTEGER NOT NULL,
+        revenue REAL NOT NULL,
+        comments INTEGER NOT NULL,
+        watchtime INTEGER NOT NULL,
+        creation_date TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS {prefix}video_metrics (
+        video_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        metric_id TEXT NOT NULL,
+        day_views INTEGER NOT NULL,
+        impressions INTEGER NOT NULL,
+        ctr REAL NOT NULL,
+        watchtime INTEGER NOT NULL,
+        PRIMARY KEY (video_id, day)
+    ) WITHOUT ROWID
+    ''',
+)
+
+# Covering indexes for the graph queries. They are created after a bulk
+# load rather than maintained row by row during it. video_metrics needs
+# none, being stored in the order of its key.
+CONSOLIDATED_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_videos_user ON videos (user_id, video_id, video_name, views)',
+)
+
+
+def safe_id(uuid_string):
+    """Return a UUID in the form used in per-table layout table names."""
+    return uuid_string.replace('-', '_')
+
+
+def create_consolidated_tables(conn, prefix=''):
+    """Create the consolidated videos and video_metrics tables, their names prefixed by ``prefix``."""
+    for statement in CONSOLIDATED_TABLES:
+        conn.execute(statement.format(prefix=prefix))
+
+
+def create_consolidated_indexes(conn):
+    """Create the covering indexes of the consolidated layout."""
+    for statement in CONSOLIDATED_INDEXES:
+        conn.execute(statement)
+
+
+def detect_layout(conn):
+    """Return the storage layout of an open analytics database.
+
+    A database that has the consolidated ``video_metrics`` table is read as
+    consolidated, even if old per-table tables are still around.
+    """
+    # PRAGMA table_info is a lookup in the parsed schema rather than a scan
+    # of sqlite_master, which matters with millions of per-table tables.
+    if conn.execute('PRAGMA table_info(video_metrics)').fetchone() is not None:
+        return CONSOLIDATED_LAYOUT
+    return PER_TABLE_LAYOUT
@@ -0,0 +1,416 @@
+"""Benchmarks for data generation, ingestion, queries, Parquet export and graph rendering.
+
+Each benchmark runs against temporary databases at one or more dataset
+scales and records throughput (rows/s, queries/s), wall time and peak
+Python memory. Results can be saved as a baseline JSON file and later runs
+compared against it:
+
+    python benchmarks.py --scales small,medium --save-baseline benchmark_baseline.json
+    python benchmarks.py --scales small,medium --baseline benchmark_baseline.json --threshold 0.2
+
+A run exits with status 1 if any metric regressed by more than the
+threshold. Everything runs offline with the headless Agg backend.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import matplotlib
+
+matplotlib.use('Agg')
+
+import numpy as np
+
+import generate_dummy_data
+import graph_views
+from analytics_schema import CONSOLIDATED_LAYOUT, PER_TABLE_LAYOUT
+from credentials import DEFAULT_PASSWORD, CredentialHasher, hash_password, verify_login
+from db_connections import connect_reader, connect_writer
+
+# users, videos per user, days per video
+SCALES = {
+    'small': (5, 5, 30),
+    'medium': (50, 20, 90),
+    'large': (200, 50, 365),
+}
+
+# Metrics where a larger value is better; for all others smaller is better
+HIGHER_IS_BETTER = ('rows_per_sec', 'queries_per_sec')
+
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_MAX_PLOTS = 2
+MAX_METRIC_QUERIES = 2000
+DEFAULT_CACHE_MB = 256
+HASH_SCHEME = 'scrypt'
+# Login accounts per generated user, so lookups search a realistically sized index
+LOGINS_PER_USER = 1000
+# Each check of a slow hash takes tens of milliseconds
+MAX_SLOW_LOGIN_CHECKS = 20
+SEED = 1234
+# Channels in the Parquet export benchmark: more than the 1024 partitions
+# Arrow writes from one batch by default, so an export that mixes channels
+# in a batch fails here
+EXPORT_SCALE = (1100, 1, 30)
+
+# Timed runs per benchmark; set from --repeat
+REPEAT = 3
+
+
+def measure(run, track_memory=True):
+    """Time ``run()`` and optionally measure its peak traced memory.
+
+    The best of REPEAT timed runs is kept to damp noise. Memory is measured
+    in a separate run, since tracemalloc slows Python code down enough to
+    distort the timing. ``run`` returns the number of units (rows, queries,
+    plots) it processed.
+    """
+    seconds = float('inf')
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        units = run()
+        seconds = min(seconds, time.perf_counter() - started)
+
+    result = {'seconds': round(seconds, 4)}
+    if track_memory:
+        tracemalloc.start()
+        run()
+        result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+        tracemalloc.stop()
+    return units, result
+
+
+def with_rate(units, result, unit_name):
+    """Add a units-per-second entry to a measurement."""
+    result[f'{unit_name}_per_sec'] = round(units / result['seconds'], 1) if result['seconds'] > 0 else 0.0
+    return result
+
+
+def seed_database(workdir, scale, layout):
+    """Generate a dataset into fresh databases and return the analytics db path."""
+    num_users, videos_per_user, days = scale
+    tag = f'{layout}_{time.perf_counter_ns()}'
+    analytics_db = os.path.join(workdir, f'analytics_{tag}.db')
+    login_db = os.path.join(workdir, f'login_{tag}.db')
+    generate_dummy_data.create_tables(analytics_db, login_db, layout)
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate_dummy_data.insert_data(
+            num_users=num_users, videos_per_user=videos_per_user, days_per_video=days,
+            analytics_db=analytics_db, login_db=login_db, seed=SEED,
+            as_of=datetime(2025, 1, 1), layout=layout,
+        )
+    return analytics_db
+
+
+def bench_generate_video_metrics(scale, track_memory):
+    """Per-video generate_video_metrics calls for every video of the dataset."""
+    num_users, videos_per_user, days = scale
+
+    def run():
+        for _ in range(num_users * videos_per_user):
+            generate_dummy_data.generate_video_metrics(100000, 6000000, '2025-01-01T00:00:00', days)
+        return num_users * videos_per_user * days
+
+    return with_rate(*measure(run, track_memory), 'rows')
+
+
+def bench_generate_video_metrics_batch(scale, track_memory):
+    """Batched metric generation, one batch per user as insert_data does it."""
+    num_users, videos_per_user, days = scale
+    views = [100000] * videos_per_user
+    watchtime = [6000000] * videos_per_user
+    dates = ['2025-01-01T00:00:00'] * videos_per_user
+
+    def run():
+        rng = np.random.default_rng(SEED)
+        for _ in range(num_users):
+            generate_dummy_data.generate_video_metrics_batch(views, watchtime, dates, days, rng)
+        return num_users * videos_per_user * days
+
+    return with_rate(*measure(run, track_memory), 'rows')
+
+
+def bench_insert_data(scale, track_memory, workdir, layout):
+    """Full seed of both databases with insert_data."""
+    num_users, videos_per_user, days = scale
+
+    def run():
+        seed_database(workdir, scale, layout)
+        # users + logins + videos + metric rows
+        return num_users * (2 + videos_per_user * (1 + days))
+
+    return with_rate(*measure(run, track_memory), 'rows')
+
+
+def bench_get_video_metrics(track_memory, analytics_db):
+    """One get_video_metrics query per video, on a shared connection."""
+    previous_db = graph_views.ANALYTICS_DB
+    graph_views.ANALYTICS_DB = analytics_db
+    video_ids = [
+        video[0]
+        for user in graph_views.get_all_users()
+        for video in graph_views.get_user_videos(user[0])
+    ][:MAX_METRIC_QUERIES]
+
+    def run():
+        for video_id in video_ids:
+            graph_views.get_video_metrics(video_id)
+        return len(video_ids)
+
+    try:
+        return with_rate(*measure(run, track_memory), 'queries')
+    finally:
+        graph_views.close_connections()
+        graph_views.ANALYTICS_DB = previous_db
+
+
+def bench_get_user_video_metrics(track_memory, analytics_db):
+    """Batched metric reads of each user's videos."""
+    previous_db = graph_views.ANALYTICS_DB
+    graph_views.ANALYTICS_DB = analytics_db
+    users = [
+        (user[0], [video[0] for video in graph_views.get_user_videos(user[0])])
+        for user in graph_views.get_all_users()
+    ]
+
+    def run():
+        rows = 0
+        for user_id, video_ids in users:
+            rows += sum(len(m) for m in graph_views.get_user_video_metrics(user_id, video_ids).values())
+        return rows
+
+    try:
+        return with_rate(*measure(run, track_memory), 'rows')
+    finally:
+        graph_views.close_connections()
+        graph_views.ANALYTICS_DB = previous_db
+
+
+def bench_cached_video_metrics(track_memory, analytics_db):
+    """get_video_metrics per video served from a warm analytics cache."""
+    previous_db = graph_views.ANALYTICS_DB
+    graph_views.ANALYTICS_DB = analytics_db
+    graph_views.use_cache(DEFAULT_CACHE_MB)
+    video_ids = [
+        video[0]
+        for user in graph_views.get_all_users()
+        for video in graph_views.get_user_videos(user[0])
+    ][:MAX_METRIC_QUERIES]
+
+    def run():
+        for video_id in video_ids:
+            graph_views.get_video_metrics(video_id)
+        return len(video_ids)
+
+    try:
+        return with_rate(*measure(run, track_memory), 'queries')
+    finally:
+        graph_views._cache = None
+        graph_views.close_connections()
+        graph_views.ANALYTICS_DB = previous_db
+
+
+def bench_plot_user_videos(track_memory, analytics_db, workdir, max_plots, renderer='standard'):
+    """Render the video plots of the first few users."""
+    previous_db, previous_graphs_dir = graph_views.ANALYTICS_DB, graph_views.GRAPHS_DIR
+    graph_views.ANALYTICS_DB = analytics_db
+    graph_views.GRAPHS_DIR = os.path.join(workdir, 'graphs')
+
+    def run():
+        for user_id, user_name, channel_name in users:
+            graph_views.plot_user_videos(user_id, user_name, channel_name, renderer=renderer)
+        return len(users)
+
+    try:
+        users = graph_views.get_all_users()[:max_plots]
+        units, result = measure(run, track_memory)
+        result['seconds_per_plot'] = round(result['seconds'] / max(units, 1), 4)
+        return result
+    finally:
+        graph_views.close_connections()
+        graph_views.ANALYTICS_DB, graph_views.GRAPHS_DIR = previous_db, previous_graphs_dir
+
+
+def bench_export_parquet(track_memory, workdir, layout):
+    """Export a database with more channels than Arrow's default partition limit to Parquet."""
+    from parquet_store import export_database
+
+    analytics_db = seed_database(workdir, EXPORT_SCALE, layout)
+    out_dir = os.path.join(workdir, f'parquet_{layout}')
+    num_users, videos_per_user, days = EXPORT_SCALE
+
+    def run():
+        export_database(out_dir, analytics_db)
+        return num_users * videos_per_user * days
+
+    return with_rate(*measure(run, track_memory), 'rows')
+
+
+def bench_hash_passwords(scale, track_memory, scheme=HASH_SCHEME):
+    """Hash one password per user in a CredentialHasher pool, as a seed does."""
+    num_users = scale[0]
+
+    def run():
+        with CredentialHasher(scheme) as hasher:
+            hasher.submit([DEFAULT_PASSWORD] * num_users).get()
+        return num_users
+
+    return with_rate(*measure(run, track_memory), 'rows')
+
+
+def seed_login_database(workdir, num_accounts, scheme):
+    """Fill a fresh login database with accounts sharing one stored password."""
+    login_db = os.path.join(workdir, f'login_{scheme}_{time.perf_counter_ns()}.db')
+    stored = hash_password(DEFAULT_PASSWORD, scheme)
+    conn = connect_writer(login_db, bulk=True)
+    try:
+        generate_dummy_data.create_login_tables(conn)
+        conn.executemany('INSERT INTO login_users (username, password) VALUES (?, ?)',
+                         ((f'user_{i}', stored) for i in range(num_accounts)))
+        conn.commit()
+    finally:
+        conn.close()
+    return login_db
+
+
+def bench_verify_login(scale, track_memory, workdir, scheme):
+    """Username lookups through the unique index, each followed by a password check."""
+    num_accounts = scale[0] * LOGINS_PER_USER
+    checks = MAX_METRIC_QUERIES if scheme == 'plain' else MAX_SLOW_LOGIN_CHECKS
+    step = max(1, num_accounts // checks)
+    usernames = [f'user_{i}' for i in range(0, num_accounts, step)][:checks]
+    conn = connect_reader(seed_login_database(workdir, num_accounts, scheme))
+
+    def run():
+        for username in usernames:
+            if not verify_login(conn, username, DEFAULT_PASSWORD):
+                raise RuntimeError(f"Login check failed for {username}")
+        return len(usernames)
+
+    try:
+        return with_rate(*measure(run, track_memory), 'queries')
+    finally:
+        conn.close()
+
+
+def run_scale(name, track_memory, max_plots):
+    """Run every benchmark at one scale and return their results."""
+    scale = SCALES[name]
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        results['generate_video_metrics'] = bench_generate_video_metrics(scale, track_memory)
+        results['generate_video_metrics_batch'] = bench_generate_video_metrics_batch(scale, track_memory)
+        for layout in (PER_TABLE_LAYOUT, CONSOLIDATED_LAYOUT):
+            results[f'insert_data[{layout}]'] = bench_insert_data(scale, track_memory, workdir, layout)
+        results[f'hash_passwords[{HASH_SCHEME}]'] = bench_hash_passwords(scale, track_memory)
+        for scheme in ('plain', HASH_SCHEME):
+            results[f'verify_login[{scheme}]'] = bench_verify_login(scale, track_memory, workdir, scheme)
+
+        for layout in (PER_TABLE_LAYOUT, CONSOLIDATED_LAYOUT):
+            analytics_db = seed_database(workdir, scale, layout)
+            results[f'get_video_metrics[{layout}]'] = bench_get_video_metrics(track_memory, analytics_db)
+            results[f'get_user_video_metrics[{layout}]'] = bench_get_user_video_metrics(track_memory, analytics_db)
+            results[f'get_video_metrics[{layout},cache]'] = bench_cached_video_metrics(track_memory, analytics_db)
+            results[f'export_parquet[{layout}]'] = bench_export_parquet(track_memory, workdir, layout)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            results['plot_user_videos'] = bench_plot_user_videos(track_memory, analytics_db, workdir, max_plots)
+            results['plot_user_videos[fast]'] = bench_plot_user_videos(
+                track_memory, analytics_db, workdir, max_plots, 'fast'
+            )
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return a list of (scale, benchmark, metric, baseline, current, change) regressions."""
+    regressions = []
+    for scale, benchmarks in results.items():
+        for bench, metrics in benchmarks.items():
+            base_metrics = baseline.get(scale, {}).get(bench, {})
+            for metric, value in metrics.items():
+                base = base_metrics.get(metric)
+                if not base:
+                    continue
+                if metric.endswith(HIGHER_IS_BETTER):
+                    change = (base - value) / base
+                else:
+                    change = (value - base) / base
+                if change > threshold:
+                    regressions.append((scale, bench, metric, base, value, change))
+    return regressions
+
+
+def print_results(results):
+    """Print results as one line per benchmark."""
+    for scale, benchmarks in results.items():
+        users, videos, days = SCALES[scale]
+        print(f"\n{scale}: {users} users x {videos} videos x {days} days")
+        for bench, metrics in benchmarks.items():
+            values = ', '.join(f'{k}={v:,}' for k, v in metrics.items())
+            print(f"  {bench:<42} {values}")
+
+
+def main(argv=None):
+    """Run the benchmarks and compare them against a baseline."""
+    global REPEAT
+    parser = argparse.ArgumentParser(description='Benchmark generation, ingestion, queries and rendering.')
+    parser.add_argument('--scales', default='small,medium',
+                        help=f'comma-separated scales to run ({", ".join(SCALES)})')
+    parser.add_argument('--max-plots', type=int, default=DEFAULT_MAX_PLOTS,
+                        help='number of user plots rendered per scale')
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help='timed runs per benchmark, the fastest is kept')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the tracemalloc runs that measure peak memory')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--save-baseline', metavar='PATH', help='save the results as the baseline')
+    parser.add_argument('--baseline', metavar='PATH', help='compare against this baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative change counted as a regression (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+    REPEAT = args.repeat
+
+    scales = [s.strip() for s in args.scales.split(',') if s.strip()]
+    unknown = [s for s in scales if s not in SCALES]
+    if unknown:
+        parser.error(f"unknown scale(s): {', '.join(unknown)}")
+
+    results = {}
+    for scale in scales:
+        print(f"Running {scale} benchmarks...")
+        results[scale] = run_scale(scale, not args.no_memory, args.max_plots)
+    print_results(results)
+
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for scale, bench, metric, base, value, change in regressions:
+                print(f"  {scale} {bench} {metric}: {base:,} -> {value:,} ({change:+.0%} worse)")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.threshold:.0%} against {args.baseline}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Salted password hashes for the login database.
+
+The Flutter app's ``verifyUser`` compares the stored password with the
+typed one, so the seeder stores plaintext by default. For auth load
+testing, ``generate_dummy_data.py --password-hash SCHEME`` stores salted,
+deliberately slow hashes instead, computed in a pool of processes so a
+large seed uses every core:
+
+* ``scrypt`` and ``pbkdf2_sha256`` (from hashlib, always available),
+  stored as ``scheme$parameters$salt$hash`` with base64 salt and hash
+* ``bcrypt`` and ``argon2``, if the ``bcrypt`` / ``argon2-cffi`` packages
+  are installed, stored in their own standard formats
+
+``verify_password`` recognises every format, so a login lookup works
+whatever scheme the database was seeded with:
+
+    python credentials.py --login-db lib/login/login_users.db Lelouch 'Umer@12g'
+"""
+import argparse
+import base64
+import functools
+import hashlib
+import hmac
+import importlib
+import multiprocessing
+import os
+import sys
+
+from analytics_schema import LOGIN_DB
+from db_connections import connect_reader
+
+DEFAULT_PASSWORD = 'Umer@12g'
+
+HASH_SCHEMES = ('plain', 'scrypt', 'pbkdf2_sha256', 'bcrypt', 'argon2')
+DEFAULT_HASH_SCHEME = 'plain'
+
+# Schemes that need an optional package, and the module it installs
+OPTIONAL_BACKENDS = {'bcrypt': 'bcrypt', 'argon2': 'argon2'}
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+# scrypt needs 128 * n * r bytes, 16 MiB here
+SCRYPT_N = 2**14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600_000
+BCRYPT_ROUNDS = 12
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=2 * 128 * n * r, dklen=HASH_BYTES)
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations, dklen=HASH_BYTES)
+
+
+def scheme_available(scheme):
+    """Return whether ``scheme`` is known and its backend can be imported."""
+    if scheme not in HASH_SCHEMES:
+        return False
+    module = OPTIONAL_BACKENDS.get(scheme)
+    if module is None:
+        return True
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        return False
+    return True
+
+
+def available_schemes():
+    """Return the schemes of HASH_SCHEMES that can be used in this environment."""
+    return tuple(scheme for scheme in HASH_SCHEMES if scheme_available(scheme))
+
+
+def hash_password(password, scheme=DEFAULT_HASH_SCHEME):
+    """Return the stored form of ``password`` under ``scheme``, with a fresh random salt."""
+    if scheme == 'plain':
+        return password
+    if scheme == 'scrypt':
+        salt = os.urandom(SALT_BYTES)
+        digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}'
+    if scheme == 'pbkdf2_sha256':
+        salt = os.urandom(SALT_BYTES)
+        return f'pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64(salt)}${_b64(_pbkdf2(password, salt, PBKDF2_ITERATIONS))}'
+    if scheme == 'bcrypt':
+        import bcrypt
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('ascii')
+    if scheme == 'argon2':
+        from argon2 import PasswordHasher
+        return PasswordHasher().hash(password)
+    raise ValueError(f"Unknown password hash scheme: {scheme}")
+
+
+def verify_password(password, stored):
+    """Return whether ``password`` matches a stored password of any scheme.
+
+    A stored value that starts like a hash but does not parse as one is a
+    legacy plaintext password and is compared as typed.
+    """
+    try:
+        if stored.startswith('scrypt$'):
+            n, r, p, salt, digest = stored.split('$')[1:]
+            candidate = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+            return hmac.compare_digest(candidate, base64.b64decode(digest))
+        if stored.startswith('pbkdf2_sha256$'):
+            iterations, salt, digest = stored.split('$')[1:]
+            candidate = _pbkdf2(password, base64.b64decode(salt), int(iterations))
+            return hmac.compare_digest(candidate, base64.b64decode(digest))
+        if stored.startswith(('$2a$', '$2b$', '$2y$')):
+            import bcrypt
+            return bcrypt.checkpw(password.encode(), stored.encode())
+        if stored.startswith('$argon2'):
+            from argon2 import PasswordHasher
+            from argon2.exceptions import VerificationError
+            try:
+                return PasswordHasher().verify(stored, password)
+            except VerificationError:
+                return False
+    except (ValueError, IndexError, OverflowError):
+        pass
+    return hmac.compare_digest(password.encode(), stored.encode())
+
+
+def verify_login(conn, username, password):
+    """Look a user up through the unique username index and check the password."""
+    row = conn.execute('SELECT password FROM login_users WHERE username = ?', (username,)).fetchone()
+    return row is not None and verify_password(password, row[0])
+
+
+class _Ready:
+    """A result computed in-process, with the same ``get`` as a pool's."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class CredentialHasher:
+    """Hashes batches of passwords in a pool of ``workers`` processes.
+
+    ``submit`` starts hashing a batch and returns at once; its ``get()``
+    returns the stored passwords in order. Plaintext, or a single worker,
+    is done in-process without a pool. Raises ValueError up front if the
+    scheme's backend is not installed.
+    """
+
+    def __init__(self, scheme=DEFAULT_HASH_SCHEME, workers=None):
+        if not scheme_available(scheme):
+            raise ValueError(f"Password hash scheme {scheme!r} is not available; "
+                             f"install its package or choose one of {', '.join(available_schemes())}")
+        self.scheme = scheme
+        self.workers = workers or os.cpu_count() or 1
+        self.hash = functools.partial(hash_password, scheme=scheme)
+        self.pool = None
+        if scheme != 'plain' and self.workers > 1:
+            self.pool = multiprocessing.get_context().Pool(self.workers)
+
+    def submit(self, passwords):
+        if self.pool is None:
+            return _Ready([self.hash(password) for password in passwords])
+        chunksize = max(1, len(passwords) // (4 * self.workers))
+        return self.pool.map_async(self.hash, passwords, chunksize)
+
+    def close(self):
+        """Wait for pending hashes and stop the pool."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def terminate(self):
+        """Stop the pool at once, dropping any pending hashes."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is not None:
+            self.terminate()
+        else:
+            self.close()
+
+
+def main(argv=None):
+    """Check one login against the login database."""
+    parser = argparse.ArgumentParser(description='Check a username and password against the login database.')
+    parser.add_argument('--login-db', default=LOGIN_DB,
+                        help='path to the login database')
+    parser.add_argument('username')
+    parser.add_argument('password')
+    args = parser.parse_args(argv)
+
+    conn = connect_reader(args.login_db)
+    try:
+        ok = verify_login(conn, args.username, args.password)
+    finally:
+        conn.close()
+    print('Login OK' if ok else 'Login failed')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""Shared SQLite connection settings for the analytics and login databases.
+
+Writers put a database in WAL mode (the setting is stored in the file), so
+readers - graph_views.py, the exporters and the Flutter app - keep reading
+the last committed snapshot while a seed, an append or the ingestion
+service writes, instead of waiting for the writer's lock. Every connection
+also gets memory-mapped I/O, a larger page cache and a busy timeout.
+
+* ``connect_reader`` opens a read-only ``mode=ro`` URI connection
+* ``connect_writer`` opens a read-write connection in WAL mode; with
+  ``bulk=True`` it also turns off fsync and the automatic checkpoints, to
+  be driven by a ``CheckpointScheduler`` instead
+* ``with_busy_retry`` retries an operation that failed with SQLITE_BUSY,
+  which the busy timeout cannot cover when a read transaction has to be
+  upgraded to a write
+"""
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import profiling
+
+BUSY_TIMEOUT = 30.0
+MMAP_SIZE = 256 * 2**20
+CACHE_SIZE_KIB = 64 * 2**10
+BULK_CACHE_SIZE_KIB = 256 * 2**10
+
+# Pages of WAL after which a scheduled checkpoint runs, about 16 MiB with 4 KiB pages
+CHECKPOINT_PAGES = 4096
+CHECKPOINT_INTERVAL = 10.0
+
+# Seconds to wait for other connections when checking whether a database is in use
+IN_USE_TIMEOUT = 0.5
+
+BUSY_RETRIES = 5
+BUSY_RETRY_DELAY = 0.05
+
+READER_PRAGMAS = (
+    f'PRAGMA mmap_size = {MMAP_SIZE}',
+    f'PRAGMA cache_size = -{CACHE_SIZE_KIB}',
+)
+
+WRITER_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    # In WAL mode NORMAL only syncs at checkpoints and is still corruption-safe
+    'PRAGMA synchronous = NORMAL',
+    f'PRAGMA mmap_size = {MMAP_SIZE}',
+    f'PRAGMA cache_size = -{CACHE_SIZE_KIB}',
+)
+
+# A bulk load trades durability of the last commits for speed, and leaves
+# checkpoints to a CheckpointScheduler
+BULK_WRITER_PRAGMAS = (
+    'PRAGMA synchronous = OFF',
+    f'PRAGMA cache_size = -{BULK_CACHE_SIZE_KIB}',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA wal_autocheckpoint = 0',
+)
+
+
+def _apply(conn, pragmas):
+    for pragma in pragmas:
+        conn.execute(pragma).fetchall()
+
+
+def connect_reader(db_path, timeout=BUSY_TIMEOUT, **kwargs):
+    """Open a read-only connection that never blocks or is blocked by a WAL writer."""
+    uri = f'{Path(db_path).resolve().as_uri()}?mode=ro'
+    conn = profiling.connect(uri, uri=True, timeout=timeout, **kwargs)
+    _apply(conn, READER_PRAGMAS)
+    return conn
+
+
+def connect_writer(db_path, timeout=BUSY_TIMEOUT, bulk=False, **kwargs):
+    """Open a read-write connection in WAL mode, tuned for bulk loads with ``bulk``."""
+    conn = profiling.connect(db_path, timeout=timeout, **kwargs)
+    with_busy_retry(_apply, conn, WRITER_PRAGMAS)
+    if bulk:
+        _apply(conn, BULK_WRITER_PRAGMAS)
+    return conn
+
+
+def database_in_use(db_path, timeout=IN_USE_TIMEOUT):
+    """Return whether a database file may be open in another connection.
+
+    Taking an exclusive lock fails while anyone else reads or writes, and
+    reading the header under it rolls back a hot journal left by a crash.
+    WAL readers do not block the lock, but a database only leaves WAL mode
+    when no other connection has it open, which also removes a WAL file
+    left behind by read-only connections. A WAL database is switched back
+    to WAL right away, so the probe leaves its journal mode as it was.
+    Nothing here touches the schema, which would mean parsing every table
+    definition.
+    """
+    conn = profiling.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        conn.execute('BEGIN EXCLUSIVE')
+        conn.execute('PRAGMA user_version').fetchone()
+        conn.execute('ROLLBACK')
+        if conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+            conn.execute('PRAGMA journal_mode = DELETE').fetchone()
+            conn.execute('PRAGMA journal_mode = WAL').fetchone()
+    except sqlite3.OperationalError:
+        return True
+    finally:
+        conn.close()
+    return os.path.exists(db_path + '-wal')
+
+
+def _is_busy(error):
+    message = str(error)
+    return 'locked' in message or 'busy' in message
+
+
+def with_busy_retry(operation, *args, retries=BUSY_RETRIES, delay=BUSY_RETRY_DELAY):
+    """Call ``operation(*args)``, retrying with exponential backoff while the database is busy."""
+    for attempt in range(retries + 1):
+        try:
+            return operation(*args)
+        except sqlite3.OperationalError as e:
+            if attempt == retries or not _is_busy(e):
+                raise
+            time.sleep(delay * 2**attempt)
+
+
+class CheckpointScheduler:
+    """Checkpoints a writer's WAL between transactions.
+
+    Call ``after_commit`` after each commit: once the WAL file has grown by
+    ``max_pages`` since the last checkpoint or ``interval`` seconds have
+    passed, a PASSIVE checkpoint copies what it can back into the database
+    without waiting for readers. (A checkpoint lets the WAL be rewritten
+    from its start rather than shrinking the file, so growth of the file
+    misses writes that reuse it; the interval covers those.)
+    ``close`` runs a final TRUNCATE checkpoint that also empties the WAL
+    file, if no reader is still using it.
+    """
+
+    def __init__(self, conn, db_path, max_pages=CHECKPOINT_PAGES, interval=CHECKPOINT_INTERVAL):
+        self.conn = conn
+        self.wal_path = f'{db_path}-wal'
+        self.max_bytes = max_pages * conn.execute('PRAGMA page_size').fetchone()[0]
+        self.interval = interval
+        self.last_checkpoint = time.monotonic()
+        self.wal_bytes_at_checkpoint = self._wal_bytes()
+        self.checkpoints = 0
+
+    def _wal_bytes(self):
+        try:
+            return os.path.getsize(self.wal_path)
+        except OSError:
+            return 0
+
+    def after_commit(self):
+        """Checkpoint if the WAL is large or the last checkpoint is old enough."""
+        grown = self._wal_bytes() - self.wal_bytes_at_checkpoint
+        if time.monotonic() - self.last_checkpoint < self.interval and grown < self.max_bytes:
+            return
+        self.checkpoint('PASSIVE')
+
+    def checkpoint(self, mode='PASSIVE'):
+        """Run a checkpoint and return (busy, WAL frames, frames checkpointed)."""
+        with profiling.span('db.checkpoint'):
+            result = self.conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+        self.last_checkpoint = time.monotonic()
+        self.wal_bytes_at_checkpoint = self._wal_bytes()
+        self.checkpoints += 1
+        return result
+
+    def close(self):
+        """Checkpoint everything and truncate the WAL file."""
+        return self.checkpoint('TRUNCATE')
@@ -0,0 +1,209 @@
+"""Fast rendering of the per-video view plots for daily regeneration.
+
+The standard renderer in graph_views.py builds a new figure per page, draws
+every day as a marker, runs ``tight_layout`` and writes a 300 dpi PNG. This
+renderer instead:
+
+* keeps a preallocated figure for each recently used page size, with
+  fixed margins and one line artist per subplot, and only swaps the line
+  data (``set_data``), titles and axis limits between pages
+* downsamples long series with Largest-Triangle-Three-Buckets (LTTB) to
+  one point per two horizontal pixels, which keeps spikes and dips
+* writes cheaper outputs: a lower-dpi PNG, an SVG, or a JSON file of the
+  downsampled series in the shape of the Flutter ``buildLineChart`` widget
+  (``totalDays``, ``viewsPerDay``, ``dates``) without drawing at all
+"""
+import json
+from collections import OrderedDict
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+FAST_FORMATS = ('png', 'svg', 'json')
+FAST_DPI = 100
+# Figure width in inches; series are downsampled to one point per two pixels
+FIGURE_WIDTH = 12
+ROW_HEIGHT = 3
+DEFAULT_JSON_POINTS = 365
+X_TICKS = 6
+Y_TICKS = 5
+# Page sizes whose figures are kept; the least recently used is closed beyond this
+MAX_TEMPLATES = 4
+
+_EPOCH = np.datetime64('1970-01-01T00:00:00', 'us')
+
+
+def lttb(x, y, threshold):
+    """Return indices of ``threshold`` points of (x, y) chosen by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. Of every bucket in between,
+    the point forming the largest triangle with the previous kept point and
+    the average of the next bucket is kept, which preserves peaks and
+    troughs far better than taking every n-th point.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_stop = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[stop:next_stop].mean() if next_stop > stop else x[-1]
+        next_y = y[stop:next_stop].mean() if next_stop > stop else y[-1]
+
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:stop] - y[previous])
+            - (x[previous] - x[start:stop]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def _day_numbers(days):
+    """Return days as Matplotlib date numbers (days since 1970-01-01)."""
+    return (np.asarray(days, dtype='datetime64[us]') - _EPOCH) / np.timedelta64(1, 'D')
+
+
+def downsample(days, views, points):
+    """Return (days, views) reduced to at most ``points`` points with LTTB."""
+    days = np.asarray(days, dtype='datetime64[us]')
+    views = np.asarray(views)
+    if len(days) <= points:
+        return days, views
+    keep = lttb(_day_numbers(days), views, points)
+    return days[keep], views[keep]
+
+
+class PageTemplate:
+    """A reusable figure with ``rows`` subplots and their line artists."""
+
+    def __init__(self, rows, dpi=FAST_DPI):
+        self.rows = rows
+        self.max_points = FIGURE_WIDTH * dpi // 2
+        self.fig, axes = plt.subplots(rows, 1, figsize=(FIGURE_WIDTH, ROW_HEIGHT * rows), squeeze=False)
+        self.axes = axes[:, 0]
+        # Fixed margins in inches, instead of measuring text with tight_layout
+        height = ROW_HEIGHT * rows
+        self.fig.subplots_adjust(left=0.08, right=0.96, top=1 - 0.8 / height, bottom=0.5 / height, hspace=0.55)
+        self.suptitle = self.fig.suptitle('', fontsize=14)
+
+        self.lines, self.averages, self.flags, self.titles = [], [], [], []
+        for ax in self.axes:
+            self.lines.append(ax.plot([], [], linewidth=1.2)[0])
+            self.averages.append(ax.plot([], [], linewidth=1.8)[0])
+            self.flags.append(ax.plot([], [], linestyle='none', marker='o', markersize=4, color='tab:red')[0])
+            self.titles.append(ax.set_title('', fontsize=10))
+            ax.set_ylabel('Daily Views')
+            ax.grid(True, linestyle='--', alpha=0.7)
+
+    def draw(self, title, videos, all_metrics, windows=None):
+        """Point the template's artists at one page of videos."""
+        self.suptitle.set_text(title)
+        for index, (ax, (video_id, video_name, total_views)) in enumerate(zip(self.axes, videos)):
+            days, views = downsample(*all_metrics[video_id], self.max_points)
+            x = _day_numbers(days)
+            self.lines[index].set_data(x, views)
+            self.titles[index].set_text(f'{video_name} (Total Views: {total_views:,})')
+
+            average_x = flag_x = average = flag_views = ()
+            if windows is not None:
+                avg_days, average, spike_days, spike_views, dip_days, dip_views = windows.overlay(video_id)
+                average_x = _day_numbers(avg_days)
+                flag_x = _day_numbers(np.concatenate([spike_days, dip_days]))
+                flag_views = np.concatenate([spike_views, dip_views])
+            self.averages[index].set_data(average_x, average)
+            self.flags[index].set_data(flag_x, flag_views)
+
+            if len(x):
+                self._set_limits(ax, x, views)
+            else:
+                self._clear_limits(ax)
+        return self.fig
+
+    @staticmethod
+    def _clear_limits(ax):
+        """Drop the limits and ticks left by the previous page, for a video without metrics."""
+        ax.set_xlim(0, 1)
+        ax.set_ylim(0, 1)
+        ax.set_xticks([])
+        ax.set_yticks([])
+
+    @staticmethod
+    def _set_limits(ax, x, views):
+        """Set axis limits and a few evenly spaced ticks, skipping Matplotlib's tick locators."""
+        ax.set_xlim(x[0] - 1, x[-1] + 1)
+        x_ticks = np.unique(np.round(np.linspace(x[0], x[-1], X_TICKS)))
+        tick_days = _EPOCH.astype('datetime64[D]') + x_ticks.astype(np.int64)
+        ax.set_xticks(x_ticks, np.datetime_as_string(tick_days, unit='D').tolist())
+
+        top = max(float(np.max(views)), 1.0)
+        ax.set_ylim(0, top * 1.05)
+        y_ticks = np.linspace(0, top, Y_TICKS)
+        ax.set_yticks(y_ticks, [f'{tick:,.0f}' for tick in y_ticks])
+
+
+class FastRenderer:
+    """Renders pages through PageTemplates kept for the MAX_TEMPLATES most recent page sizes."""
+
+    def __init__(self, dpi=FAST_DPI, json_points=DEFAULT_JSON_POINTS, max_templates=MAX_TEMPLATES):
+        self.dpi = dpi
+        self.json_points = json_points
+        self.max_templates = max_templates
+        self.templates = OrderedDict()
+
+    def template(self, rows):
+        if rows in self.templates:
+            self.templates.move_to_end(rows)
+            return self.templates[rows]
+        if len(self.templates) >= self.max_templates:
+            _, evicted = self.templates.popitem(last=False)
+            plt.close(evicted.fig)
+        self.templates[rows] = PageTemplate(rows, self.dpi)
+        return self.templates[rows]
+
+    def render_page(self, path, title, videos, all_metrics, output_format='png', windows=None):
+        """Write one page of videos to ``path`` as PNG, SVG or JSON."""
+        if output_format == 'json':
+            write_series_json(path, title, videos, all_metrics, self.json_points)
+            return
+        fig = self.template(len(videos)).draw(title, videos, all_metrics, windows)
+        if output_format == 'png':
+            # zlib's fastest level; the plots are mostly flat colour
+            fig.savefig(path, format='png', dpi=self.dpi, pil_kwargs={'compress_level': 1})
+        else:
+            fig.savefig(path, format=output_format, dpi=self.dpi)
+
+    def close(self):
+        for template in self.templates.values():
+            plt.close(template.fig)
+        self.templates.clear()
+
+
+def series_json(title, videos, all_metrics, points=DEFAULT_JSON_POINTS):
+    """Return downsampled series of a page of videos in the line chart widget's shape."""
+    series = []
+    for video_id, video_name, total_views in videos:
+        days, views = downsample(*all_metrics[video_id], points)
+        series.append({
+            'videoId': video_id,
+            'videoName': video_name,
+            'totalViews': total_views,
+            'totalDays': len(views),
+            'viewsPerDay': np.asarray(views).astype(np.int64).tolist(),
+            'dates': np.datetime_as_string(days, unit='D').tolist(),
+        })
+    return {'title': title, 'videos': series}
+
+
+def write_series_json(path, title, videos, all_metrics, points=DEFAULT_JSON_POINTS):
+    """Write series_json of a page of videos to ``path``."""
+    with open(path, 'w') as f:
+        json.dump(series_json(title, videos, all_metrics, points), f, separators=(',', ':'))
@@ -1,46 +1,66 @@
-import random
-import sqlite3
-import uuid
+import argparse
+import functools
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import traceback
+from collections import namedtuple
 from datetime import datetime, timedelta
 
+import numpy as np
 
-def clear_databases():
-    """Clear all existing data from both databases."""
-    # Clear analytics database
-    conn = sqlite3.connect('lib/DB/youtube_analytics.db')
-    cursor = conn.cursor()
-    
-    # Get all tables
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = cursor.fetchall()
-    
-    # Drop all tables except sqlite_sequence
-    for table in tables:
-        if table[0] != 'sqlite_sequence':
-            cursor.execute(f"DROP TABLE IF EXISTS {table[0]};")
-    
-    conn.commit()
-    conn.close()
+import profiling
+from analytics_schema import (
+    ANALYTICS_DB,
+    CONSOLIDATED_LAYOUT,
+    LAYOUTS,
+    LOGIN_DB,
+    MAX_COMPOUND_SELECT,
+    PER_TABLE_LAYOUT,
+    create_consolidated_indexes,
+    create_consolidated_tables,
+    detect_layout,
+    safe_id,
+)
+from credentials import DEFAULT_HASH_SCHEME, DEFAULT_PASSWORD, CredentialHasher, available_schemes
+from db_connections import CheckpointScheduler, connect_writer, database_in_use, with_busy_retry
+from rankings import apply_ranking_deltas, build_rankings, has_rankings
+from rollups import apply_metric_deltas, build_rollups
+from snapshots import dump_snapshot, read_manifest, restore_snapshot
 
-    # Clear login database
-    conn = sqlite3.connect('lib/login/login_users.db')
-    cursor = conn.cursor()
-    
-    # Drop login_users table
-    cursor.execute("DROP TABLE IF EXISTS login_users;")
-    
-    conn.commit()
-    conn.close()
+# Defaults reproduce the original small demo dataset
+DEFAULT_USERS = 5
+DEFAULT_VIDEOS_PER_USER = 5
+DEFAULT_DAYS = 30
+DEFAULT_USERS_PER_BATCH = 500
+DEFAULT_NEW_VIDEO_CHANCE = 0.05
 
+# Seconds to wait for other connections before resetting a database in place
+RESET_LOCK_TIMEOUT = 0.5
 
-def create_tables():
-    """Create the necessary tables in both databases."""
-    # Create analytics tables
-    conn = sqlite3.connect('lib/DB/youtube_analytics.db')
-    cursor = conn.cursor()
-    
-    # Create all_users table
-    cursor.execute('''
+METRIC_COLUMNS = ('metric_id', 'day', 'day_views', 'impressions', 'ctr', 'watchtime')
+VIDEO_COLUMNS = ('video_id', 'video_name', 'views', 'subs', 'revenue', 'comments', 'watchtime', 'creation_date')
+
+# A generated video, in the column order of the per-user video tables
+Video = namedtuple('Video', VIDEO_COLUMNS)
+
+# Metric rows generated, queued and written at a time, which bounds the
+# memory of a seed whatever the size of the dataset
+METRIC_ROWS_PER_CHUNK = 1 << 18
+# Chunks each generator process may have queued for the writer
+DEFAULT_PENDING_CHUNKS = 2
+
+
+def create_analytics_tables(conn, layout=PER_TABLE_LAYOUT):
+    """Create the analytics tables that exist before any data is inserted.
+
+    Per-table layout tables are created per user and video as data is
+    inserted; the consolidated tables are created here.
+    """
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS all_users (
         user_id TEXT PRIMARY KEY,
         user_name TEXT NOT NULL,
@@ -56,35 +76,134 @@ def create_tables():
     )
     ''')
     
-    conn.commit()
-    conn.close()
+    if layout == CONSOLIDATED_LAYOUT:
+        create_consolidated_tables(conn)
 
-    # Create login table
-    conn = sqlite3.connect('lib/login/login_users.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+
+def create_login_tables(conn):
+    """Create the login_users table."""
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS login_users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         username TEXT UNIQUE,
         password TEXT
     )
     ''')
+
+
+def _replace_database(db_path, create_schema):
+    """Build a fresh database next to ``db_path`` and atomically move it into place."""
+    directory = os.path.dirname(os.path.abspath(db_path))
+    fd, new_path = tempfile.mkstemp(prefix=f'{os.path.basename(db_path)}.', suffix='.new', dir=directory)
+    os.close(fd)
+    try:
+        if os.path.exists(db_path):
+            shutil.copymode(db_path, new_path)
+        conn = connect_writer(new_path)
+        try:
+            create_schema(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(new_path, db_path)
+    finally:
+        if os.path.exists(new_path):
+            os.remove(new_path)
+
+
+def _drop_all_tables(db_path, create_schema):
+    """Drop every table and view in one transaction, recreate the schema and VACUUM."""
+    conn = profiling.connect(db_path, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        objects = conn.execute('''
+        SELECT type, name FROM sqlite_master
+        WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'
+        ''').fetchall()
+        for object_type, name in objects:
+            conn.execute(f'DROP {object_type.upper()} IF EXISTS "{name}"')
+        create_schema(conn)
+        conn.execute('COMMIT')
+        
+        # Give the freed pages back so the file does not keep its old size
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+
+def reset_database(db_path, create_schema):
+    """Empty a database and create its schema; return how it was done.
+
+    When nothing else has the database open, a new file with the schema
+    already created replaces it, which takes the same time whatever the
+    old file's size. Otherwise, or if the file cannot be replaced (Windows
+    refuses while another process has it open), every table is dropped in a
+    single transaction followed by VACUUM. Returns 'created', 'replaced' or
+    'dropped'.
+    """
+    if not os.path.exists(db_path):
+        _replace_database(db_path, create_schema)
+        return 'created'
+    
+    if not database_in_use(db_path, RESET_LOCK_TIMEOUT):
+        try:
+            _replace_database(db_path, create_schema)
+            
+            # A journal that survived the check is not hot, just stale
+            if os.path.exists(db_path + '-journal'):
+                os.remove(db_path + '-journal')
+            return 'replaced'
+        except OSError as e:
+            print(f"  Could not replace {db_path} ({e}), dropping its tables instead")
     
+    _drop_all_tables(db_path, create_schema)
+    return 'dropped'
+
+
+def clear_databases(analytics_db=ANALYTICS_DB, login_db=LOGIN_DB, layout=PER_TABLE_LAYOUT):
+    """Clear all existing data from both databases, leaving their empty tables."""
+    for db_path, create_schema in (
+        (analytics_db, functools.partial(create_analytics_tables, layout=layout)),
+        (login_db, create_login_tables),
+    ):
+        started = time.perf_counter()
+        method = reset_database(db_path, create_schema)
+        print(f"  {db_path}: {method} in {time.perf_counter() - started:.2f}s")
+
+
+def create_tables(analytics_db=ANALYTICS_DB, login_db=LOGIN_DB, layout=PER_TABLE_LAYOUT):
+    """Create the necessary tables in both databases."""
+    # Create analytics tables
+    conn = connect_writer(analytics_db)
+    create_analytics_tables(conn, layout)
     conn.commit()
     conn.close()
 
+    # Create login table
+    conn = connect_writer(login_db)
+    create_login_tables(conn)
+    conn.commit()
+    conn.close()
+
+
+def generate_user_data(num_users=DEFAULT_USERS, start_index=0, rng=None, as_of=None):
+    """Generate data for a range of users.
 
-def generate_user_data():
-    """Generate data for 5 users with specified usernames."""
+    The first five users get the predefined usernames; any further users
+    are named after their index so usernames stay unique at scale.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    as_of = as_of or datetime.now()
+    
     # List of predefined usernames
     usernames = ["umer", "Danny", "Talal", "Nemo", "Lelouch"]
     
+    user_ids = generate_uuid_strings(num_users, rng).tolist()
     users = []
-    for i in range(5):
-        user_id = str(uuid.uuid4())
-        creation_date = datetime.now().isoformat()
-        username = usernames[i]
+    for i in range(start_index, start_index + num_users):
+        user_id = user_ids[i - start_index]
+        creation_date = as_of.isoformat()
+        username = usernames[i] if i < len(usernames) else f'user_{i}'
         
         user = {
             'user_id': user_id,
@@ -92,7 +211,7 @@ def generate_user_data():
             'channel_creation_date': creation_date,
             'channel_name': f'{username}\'s Channel',
             'total_views': 0,  # Will be updated after adding videos
-            'total_subs': random.randint(1000, 100000),
+            'total_subs': int(rng.integers(1000, 100000, endpoint=True)),
             'total_comments': 0,  # Will be updated after adding videos
             'total_watchtime': 0,  # Will be updated after adding videos
             'total_revenue': 0.0,  # Will be updated after adding videos
@@ -102,9 +221,9 @@ def generate_user_data():
         users.append(user)
     return users
 
-def create_user_video_table(user_id):
+def create_user_video_table(user_id, analytics_db=ANALYTICS_DB):
     """Create a table for user's videos."""
-    conn = sqlite3.connect('lib/DB/youtube_analytics.db')
+    conn = profiling.connect(analytics_db)
     cursor = conn.cursor()
     
     safe_user_id = user_id.replace('-', '_')
@@ -124,9 +243,9 @@ def create_user_video_table(user_id):
     conn.commit()
     conn.close()
 
-def create_video_metrics_table(video_id):
+def create_video_metrics_table(video_id, analytics_db=ANALYTICS_DB):
     """Create a table for video metrics."""
-    conn = sqlite3.connect('lib/DB/youtube_analytics.db')
+    conn = profiling.connect(analytics_db)
     cursor = conn.cursor()
     
     safe_video_id = video_id.replace('-', '_')
@@ -144,8 +263,10 @@ def create_video_metrics_table(video_id):
     conn.commit()
     conn.close()
 
-def generate_random_video_title():
+def generate_random_video_title(rng=None):
     """Generate a random but meaningful video title."""
+    rng = rng if rng is not None else np.random.default_rng()
+    
     prefixes = [
         "Ultimate Guide to", "How I Mastered", "10 Ways to Improve Your", 
         "The Secret of", "Why You Should Try", "Let's Explore", 
@@ -177,284 +298,1050 @@ def generate_random_video_title():
         "That Nobody Talks About", "- Is It Worth It?", "Steal", "Hamara"
     ]
     
-    return f"{random.choice(prefixes)} {random.choice(topics)} {random.choice(suffixes)}"
-
-def generate_video_metrics(total_views, total_watchtime, creation_date):
-    """Generate 30 days of metrics for a video with high variance."""
-    metrics = []
-    start_date = datetime.fromisoformat(creation_date)
-    
-    # Generate separate weights for views and watch time
-    view_weights = []
-    watchtime_weights = []
-    
-    for i in range(30):
-        # Base weight for views with higher variability
-        if i == 0:  # First day spike
-            view_weight = random.uniform(0.1, 0.3)  # 10-30% of views on first day
-        elif i == 1:  # Second day
-            view_weight = random.uniform(0.05, 0.2)  # 5-20% of views
-        elif i == 2:  # Third day
-            view_weight = random.uniform(0.03, 0.15)  # 3-15% of views
-        elif i < 7:  # First week
-            view_weight = random.uniform(0.02, 0.1)  # 2-10% of views
-        elif i < 14:  # Second week
-            view_weight = random.uniform(0.01, 0.08)  # 1-8% of views
-        else:  # Rest of the month
-            view_weight = random.uniform(0.005, 0.05)  # 0.5-5% of views
-        
-        # Add more dramatic spikes (20% chance each day)
-        if random.random() < 0.2:
-            view_weight *= random.uniform(1.5, 4.0)  # Higher multiplier for more variance
-        
-        # Add potential dips (15% chance)
-        if random.random() < 0.15:
-            view_weight *= random.uniform(0.3, 0.7)  # Significant drop in views
-            
-        view_weights.append(view_weight)
-        
-        # Generate independent weight for watch time
-        # Base value is partially correlated with views but with independent variance
-        # Watch time pattern can differ significantly from views pattern
-        watchtime_base = view_weight * random.uniform(0.5, 1.5)  # Loosely correlated with views
-        
-        # Add watch time specific spikes (15% chance)
-        if random.random() < 0.15:
-            watchtime_base *= random.uniform(1.5, 3.0)  # Higher engagement day
-            
-        # Add watch time specific dips (15% chance)
-        if random.random() < 0.15:
-            watchtime_base *= random.uniform(0.3, 0.8)  # Lower engagement day
-            
-        watchtime_weights.append(watchtime_base)
+    prefix = prefixes[rng.integers(len(prefixes))]
+    topic = topics[rng.integers(len(topics))]
+    suffix = suffixes[rng.integers(len(suffixes))]
+    return f"{prefix} {topic} {suffix}"
+
+# Per-day ranges for the base share of a video's views: a launch spike over
+# the first three days, then a decaying first and second week and a long tail.
+VIEW_WEIGHT_SCHEDULE = (
+    # (first day, low, high)
+    (0, 0.1, 0.3),     # 10-30% of views on first day
+    (1, 0.05, 0.2),    # 5-20% of views
+    (2, 0.03, 0.15),   # 3-15% of views
+    (3, 0.02, 0.1),    # 2-10% of views for the rest of the first week
+    (7, 0.01, 0.08),   # 1-8% of views in the second week
+    (14, 0.005, 0.05), # 0.5-5% of views for the rest of the video's life
+)
+
+
+_HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+_UUID_HEX_GROUPS = ((0, 8), (8, 12), (12, 16), (16, 20), (20, 32))
+
+
+def _apply_random_factor(weights, rng, chance, low, high):
+    """Multiply a random ``chance`` share of entries by U(low, high), in place."""
+    hits = rng.random(weights.shape) < chance
+    weights[hits] *= rng.uniform(low, high, size=int(hits.sum()))
+
+
+def _view_weight_bounds(num_days):
+    """Return per-day (low, high) arrays following VIEW_WEIGHT_SCHEDULE."""
+    low = np.empty(num_days)
+    high = np.empty(num_days)
+    for first_day, lo, hi in VIEW_WEIGHT_SCHEDULE:
+        low[first_day:] = lo
+        high[first_day:] = hi
+    return low, high
+
+
+def _split_totals(weights, totals):
+    """Split integer totals across days in proportion to ``weights``.
+
+    Each day gets its truncated share and the last day gets whatever is
+    left, so every row sums exactly to its total.
+    """
+    weights = weights / weights.sum(axis=1, keepdims=True)
+    shares = np.floor(weights * totals[:, None]).astype(np.int64)
+    shares[:, -1] = totals - shares[:, :-1].sum(axis=1)
+    return shares
+
+
+def _impressions_and_ctr(day_views, rng):
+    """Draw a CTR per day and return the (impressions, ctr) arrays it implies."""
+    # Base CTR between 2% and 12%, with a 30% chance to halve or double it
+    ctr_base = rng.uniform(0.02, 0.12, size=day_views.shape)
+    _apply_random_factor(ctr_base, rng, 0.3, 0.5, 2.0)
     
-    # Normalize weights to ensure they sum to 1
-    total_view_weight = sum(view_weights)
-    view_weights = [w/total_view_weight for w in view_weights]
+    # Calculate impressions from views and CTR, then the actual CTR back from them
+    impressions = np.floor(day_views / ctr_base).astype(np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ctr = np.where(impressions > 0, np.round(day_views / impressions, 4), 0.0)
+    return impressions, ctr
+
+
+def generate_uuid_bytes(count, rng):
+    """Generate an array of ``count`` random version 4 UUIDs from ``rng``, as ASCII bytes."""
+    raw = rng.integers(0, 256, size=(count, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
     
-    total_watchtime_weight = sum(watchtime_weights)
-    watchtime_weights = [w/total_watchtime_weight for w in watchtime_weights]
+    # Format as hex text with a lookup table rather than one str() per UUID
+    hex_chars = np.empty((count, 32), dtype=np.uint8)
+    hex_chars[:, 0::2] = _HEX_DIGITS[raw >> 4]
+    hex_chars[:, 1::2] = _HEX_DIGITS[raw & 0x0F]
     
-    # Calculate remaining views and watchtime to distribute
-    remaining_views = total_views
-    remaining_watchtime = total_watchtime
+    chars = np.full((count, 36), ord('-'), dtype=np.uint8)
+    for dashes, (start, stop) in enumerate(_UUID_HEX_GROUPS):
+        chars[:, start + dashes:stop + dashes] = hex_chars[:, start:stop]
+    return chars.view('S36').ravel()
+
+
+def generate_uuid_strings(count, rng):
+    """Generate an array of ``count`` random version 4 UUID strings from ``rng``."""
+    return generate_uuid_bytes(count, rng).astype('U36')
+
+
+def _format_days(creation_dates, num_days):
+    """Return the ISO timestamps of each video's first ``num_days`` days, as ASCII bytes.
+
+    Every day keeps its video's creation time of day, so only the few
+    distinct dates in the batch are formatted and the text is assembled
+    byte-wise instead of formatting each timestamp separately.
+    """
+    starts = np.array(creation_dates, dtype='datetime64[us]')
+    days = starts.astype('datetime64[D]')[:, None] + np.arange(num_days)
+    first_day = days.min()
+    distinct_days = first_day + np.arange((days.max() - first_day).astype(int) + 1)
     
-    for i in range(30):
-        metric_id = str(uuid.uuid4())
-        day = (start_date + timedelta(days=i)).isoformat()
-        
-        # Calculate this day's share based on independent weights
-        if i == 29:  # Last day gets all remaining values
-            day_views = remaining_views
-            watchtime = remaining_watchtime
-        else:
-            day_views = int(view_weights[i] * total_views)
-            watchtime = int(watchtime_weights[i] * total_watchtime)
-            remaining_views -= day_views
-            remaining_watchtime -= watchtime
-        
-        # Generate impressions and CTR with more variance
-        # CTR can vary significantly day by day
-        ctr_base = random.uniform(0.02, 0.12)  # Base CTR between 2% and 12%
-        
-        # Add random variance to CTR
-        if random.random() < 0.3:  # 30% chance of a CTR spike or dip
-            ctr_base *= random.uniform(0.5, 2.0)  # Can halve or double the CTR
-            
-        # Calculate impressions based on views and CTR
-        impressions = int(day_views / ctr_base) if ctr_base > 0 else day_views * 10
-        
-        # Recalculate actual CTR based on views and impressions
-        ctr = round(day_views / impressions, 4) if impressions > 0 else 0
-        
-        metric = {
-            'metric_id': metric_id,
-            'day': day,
-            'day_views': day_views,
-            'impressions': impressions,
-            'ctr': ctr,
-            'watchtime': watchtime
-        }
-        metrics.append(metric)
+    date_chars = np.datetime_as_string(distinct_days).astype('S10').view(np.uint8).reshape(-1, 10)
+    time_chars = np.datetime_as_string(starts, unit='us').astype('S26').view(np.uint8).reshape(-1, 26)
     
-    return metrics
+    chars = np.empty(days.shape + (26,), dtype=np.uint8)
+    chars[..., :10] = date_chars[(days - first_day).astype(int)]
+    chars[..., 10:] = time_chars[:, None, 10:]
+    return chars.view('S26')[..., 0]
 
-def generate_video_data(user_id):
-    """Generate data for 5 videos for a user."""
+
+def generate_video_metrics_batch(total_views, total_watchtime, creation_dates,
+                                 num_days=DEFAULT_DAYS, rng=None):
+    """Generate daily metrics for a batch of videos at once.
+
+    Draws the whole video x day matrix of view and watch time weights,
+    spike/dip multipliers and CTRs with NumPy, using the same distributions
+    as the original per-day loop. Daily views and watch time of each video
+    sum exactly to its totals.
+
+    Returns a dict of 2-D arrays (one row per video) keyed by metric
+    column name. The text columns are kept as ASCII bytes, a quarter of the
+    size of NumPy strings, and only decoded as rows are built.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    total_views = np.asarray(total_views, dtype=np.int64)
+    total_watchtime = np.asarray(total_watchtime, dtype=np.int64)
+    shape = (len(total_views), num_days)
+    
+    # Base weight for views with higher variability
+    low, high = _view_weight_bounds(num_days)
+    view_weights = rng.uniform(low, high, size=shape)
+    _apply_random_factor(view_weights, rng, 0.2, 1.5, 4.0)   # Dramatic spikes
+    _apply_random_factor(view_weights, rng, 0.15, 0.3, 0.7)  # Significant dips
+    
+    # Watch time is loosely correlated with views but has its own spikes and dips
+    watchtime_weights = view_weights * rng.uniform(0.5, 1.5, size=shape)
+    _apply_random_factor(watchtime_weights, rng, 0.15, 1.5, 3.0)  # Higher engagement day
+    _apply_random_factor(watchtime_weights, rng, 0.15, 0.3, 0.8)  # Lower engagement day
+    
+    day_views = _split_totals(view_weights, total_views)
+    watchtime = _split_totals(watchtime_weights, total_watchtime)
+    
+    impressions, ctr = _impressions_and_ctr(day_views, rng)
+    
+    return {
+        'metric_id': generate_uuid_bytes(day_views.size, rng).reshape(shape),
+        'day': _format_days(creation_dates, num_days),
+        'day_views': day_views,
+        'impressions': impressions,
+        'ctr': ctr,
+        'watchtime': watchtime,
+    }
+
+
+def _metric_columns(metrics, index):
+    """Return the METRIC_COLUMNS values of one video of a metrics batch as lists."""
+    return (
+        metrics['metric_id'][index].astype(str).tolist(),
+        metrics['day'][index].astype(str).tolist(),
+        metrics['day_views'][index].tolist(),
+        metrics['impressions'][index].tolist(),
+        metrics['ctr'][index].tolist(),
+        metrics['watchtime'][index].tolist(),
+    )
+
+
+def metric_rows(metrics, index):
+    """Return the insert tuples for one video of a metrics batch."""
+    return list(zip(*_metric_columns(metrics, index)))
+
+
+def generate_video_metrics(total_views, total_watchtime, creation_date, num_days=DEFAULT_DAYS):
+    """Generate daily metrics for a video with high variance.
+
+    Returns one tuple per day, in METRIC_COLUMNS order.
+    """
+    metrics = generate_video_metrics_batch(
+        [total_views], [total_watchtime], [creation_date], num_days
+    )
+    return metric_rows(metrics, 0)
+
+def generate_video_data(user_id, num_videos=DEFAULT_VIDEOS_PER_USER, rng=None, as_of=None):
+    """Yield a user's videos as Video tuples.
+
+    Videos are drawn as they are consumed, so a caller can take them a run
+    at a time; all IDs are drawn before the first video either way.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    as_of = as_of or datetime.now()
+    
     # Keep track of used titles to avoid duplicates
     used_titles = set()
     
-    videos = []
-    for i in range(5):
-        video_id = str(uuid.uuid4())
-        creation_date = (datetime.now() - timedelta(days=random.randint(1, 365))).isoformat()
+    video_ids = generate_uuid_bytes(num_videos, rng)
+    for i in range(num_videos):
+        video_id = video_ids[i].decode()
+        age_days = int(rng.integers(1, 365, endpoint=True))
+        creation_date = (as_of - timedelta(days=age_days)).isoformat()
         
-        # Generate unique title
-        while True:
-            title = generate_random_video_title()
+        # Generate unique title, numbering it once random draws keep colliding
+        for _ in range(20):
+            title = generate_random_video_title(rng)
             if title not in used_titles:
-                used_titles.add(title)
                 break
+        else:
+            title = f'{title} (Part {i + 1})'
+        used_titles.add(title)
         
         # Generate total views and watchtime with greater variance
-        views = random.randint(1000, 2000000)  # Wider range
-        avg_watch_minutes = random.uniform(1.5, 8.0)  # Average watch time in minutes
+        views = int(rng.integers(1000, 2000000, endpoint=True))  # Wider range
+        avg_watch_minutes = rng.uniform(1.5, 8.0)  # Average watch time in minutes
         watchtime = int(views * avg_watch_minutes * 60)  # Convert to seconds
         
         # Generate other metrics with greater variance
-        subs_rate = random.uniform(0.005, 0.05)  # Between 0.5% and 5% of viewers subscribe
+        subs_rate = rng.uniform(0.005, 0.05)  # Between 0.5% and 5% of viewers subscribe
         subs = int(views * subs_rate)
         
-        comment_rate = random.uniform(0.005, 0.03)  # Between 0.5% and 3% of viewers comment
+        comment_rate = rng.uniform(0.005, 0.03)  # Between 0.5% and 3% of viewers comment
         comments = int(views * comment_rate)
         
         # Revenue with more variance
-        cpm = random.uniform(1.0, 8.0)  # CPM between $1 and $8
+        cpm = rng.uniform(1.0, 8.0)  # CPM between $1 and $8
         revenue = round((views / 1000) * cpm, 2)
         
-        video = {
-            'video_id': video_id,
-            'video_name': title,
-            'views': views,
-            'subs': subs,
-            'revenue': revenue,
-            'comments': comments,
-            'watchtime': watchtime,
-            'creation_date': creation_date
-        }
-        videos.append(video)
-    return videos
+        yield Video(video_id, title, views, subs, revenue, comments, watchtime, creation_date)
 
-def insert_data():
-    """Insert all generated data into both databases."""
-    # Generate users
-    users = generate_user_data()
-    
-    # Create connections
-    conn_analytics = sqlite3.connect('lib/DB/youtube_analytics.db')
-    cursor_analytics = conn_analytics.cursor()
-    
-    conn_login = sqlite3.connect('lib/login/login_users.db')
-    cursor_login = conn_login.cursor()
+def batch_rng(seed, batch_index):
+    """Return the random generator for one user batch.
+
+    Each batch draws from its own stream derived from the master seed, so
+    the dataset depends only on the seed and batch size, not on how many
+    workers generated it or in which order they finished.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(batch_index,)))
+
+def users_in_batch(batch_index, params):
+    """Return the number of users in one batch of a run."""
+    return min(params['users_per_batch'], params['num_users'] - batch_index * params['users_per_batch'])
+
+def generate_user_batch(batch_index, params):
+    """Generate one batch of users, yielding its rows a chunk at a time.
+
+    ``params`` holds the run settings (see insert_data). Yields
+    ('videos', [(user_id, videos, metrics), ...]) chunks of about
+    METRIC_ROWS_PER_CHUNK metric rows, with videos as Video tuples and
+    metrics as NumPy arrays so chunks are cheap to pass between processes,
+    then ('users', users) once every user's totals are known.
+
+    A user with more metric rows than a chunk is generated a run of videos
+    at a time, so memory stays bounded by the chunk size however large the
+    dataset; smaller users draw the same random numbers as when generated
+    whole.
+    """
+    rng = batch_rng(params['seed'], batch_index)
+    start_index = batch_index * params['users_per_batch']
+    num_days = params['days_per_video']
+    videos_per_run = max(1, METRIC_ROWS_PER_CHUNK // num_days)
+    with profiling.span('generate.users'):
+        users = generate_user_data(users_in_batch(batch_index, params), start_index, rng=rng, as_of=params['as_of'])
     
-    try:
-        for user in users:
-            # Insert into analytics database
-            cursor_analytics.execute('''
-            INSERT INTO all_users (
-                user_id, user_name, channel_creation_date, channel_name,
-                total_views, total_subs, total_comments, total_watchtime,
-                total_revenue, channel_image_link, description
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                user['user_id'], user['user_name'], user['channel_creation_date'],
-                user['channel_name'], user['total_views'], user['total_subs'],
-                user['total_comments'], user['total_watchtime'], user['total_revenue'],
-                user['channel_image_link'], user['description']
-            ))
+    chunk = []
+    chunk_rows = 0
+    for user in users:
+        videos = generate_video_data(
+            user['user_id'], params['videos_per_user'], rng=rng, as_of=params['as_of']
+        )
+        while True:
+            with profiling.span('generate.videos'):
+                run = list(itertools.islice(videos, videos_per_run))
+            if not run:
+                break
             
-            # Insert into login database with the new password
-            cursor_login.execute('''
-            INSERT INTO login_users (username, password)
-            VALUES (?, ?)
-            ''', (user['user_name'], 'Umer@12g'))  # New password as requested
+            # Generate metrics that sum up to each video's totals, the whole run at once
+            with profiling.span('generate.metrics'):
+                metrics = generate_video_metrics_batch(
+                    [v.views for v in run],
+                    [v.watchtime for v in run],
+                    [v.creation_date for v in run],
+                    num_days,
+                    rng=rng
+                )
+            chunk.append((user['user_id'], run, metrics))
+            chunk_rows += len(run) * num_days
             
-            # Create user's video table
-            safe_user_id = user['user_id'].replace('-', '_')
+            # Fill in the user's total stats, carrying on the sums of earlier runs
+            user['total_views'] = sum((v.views for v in run), user['total_views'])
+            user['total_comments'] = sum((v.comments for v in run), user['total_comments'])
+            user['total_watchtime'] = sum((v.watchtime for v in run), user['total_watchtime'])
+            user['total_revenue'] = sum((v.revenue for v in run), user['total_revenue'])
+            
+            if chunk_rows >= METRIC_ROWS_PER_CHUNK:
+                yield 'videos', chunk
+                chunk = []
+                chunk_rows = 0
+    
+    if chunk:
+        yield 'videos', chunk
+    yield 'users', users
+
+def _write_per_table_videos(cursor_analytics, user_videos):
+    """Write videos and metrics into per-user and per-video tables.
+
+    ``user_videos`` holds (user_id, videos, metrics) runs of a user's
+    videos, as yielded by generate_user_batch.
+    """
+    rows_written = 0
+    
+    for user_id, videos, metrics in user_videos:
+        # Create user's video table
+        safe_user_id = safe_id(user_id)
+        cursor_analytics.execute(f'''
+        CREATE TABLE IF NOT EXISTS user_{safe_user_id} (
+            video_id TEXT PRIMARY KEY,
+            video_name TEXT NOT NULL,
+            views INTEGER NOT NULL,
+            subs INTEGER NOT NULL,
+            revenue REAL NOT NULL,
+            comments INTEGER NOT NULL,
+            watchtime INTEGER NOT NULL,
+            creation_date TEXT NOT NULL
+        )
+        ''')
+        
+        for index, video in enumerate(videos):
+            # Create video metrics table
+            safe_video_id = safe_id(video.video_id)
             cursor_analytics.execute(f'''
-            CREATE TABLE IF NOT EXISTS user_{safe_user_id} (
-                video_id TEXT PRIMARY KEY,
-                video_name TEXT NOT NULL,
-                views INTEGER NOT NULL,
-                subs INTEGER NOT NULL,
-                revenue REAL NOT NULL,
-                comments INTEGER NOT NULL,
-                watchtime INTEGER NOT NULL,
-                creation_date TEXT NOT NULL
+            CREATE TABLE IF NOT EXISTS video_metrics_{safe_video_id} (
+                metric_id TEXT PRIMARY KEY,
+                day TEXT NOT NULL,
+                day_views INTEGER NOT NULL,
+                impressions INTEGER NOT NULL,
+                ctr REAL NOT NULL,
+                watchtime INTEGER NOT NULL
             )
             ''')
             
-            # Generate and insert videos
-            videos = generate_video_data(user['user_id'])
-            total_views = 0
-            total_comments = 0
-            total_watchtime = 0
-            total_revenue = 0.0
-            
-            for video in videos:
-                cursor_analytics.execute(f'''
-                INSERT INTO user_{safe_user_id} (
-                    video_id, video_name, views, subs, revenue,
-                    comments, watchtime, creation_date
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    video['video_id'], video['video_name'], video['views'],
-                    video['subs'], video['revenue'], video['comments'],
-                    video['watchtime'], video['creation_date']
-                ))
-                
-                # Create video metrics table
-                safe_video_id = video['video_id'].replace('-', '_')
-                cursor_analytics.execute(f'''
-                CREATE TABLE IF NOT EXISTS video_metrics_{safe_video_id} (
-                    metric_id TEXT PRIMARY KEY,
-                    day TEXT NOT NULL,
-                    day_views INTEGER NOT NULL,
-                    impressions INTEGER NOT NULL,
-                    ctr REAL NOT NULL,
-                    watchtime INTEGER NOT NULL
-                )
-                ''')
-                
-                # Generate and insert metrics that sum up to the video's totals
-                metrics = generate_video_metrics(
-                    video['views'],
-                    video['watchtime'],
-                    video['creation_date']
-                )
-                
-                for metric in metrics:
-                    cursor_analytics.execute(f'''
-                    INSERT INTO video_metrics_{safe_video_id} (
-                        metric_id, day, day_views, impressions, ctr, watchtime
-                    ) VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
-                        metric['metric_id'], metric['day'], metric['day_views'],
-                        metric['impressions'], metric['ctr'], metric['watchtime']
-                    ))
-                
-                total_views += video['views']
-                total_comments += video['comments']
-                total_watchtime += video['watchtime']
-                total_revenue += video['revenue']
+            rows = metric_rows(metrics, index)
+            cursor_analytics.executemany(f'''
+            INSERT INTO video_metrics_{safe_video_id} (
+                metric_id, day, day_views, impressions, ctr, watchtime
+            ) VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            rows_written += len(rows)
+        
+        cursor_analytics.executemany(f'''
+        INSERT INTO user_{safe_user_id} (
+            video_id, video_name, views, subs, revenue,
+            comments, watchtime, creation_date
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', videos)
+        rows_written += len(videos)
+    
+    return rows_written
+
+def _consolidated_metric_rows(user_videos):
+    """Yield the video_metrics insert tuples of ``user_videos``, one video at a time."""
+    for _, videos, metrics in user_videos:
+        for index, video in enumerate(videos):
+            yield from zip(itertools.repeat(video.video_id), *_metric_columns(metrics, index))
+
+def _write_consolidated_videos(cursor_analytics, user_videos):
+    """Write videos and metrics into the shared videos and video_metrics tables.
+
+    The rows are streamed into executemany as they are built, so only the
+    NumPy arrays of ``user_videos`` are held in memory.
+    """
+    cursor_analytics.executemany('''
+    INSERT INTO videos (
+        video_id, video_name, views, subs, revenue,
+        comments, watchtime, creation_date, user_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (video + (user_id,) for user_id, videos, _ in user_videos for video in videos))
+    rows_written = cursor_analytics.rowcount
+    
+    cursor_analytics.executemany('''
+    INSERT INTO video_metrics (
+        video_id, metric_id, day, day_views, impressions, ctr, watchtime
+    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', _consolidated_metric_rows(user_videos))
+    
+    return rows_written + cursor_analytics.rowcount
+
+def write_user_batch(cursor_analytics, cursor_login, batch, layout=PER_TABLE_LAYOUT, passwords=None):
+    """Write one generated batch of users to both databases.
+
+    ``batch`` is the chunk stream of generate_user_batch; each chunk of
+    videos is written as it arrives and the users once their totals are
+    known. Every table is filled with executemany calls. ``passwords`` is
+    the pending result of CredentialHasher.submit for the batch's users; it
+    is only collected after the analytics rows are written, so the hashing
+    pool works meanwhile. Without it every user gets DEFAULT_PASSWORD in
+    plaintext. Returns the number of rows written.
+    """
+    write_videos = _write_consolidated_videos if layout == CONSOLIDATED_LAYOUT else _write_per_table_videos
+    rows_written = 0
+    for kind, payload in batch:
+        if kind == 'videos':
+            rows_written += write_videos(cursor_analytics, payload)
+        else:
+            users = payload
+    
+    cursor_analytics.executemany('''
+    INSERT INTO all_users (
+        user_id, user_name, channel_creation_date, channel_name,
+        total_views, total_subs, total_comments, total_watchtime,
+        total_revenue, channel_image_link, description
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (u['user_id'], u['user_name'], u['channel_creation_date'],
+         u['channel_name'], u['total_views'], u['total_subs'],
+         u['total_comments'], u['total_watchtime'], u['total_revenue'],
+         u['channel_image_link'], u['description'])
+        for u in users
+    ])
+    
+    if passwords is None:
+        stored = [DEFAULT_PASSWORD] * len(users)
+    else:
+        with profiling.span('write.wait_for_hashes'):
+            stored = passwords.get()
+    
+    cursor_login.executemany('''
+    INSERT INTO login_users (username, password)
+    VALUES (?, ?)
+    ''', [(u['user_name'], password) for u, password in zip(users, stored)])
+    rows_written += 2 * len(users)
+    
+    return rows_written
+
+def report_progress(users_done, num_users, rows_written, started):
+    """Print how far the seed has got and its overall throughput."""
+    elapsed = time.perf_counter() - started
+    rate = rows_written / elapsed if elapsed > 0 else 0.0
+    print(f"  {users_done:,}/{num_users:,} users ({100 * users_done / num_users:.1f}%), "
+          f"{rows_written:,} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)")
+
+def _generation_worker(worker_index, workers, num_batches, result_queue, params):
+    """Worker process: generate every ``workers``-th batch, streaming its chunks to the writer."""
+    try:
+        for batch_index in range(worker_index, num_batches, workers):
+            for item in generate_user_batch(batch_index, params):
+                result_queue.put(item)
+            profiling.flush()
+    except Exception:
+        result_queue.put(('error', traceback.format_exc()))
+
+def _receive_batch(result_queue):
+    """Yield the chunks of one batch from a worker's queue, up to its users."""
+    while True:
+        item = result_queue.get()
+        if item[0] == 'error':
+            raise RuntimeError(f"Data generation worker failed:\n{item[1]}")
+        yield item
+        if item[0] == 'users':
+            return
+
+def generate_batches_parallel(num_batches, params, workers, max_pending=DEFAULT_PENDING_CHUNKS):
+    """Yield the chunk stream of every batch in order, generating them in worker processes.
+
+    Worker ``w`` generates batches ``w``, ``w + workers``, ... and streams
+    their chunks into its own queue of at most ``max_pending`` chunks,
+    which the writer drains one batch at a time in order, so row order is
+    reproducible. Memory is bounded by the chunks in flight no matter how
+    far the workers get ahead of the writer. Each batch's stream must be
+    consumed before the next one.
+    """
+    ctx = multiprocessing.get_context()
+    result_queues = [ctx.Queue(maxsize=max_pending) for _ in range(workers)]
+    processes = [
+        ctx.Process(target=_generation_worker,
+                    args=(index, workers, num_batches, result_queues[index], params), daemon=True)
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    
+    finished = False
+    try:
+        for batch_index in range(num_batches):
+            yield _receive_batch(result_queues[batch_index % workers])
+        finished = True
+    finally:
+        for process in processes:
+            # Workers left behind by an error may be blocked on a full queue
+            process.join(timeout=5 if finished else 0)
+            if process.is_alive():
+                process.terminate()
+
+def insert_data(num_users=DEFAULT_USERS, videos_per_user=DEFAULT_VIDEOS_PER_USER,
+                days_per_video=DEFAULT_DAYS, users_per_batch=DEFAULT_USERS_PER_BATCH,
+                analytics_db=ANALYTICS_DB, login_db=LOGIN_DB,
+                seed=None, workers=1, as_of=None, layout=PER_TABLE_LAYOUT,
+                password_scheme=DEFAULT_HASH_SCHEME, hash_workers=None):
+    """Insert all generated data into both databases.
+
+    Users are generated and written ``users_per_batch`` at a time, with one
+    transaction per batch on each database. Within a batch, rows are
+    generated and written in chunks of about METRIC_ROWS_PER_CHUNK metric
+    rows, so memory does not grow with the dataset. With more than one
+    worker the batches are generated in a pool of processes while this
+    process stays the only one writing to SQLite. The same ``seed`` and ``as_of`` always
+    produce the same data, whatever the number of workers. Login passwords
+    are stored under ``password_scheme`` (see credentials.py), hashed in a
+    pool of ``hash_workers`` processes (default: one per core).
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+        print(f"  Using random seed {seed}")
+    
+    params = {
+        'num_users': num_users,
+        'videos_per_user': videos_per_user,
+        'days_per_video': days_per_video,
+        'users_per_batch': users_per_batch,
+        'seed': seed,
+        'as_of': as_of or datetime.now(),
+    }
+    num_batches = -(-num_users // users_per_batch)
+    
+    # Fails before anything is written if the scheme's backend is missing
+    hasher = CredentialHasher(password_scheme, hash_workers)
+    
+    if workers > 1:
+        batches = generate_batches_parallel(num_batches, params, workers)
+    else:
+        batches = (generate_user_batch(i, params) for i in range(num_batches))
+    
+    # Create connections. Readers such as graph_views.py keep reading the
+    # last committed batch while the load runs, and the WALs are copied
+    # back into the databases between batches.
+    conn_analytics = connect_writer(analytics_db, bulk=True)
+    cursor_analytics = conn_analytics.cursor()
+    checkpoint_analytics = CheckpointScheduler(conn_analytics, analytics_db)
+    
+    conn_login = connect_writer(login_db, bulk=True)
+    cursor_login = conn_login.cursor()
+    checkpoint_login = CheckpointScheduler(conn_login, login_db)
+    
+    started = time.perf_counter()
+    rows_written = 0
+    users_done = 0
+    
+    try:
+        for batch_index, batch in enumerate(batches):
+            batch_users = users_in_batch(batch_index, params)
+            passwords = hasher.submit([DEFAULT_PASSWORD] * batch_users)
+            with profiling.span('write.batch'):
+                rows_written += write_user_batch(cursor_analytics, cursor_login, batch, layout, passwords)
             
-            # Update user's total stats
-            cursor_analytics.execute('''
-            UPDATE all_users
-            SET total_views = ?, total_comments = ?, total_watchtime = ?, total_revenue = ?
-            WHERE user_id = ?
-            ''', (total_views, total_comments, total_watchtime, total_revenue, user['user_id']))
+            with profiling.span('write.commit'):
+                conn_analytics.commit()
+                conn_login.commit()
+            checkpoint_analytics.after_commit()
+            checkpoint_login.after_commit()
             
-            # Commit after each user to prevent long transactions
-            conn_analytics.commit()
-            conn_login.commit()
+            users_done += batch_users
+            report_progress(users_done, num_users, rows_written, started)
+        
+        if layout == CONSOLIDATED_LAYOUT:
+            print("  Building indexes...")
+            with profiling.span('write.indexes'):
+                create_consolidated_indexes(conn_analytics)
+                conn_analytics.commit()
+        
+        checkpoint_analytics.close()
+        checkpoint_login.close()
+        hasher.close()
     
     finally:
+        batches.close()
+        # Drops hashes still pending after an error; a no-op once closed
+        hasher.terminate()
+        
         # Close connections
         conn_analytics.close()
         conn_login.close()
 
 
-def main():
+def read_channel_videos(cursor, user_id, layout=PER_TABLE_LAYOUT):
+    """Return a channel's videos along with their latest metric day.
+
+    Rows are (video_id, views, subs, revenue, comments, watchtime,
+    creation_date, last_day, last_day_views, last_day_watchtime); the last
+    three are None for a video without metrics. Only the metric row with
+    the highest day of each video is read. Live ingestion inserts days in
+    the order events arrive, so insertion order is no guide to the latest
+    day.
+    """
+    if layout == CONSOLIDATED_LAYOUT:
+        return cursor.execute('''
+        SELECT v.video_id, v.views, v.subs, v.revenue, v.comments, v.watchtime,
+               v.creation_date, m.day, m.day_views, m.watchtime
+        FROM videos v
+        LEFT JOIN video_metrics m ON m.video_id = v.video_id
+            AND m.day = (SELECT MAX(day) FROM video_metrics WHERE video_id = v.video_id)
+        WHERE v.user_id = ?
+        ''', (user_id,)).fetchall()
+    
+    videos = cursor.execute(f'''
+    SELECT video_id, views, subs, revenue, comments, watchtime, creation_date
+    FROM user_{safe_id(user_id)}
+    ''').fetchall()
+    
+    latest = {}
+    for start in range(0, len(videos), MAX_COMPOUND_SELECT):
+        chunk = [video[0] for video in videos[start:start + MAX_COMPOUND_SELECT]]
+        query = ' UNION ALL '.join(
+            f'SELECT * FROM (SELECT ?, day, day_views, watchtime FROM video_metrics_{safe_id(video_id)} '
+            f'ORDER BY day DESC LIMIT 1)'
+            for video_id in chunk
+        )
+        for video_id, day, day_views, watchtime in cursor.execute(query, chunk):
+            latest[video_id] = (day, day_views, watchtime)
+    return [video + latest.get(video[0], (None, None, None)) for video in videos]
+
+def _continue_video_metrics(videos, num_days, rng):
+    """Generate the next ``num_days`` of metrics for existing videos, all at once.
+
+    Each video carries on from its latest day: views start around that
+    day's views and decay slowly, with occasional spikes and dips, and
+    watch time per view stays close to its latest value. A video with no
+    metrics yet starts on its creation date from the 1% long-tail share of
+    its views.
+    """
+    shape = (len(videos), num_days)
+    views = np.array([v[1] for v in videos], dtype=np.float64)
+    watchtime_total = np.array([v[5] for v in videos], dtype=np.float64)
+    has_metrics = np.array([v[7] is not None for v in videos])
+    last_views = np.array([v[8] or 0 for v in videos], dtype=np.float64)
+    last_watchtime = np.array([v[9] or 0 for v in videos], dtype=np.float64)
+    
+    starts = np.array([
+        np.datetime64(v[7]) + np.timedelta64(1, 'D') if v[7] is not None else np.datetime64(v[6])
+        for v in videos
+    ], dtype='datetime64[us]')
+    base_views = np.where(has_metrics, last_views, views * 0.01)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        watch_per_view = np.where(last_views > 0, last_watchtime / last_views, watchtime_total / views)
+    watch_per_view = np.where(np.isfinite(watch_per_view) & (watch_per_view > 0), watch_per_view, 300.0)
+    
+    # Slow decay of up to 3% a day, around which each day varies by +-30%
+    decay = rng.uniform(0.97, 1.0, size=(shape[0], 1)) ** np.arange(1, num_days + 1)
+    view_weights = rng.uniform(0.7, 1.3, size=shape) * decay
+    _apply_random_factor(view_weights, rng, 0.1, 1.5, 4.0)  # Spikes
+    _apply_random_factor(view_weights, rng, 0.1, 0.3, 0.7)  # Dips
+    
+    day_views = np.floor(base_views[:, None] * view_weights).astype(np.int64)
+    watchtime = np.floor(
+        day_views * watch_per_view[:, None] * rng.uniform(0.8, 1.2, size=shape)
+    ).astype(np.int64)
+    impressions, ctr = _impressions_and_ctr(day_views, rng)
+    
+    return {
+        'metric_id': generate_uuid_bytes(day_views.size, rng).reshape(shape),
+        'day': _format_days(starts, num_days),
+        'day_views': day_views,
+        'impressions': impressions,
+        'ctr': ctr,
+        'watchtime': watchtime,
+    }
+
+def _publish_video(first_day, num_days, rng):
+    """Generate a video published on ``first_day`` and its first ``num_days`` of metrics.
+
+    Daily views follow the launch spike of VIEW_WEIGHT_SCHEDULE as a share
+    of a lifetime view count, so later appends continue its long tail.
+    Returns the Video, with totals so far, and a one-row metrics batch.
+    """
+    lifetime_views = int(rng.integers(1000, 2000000, endpoint=True))
+    low, high = _view_weight_bounds(num_days)
+    view_weights = rng.uniform(low, high, size=(1, num_days))
+    _apply_random_factor(view_weights, rng, 0.2, 1.5, 4.0)   # Dramatic spikes
+    _apply_random_factor(view_weights, rng, 0.15, 0.3, 0.7)  # Significant dips
+    
+    day_views = np.floor(lifetime_views * view_weights).astype(np.int64)
+    avg_watch_seconds = rng.uniform(1.5, 8.0) * 60
+    watchtime = np.floor(
+        day_views * avg_watch_seconds * rng.uniform(0.5, 1.5, size=day_views.shape)
+    ).astype(np.int64)
+    impressions, ctr = _impressions_and_ctr(day_views, rng)
+    metrics = {
+        'metric_id': generate_uuid_bytes(num_days, rng).reshape(1, num_days),
+        'day': _format_days([first_day], num_days),
+        'day_views': day_views,
+        'impressions': impressions,
+        'ctr': ctr,
+        'watchtime': watchtime,
+    }
+    
+    # Same subscriber, comment and CPM ranges as generate_video_data
+    views = int(day_views.sum())
+    subs_rate = rng.uniform(0.005, 0.05)
+    comment_rate = rng.uniform(0.005, 0.03)
+    cpm = rng.uniform(1.0, 8.0)
+    video = Video(
+        video_id=generate_uuid_strings(1, rng).tolist()[0],
+        video_name=generate_random_video_title(rng),
+        views=views,
+        subs=int(views * subs_rate),
+        revenue=round((views / 1000) * cpm, 2),
+        comments=int(views * comment_rate),
+        watchtime=int(watchtime.sum()),
+        creation_date=metrics['day'][0, 0].decode(),
+    )
+    return video, metrics
+
+def generate_append_batch(channels, num_days, rng, new_video_chance=DEFAULT_NEW_VIDEO_CHANCE):
+    """Generate ``num_days`` more days of activity for a batch of channels.
+
+    ``channels`` holds (user_id, channel_creation_date, videos) with videos
+    as returned by read_channel_videos. Every existing video gets new daily
+    metrics, and on each simulated day a channel publishes a new video with
+    probability ``new_video_chance``. Returns one dict per channel with the
+    metric rows to insert, the new videos and the increments of the video
+    and channel totals.
+    """
+    all_videos = [video for _, _, videos in channels for video in videos]
+    if all_videos:
+        metrics = _continue_video_metrics(all_videos, num_days, rng)
+        new_views = metrics['day_views'].sum(axis=1)
+        new_watchtime = metrics['watchtime'].sum(axis=1)
+    
+    results = []
+    index = 0
+    for user_id, channel_creation_date, videos in channels:
+        channel = {
+            'user_id': user_id,
+            'metrics': [],
+            'updates': [],
+            'new_videos': [],
+            # Metrics batch of the new videos, one 1-D array per video and column
+            'new_video_metrics': {column: [] for column in METRIC_COLUMNS},
+        }
+        
+        for video_id, views, subs, revenue, comments, _, _, _, _, _ in videos:
+            # Subscribers, comments and revenue grow at the video's rates so far
+            gained = int(new_views[index])
+            ratio = gained / views if views else 0.0
+            channel['metrics'].append((video_id, metric_rows(metrics, index)))
+            channel['updates'].append((
+                gained, int(subs * ratio), round(revenue * ratio, 2),
+                int(comments * ratio), int(new_watchtime[index]), video_id,
+            ))
+            index += 1
+        
+        # New videos go up after the channel's latest day of metrics
+        last_days = [video[7] for video in videos if video[7] is not None]
+        today = np.datetime64(max(last_days) if last_days else channel_creation_date, 'us')
+        for offset in np.flatnonzero(rng.random(num_days) < new_video_chance).tolist():
+            video, video_metrics = _publish_video(
+                today + np.timedelta64(offset + 1, 'D'), num_days - offset, rng
+            )
+            channel['new_videos'].append(video)
+            for column in METRIC_COLUMNS:
+                channel['new_video_metrics'][column].append(video_metrics[column][0])
+        
+        updates = channel['updates'] + [
+            (v.views, v.subs, v.revenue, v.comments, v.watchtime, v.video_id)
+            for v in channel['new_videos']
+        ]
+        channel['totals'] = tuple(sum(update[i] for update in updates) for i in range(5))
+        results.append(channel)
+    return results
+
+def write_append_batch(cursor, channels, layout=PER_TABLE_LAYOUT, update_rollups=False, update_rankings=False):
+    """Write one generated append batch to the analytics database.
+
+    New metric rows and videos are inserted, video and channel totals are
+    incremented in place and, with ``update_rollups`` / ``update_rankings``,
+    the new days are added onto the channel rollups and video leaderboards.
+    The caller commits. Returns the number of rows written.
+    """
+    rows_written = 0
+    
+    for channel in channels:
+        user_id = channel['user_id']
+        if channel['new_videos']:
+            new_videos = [(user_id, channel['new_videos'], channel['new_video_metrics'])]
+            if layout == CONSOLIDATED_LAYOUT:
+                rows_written += _write_consolidated_videos(cursor, new_videos)
+            else:
+                rows_written += _write_per_table_videos(cursor, new_videos)
+        
+        if layout == CONSOLIDATED_LAYOUT:
+            cursor.executemany('''
+            INSERT INTO video_metrics (
+                video_id, metric_id, day, day_views, impressions, ctr, watchtime
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', ((video_id,) + row for video_id, rows in channel['metrics'] for row in rows))
+            rows_written += cursor.rowcount
+            video_table = 'videos'
+        else:
+            for video_id, rows in channel['metrics']:
+                cursor.executemany(f'''
+                INSERT INTO video_metrics_{safe_id(video_id)} (
+                    metric_id, day, day_views, impressions, ctr, watchtime
+                ) VALUES (?, ?, ?, ?, ?, ?)
+                ''', rows)
+                rows_written += len(rows)
+            video_table = f'user_{safe_id(user_id)}'
+        
+        cursor.executemany(f'''
+        UPDATE {video_table}
+        SET views = views + ?, subs = subs + ?, revenue = round(revenue + ?, 2),
+            comments = comments + ?, watchtime = watchtime + ?
+        WHERE video_id = ?
+        ''', channel['updates'])
+        
+        new_video_rows = [
+            (video.video_id, metric_rows(channel['new_video_metrics'], index))
+            for index, video in enumerate(channel['new_videos'])
+        ]
+        if update_rollups:
+            apply_metric_deltas(cursor.connection, user_id, (
+                (day, day_views, watchtime, impressions)
+                for _, rows in channel['metrics'] + new_video_rows
+                for _, day, day_views, impressions, _, watchtime in rows
+            ))
+        if update_rankings:
+            videos = [
+                (video_id, None, views, revenue, watchtime)
+                for views, _, revenue, _, watchtime, video_id in channel['updates']
+            ] + [
+                (v.video_id, v.video_name, v.views, v.revenue, v.watchtime)
+                for v in channel['new_videos']
+            ]
+            apply_ranking_deltas(cursor.connection, user_id, videos, (
+                (video_id, day, day_views)
+                for video_id, rows in channel['metrics'] + new_video_rows
+                for _, day, day_views, _, _, _ in rows
+            ))
+    
+    cursor.executemany('''
+    UPDATE all_users
+    SET total_views = total_views + ?, total_subs = total_subs + ?,
+        total_revenue = round(total_revenue + ?, 2), total_comments = total_comments + ?,
+        total_watchtime = total_watchtime + ?
+    WHERE user_id = ?
+    ''', [channel['totals'] + (channel['user_id'],) for channel in channels])
+    
+    return rows_written
+
+def append_days(num_days, analytics_db=ANALYTICS_DB, seed=None,
+                users_per_batch=DEFAULT_USERS_PER_BATCH, new_video_chance=DEFAULT_NEW_VIDEO_CHANCE):
+    """Advance an existing analytics database by ``num_days`` simulated days.
+
+    Channels are processed ``users_per_batch`` at a time, each batch in one
+    transaction. Only each video's latest metric row is read, so the cost
+    grows with the number of videos and new rows rather than with the
+    metric history already stored. New days start after each video's
+    highest stored day, and each batch holds the write lock from that read
+    to its commit, so days that already exist, such as those written by the
+    ingestion service, are skipped rather than inserted again. Rollup and
+    leaderboard tables, if present, are kept up to date.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+        print(f"  Using random seed {seed}")
+    
+    conn = connect_writer(analytics_db)
+    cursor = conn.cursor()
+    
+    try:
+        layout = detect_layout(conn)
+        update_rollups = conn.execute('PRAGMA table_info(channel_daily_rollup)').fetchone() is not None
+        update_rankings = has_rankings(conn)
+        users = cursor.execute('SELECT user_id, channel_creation_date FROM all_users').fetchall()
+        
+        started = time.perf_counter()
+        rows_written = 0
+        for batch_index, start in enumerate(range(0, len(users), users_per_batch)):
+            batch_users = users[start:start + users_per_batch]
+            # No other writer may add days between reading the latest ones and the commit
+            with_busy_retry(conn.execute, 'BEGIN IMMEDIATE')
+            with profiling.span('append.read'):
+                channels = [
+                    (user_id, creation_date, read_channel_videos(cursor, user_id, layout))
+                    for user_id, creation_date in batch_users
+                ]
+            with profiling.span('append.generate'):
+                batch = generate_append_batch(channels, num_days, batch_rng(seed, batch_index), new_video_chance)
+            with profiling.span('append.write'):
+                rows_written += write_append_batch(cursor, batch, layout, update_rollups, update_rankings)
+                conn.commit()
+            report_progress(start + len(batch_users), len(users), rows_written, started)
+        
+        # Readers holding snapshots keep the WAL from being reused; empty it
+        CheckpointScheduler(conn, analytics_db).close()
+    
+    finally:
+        conn.close()
+
+
+def parse_args(argv=None):
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description='Generate dummy analytics data.')
+    parser.add_argument('--users', type=int, default=DEFAULT_USERS,
+                        help='number of channels to generate')
+    parser.add_argument('--videos-per-user', type=int, default=DEFAULT_VIDEOS_PER_USER,
+                        help='number of videos per channel')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS,
+                        help='number of daily metric rows per video')
+    parser.add_argument('--users-per-batch', type=int, default=DEFAULT_USERS_PER_BATCH,
+                        help='users generated and committed per transaction')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of generator processes (1 generates in-process)')
+    parser.add_argument('--seed', type=int,
+                        help='master seed; the same seed and --as-of reproduce the same data')
+    parser.add_argument('--as-of', type=datetime.fromisoformat,
+                        help='ISO date the dataset is generated relative to (default: now)')
+    parser.add_argument('--layout', choices=LAYOUTS, default=PER_TABLE_LAYOUT,
+                        help='storage layout of the analytics database')
+    parser.add_argument('--password-hash', choices=available_schemes(), default=DEFAULT_HASH_SCHEME,
+                        help='how login passwords are stored; the app only accepts plain '
+                             '(bcrypt and argon2 are offered when their packages are installed)')
+    parser.add_argument('--hash-workers', type=int,
+                        help='number of password hashing processes (default: one per core)')
+    parser.add_argument('--no-rollups', action='store_true',
+                        help='skip building the channel rollup tables')
+    parser.add_argument('--no-rankings', action='store_true',
+                        help='skip building the channel and video leaderboards')
+    parser.add_argument('--append-days', type=int, metavar='N',
+                        help='instead of reseeding, advance the existing database by N days')
+    parser.add_argument('--new-video-chance', type=float, default=DEFAULT_NEW_VIDEO_CHANCE,
+                        help='with --append-days, chance per channel and day of publishing a video')
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help='restore the databases from this snapshot if it was made with the same '
+                             'options, otherwise generate them and save the snapshot (needs --seed)')
+    parser.add_argument('--analytics-db', default=ANALYTICS_DB,
+                        help='path to the analytics database')
+    parser.add_argument('--login-db', default=LOGIN_DB,
+                        help='path to the login database')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='write a JSON profile of the run (phase timings, SQL per call site) to PATH')
+    parser.add_argument('--profile-cpu', action='store_true',
+                        help='with --profile, also run under cProfile')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, also trace allocations with tracemalloc')
+    args = parser.parse_args(argv)
+    if args.snapshot and args.seed is None:
+        parser.error('--snapshot needs --seed, or the snapshot could not be reproduced')
+    if args.snapshot and args.append_days:
+        parser.error('--snapshot cannot be combined with --append-days')
+    return args
+
+
+def snapshot_params(args):
+    """Return the options that determine the generated data, as stored in a snapshot."""
+    return {
+        'users': args.users,
+        'videos_per_user': args.videos_per_user,
+        'days': args.days,
+        # Each batch draws from its own random stream, so batching changes the data
+        'users_per_batch': args.users_per_batch,
+        'seed': args.seed,
+        'as_of': args.as_of.isoformat() if args.as_of else None,
+        'layout': args.layout,
+        'password_hash': args.password_hash,
+        'rollups': not args.no_rollups,
+        'rankings': not args.no_rankings,
+    }
+
+
+def main(argv=None):
     """Main function to generate dummy data."""
+    args = parse_args(argv)
+    if args.profile:
+        profiling.enable(args.profile, args.profile_cpu, args.profile_memory)
+    
+    if args.append_days:
+        print(f"Appending {args.append_days} days to {args.analytics_db}...")
+        with profiling.span('append_days'):
+            append_days(
+                args.append_days,
+                analytics_db=args.analytics_db,
+                seed=args.seed,
+                users_per_batch=args.users_per_batch,
+                new_video_chance=args.new_video_chance,
+            )
+        print("Dummy data append completed successfully!")
+        return
+    
+    if args.snapshot and os.path.exists(args.snapshot):
+        if read_manifest(args.snapshot)['params'] == snapshot_params(args):
+            print(f"Restoring {args.snapshot}...")
+            with profiling.span('restore_snapshot'):
+                restore_snapshot(args.snapshot, args.analytics_db, args.login_db)
+            print("Dummy data restored from snapshot!")
+            return
+        print(f"{args.snapshot} was made with other options, regenerating it")
+    
     print("Clearing existing databases...")
-    clear_databases()
+    with profiling.span('clear_databases'):
+        clear_databases(args.analytics_db, args.login_db, args.layout)
     
     print("Creating tables...")
-    create_tables()
+    with profiling.span('create_tables'):
+        create_tables(args.analytics_db, args.login_db, args.layout)
     
     print("Generating and inserting dummy data...")
-    insert_data()
+    with profiling.span('insert_data'):
+        insert_data(
+            num_users=args.users,
+            videos_per_user=args.videos_per_user,
+            days_per_video=args.days,
+            users_per_batch=args.users_per_batch,
+            analytics_db=args.analytics_db,
+            login_db=args.login_db,
+            seed=args.seed,
+            workers=args.workers,
+            as_of=args.as_of,
+            layout=args.layout,
+            password_scheme=args.password_hash,
+            hash_workers=args.hash_workers,
+        )
+    
+    if not args.no_rollups:
+        print("Building channel rollups...")
+        started = time.perf_counter()
+        conn = connect_writer(args.analytics_db, bulk=True)
+        try:
+            with profiling.span('build_rollups'):
+                build_rollups(conn)
+            CheckpointScheduler(conn, args.analytics_db).close()
+        finally:
+            conn.close()
+        print(f"  Built rollups in {time.perf_counter() - started:.1f}s")
+    
+    if not args.no_rankings:
+        print("Building leaderboards...")
+        started = time.perf_counter()
+        conn = connect_writer(args.analytics_db, bulk=True)
+        try:
+            with profiling.span('build_rankings'):
+                build_rankings(conn)
+            CheckpointScheduler(conn, args.analytics_db).close()
+        finally:
+            conn.close()
+        print(f"  Built leaderboards in {time.perf_counter() - started:.1f}s")
+    
+    if args.snapshot:
+        print(f"Saving snapshot {args.snapshot}...")
+        started = time.perf_counter()
+        with profiling.span('dump_snapshot'):
+            dump_snapshot(args.snapshot, args.analytics_db, args.login_db, snapshot_params(args))
+        print(f"  Saved snapshot in {time.perf_counter() - started:.1f}s")
     
     print("Dummy data generation completed successfully!")
 
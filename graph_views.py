@@ -1,109 +1,542 @@
+import argparse
+import functools
+import glob
+import hashlib
+import json
+import multiprocessing
 import os
-import sqlite3
+import time
+from datetime import date, timedelta
 
+import matplotlib
 import matplotlib.pyplot as plt
 import pandas as pd
+from matplotlib.backends.backend_pdf import PdfPages
 
+import profiling
+from analytics_schema import ANALYTICS_DB, CONSOLIDATED_LAYOUT, MAX_COMPOUND_SELECT, detect_layout, safe_id
+from db_connections import connect_reader
+from fast_render import FAST_FORMATS, FastRenderer
+from rankings import top_channels_with_others, top_n
+from window_analytics import ChannelWindows
+
+
+GRAPHS_DIR = 'graphs'
+COMPARISON_PLOT = os.path.join(GRAPHS_DIR, 'all_users_comparison.png')
+MANIFEST_PATH = os.path.join(GRAPHS_DIR, 'manifest.json')
+
+# Part of every plot fingerprint; bump PLOT_VERSION whenever the way plots
+# are drawn changes so incremental runs redraw everything.
+PLOT_VERSION = 2
+PLOT_DPI = 300
+
+# Formats written as one numbered file per page
+PAGED_FORMATS = ('png', 'svg', 'json')
+RENDERERS = ('standard', 'fast')
+
+# Channels drawn as their own bar in the comparison plot; the rest share one
+COMPARISON_TOP_CHANNELS = 20
+
+# Preset lengths in days of get_recent_video_metrics windows (last 7, 28 and 90 days)
+RECENT_PERIODS = (7, 28, 90)
+
+# Metric queries of the consolidated layout. Each is a search of the
+# clustered (video_id, day) key; metric_indexes.py checks their plans.
+VIDEO_METRICS_SQL = 'SELECT day, day_views FROM video_metrics WHERE video_id = ? ORDER BY day'
+VIDEO_METRICS_RANGE_SQL = '''
+    SELECT day, day_views FROM video_metrics
+    WHERE video_id = ? AND day >= ? AND day < ?
+    ORDER BY day
+'''
+LATEST_METRIC_DAY_SQL = 'SELECT MAX(day) FROM video_metrics WHERE video_id = ?'
+
+# Day bounds that include every day; stored days start with a 4-digit year
+_FIRST_DAY = '0000'
+_AFTER_LAST_DAY = '9999'
+
+_connections = {}
+
+# Set by use_parquet() to read an exported Parquet dataset instead of SQLite
+_parquet_source = None
+
+# Set by use_cache() to serve videos and metrics from an in-memory cache
+_cache = None
+
+# Created on first use by get_fast_renderer(); one per process
+_fast_renderer = None
+
+
+def get_connection():
+    """Return the shared read-only connection to the analytics database.
+
+    One connection per database path is opened lazily and reused by every
+    query in this module, along with its detected storage layout.
+    """
+    if ANALYTICS_DB not in _connections:
+        conn = connect_reader(ANALYTICS_DB)
+        _connections[ANALYTICS_DB] = (conn, detect_layout(conn))
+    return _connections[ANALYTICS_DB]
+
+def close_connections():
+    """Close the shared connections."""
+    for conn, _ in _connections.values():
+        conn.close()
+    _connections.clear()
+
+def use_parquet(root):
+    """Read all data from a Parquet export (see parquet_store.py) instead of SQLite."""
+    global _parquet_source
+    from parquet_store import ParquetSource
+    _parquet_source = ParquetSource(root)
+
+def use_cache(budget_mb):
+    """Serve videos and metrics from an in-memory cache of up to ``budget_mb`` MB."""
+    global _cache
+    from analytics_cache import AnalyticsCache
+    _cache = AnalyticsCache(get_connection, budget_mb)
 
 def get_all_users():
     """Get all users from the database."""
-    conn = sqlite3.connect('lib/DB/youtube_analytics.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT user_id, user_name, channel_name FROM all_users')
-    users = cursor.fetchall()
-    
-    conn.close()
-    return users
+    if _parquet_source is not None:
+        return _parquet_source.get_all_users()
+    conn, _ = get_connection()
+    return conn.execute('SELECT user_id, user_name, channel_name FROM all_users').fetchall()
 
 def get_user_videos(user_id):
     """Get all videos for a specific user."""
-    conn = sqlite3.connect('lib/DB/youtube_analytics.db')
-    cursor = conn.cursor()
-    
-    safe_user_id = user_id.replace('-', '_')
-    cursor.execute(f'SELECT video_id, video_name, views FROM user_{safe_user_id}')
-    videos = cursor.fetchall()
+    if _parquet_source is not None:
+        return _parquet_source.get_user_videos(user_id)
+    if _cache is not None:
+        return _cache.get_user_videos(user_id)
+    conn, layout = get_connection()
     
-    conn.close()
-    return videos
+    if layout == CONSOLIDATED_LAYOUT:
+        return conn.execute(
+            'SELECT video_id, video_name, views FROM videos WHERE user_id = ?',
+            (user_id,)
+        ).fetchall()
+    return conn.execute(f'SELECT video_id, video_name, views FROM user_{safe_id(user_id)}').fetchall()
 
 def get_video_metrics(video_id):
     """Get all metrics for a specific video."""
-    conn = sqlite3.connect('lib/DB/youtube_analytics.db')
-    cursor = conn.cursor()
+    if _parquet_source is not None:
+        return _parquet_source.get_video_metrics(video_id)
+    if _cache is not None:
+        return _cache.get_video_metrics(video_id)
+    conn, layout = get_connection()
     
-    safe_video_id = video_id.replace('-', '_')
-    cursor.execute(f'''
+    if layout == CONSOLIDATED_LAYOUT:
+        return conn.execute(VIDEO_METRICS_SQL, (video_id,)).fetchall()
+    return conn.execute(f'''
         SELECT day, day_views 
-        FROM video_metrics_{safe_video_id}
+        FROM video_metrics_{safe_id(video_id)}
+        ORDER BY day
+    ''').fetchall()
+
+def _day_bounds(start_day=None, end_day=None):
+    """Return [low, high) day string bounds for inclusive dates or ISO date strings."""
+    low = str(start_day)[:10] if start_day is not None else _FIRST_DAY
+    if end_day is None:
+        return low, _AFTER_LAST_DAY
+    # Stored days carry a time of day, so the bound is the start of the next day
+    return low, (date.fromisoformat(str(end_day)[:10]) + timedelta(days=1)).isoformat()
+
+def get_video_metrics_range(video_id, start_day=None, end_day=None):
+    """Get a video's metrics from ``start_day`` to ``end_day``, both included.
+
+    Days are dates or ISO date strings, and either may be None for an open
+    end. In the consolidated layout only the rows in the range are read.
+    """
+    low, high = _day_bounds(start_day, end_day)
+    if _parquet_source is not None or _cache is not None:
+        return [row for row in get_video_metrics(video_id) if low <= row[0] < high]
+    conn, layout = get_connection()
+    
+    if layout == CONSOLIDATED_LAYOUT:
+        return conn.execute(VIDEO_METRICS_RANGE_SQL, (video_id, low, high)).fetchall()
+    return conn.execute(f'''
+        SELECT day, day_views
+        FROM video_metrics_{safe_id(video_id)}
+        WHERE day >= ? AND day < ?
         ORDER BY day
-    ''')
-    metrics = cursor.fetchall()
+    ''', (low, high)).fetchall()
+
+def get_latest_metric_day(video_id):
+    """Return the date of a video's newest metric day, or None if it has none."""
+    if _parquet_source is not None or _cache is not None:
+        metrics = get_video_metrics(video_id)
+        latest = metrics[-1][0] if metrics else None
+    else:
+        conn, layout = get_connection()
+        if layout == CONSOLIDATED_LAYOUT:
+            latest = conn.execute(LATEST_METRIC_DAY_SQL, (video_id,)).fetchone()[0]
+        else:
+            latest = conn.execute(f'SELECT MAX(day) FROM video_metrics_{safe_id(video_id)}').fetchone()[0]
+    return date.fromisoformat(str(latest)[:10]) if latest is not None else None
+
+def get_recent_video_metrics(video_id, days=28, as_of=None):
+    """Get a video's metrics of the ``days`` days up to ``as_of``, such as the last 28 days.
+
+    ``days`` is any positive number of days; RECENT_PERIODS lists the usual
+    ones. ``as_of`` defaults to the video's newest metric day, so a dataset
+    generated for another date still has recent days.
+    """
+    if days < 1:
+        raise ValueError(f'days must be positive, got {days!r}')
+    if as_of is None:
+        as_of = get_latest_metric_day(video_id)
+        if as_of is None:
+            return []
+    end_day = date.fromisoformat(str(as_of)[:10])
+    return get_video_metrics_range(video_id, end_day - timedelta(days=days - 1), end_day)
+
+def user_video_metrics_sql(count, ranged=False):
+    """Return the consolidated query of ``count`` videos' metrics, optionally limited to a day range."""
+    placeholders = ', '.join('?' * count)
+    day_range = 'AND day >= ? AND day < ?' if ranged else ''
+    return f'''
+        SELECT video_id, day, day_views
+        FROM video_metrics
+        WHERE video_id IN ({placeholders}) {day_range}
+        ORDER BY video_id, day
+    '''
+
+def get_user_video_metrics(user_id, video_ids):
+    """Get the metrics of some of a user's videos, grouped by video id.
+
+    Videos are read MAX_COMPOUND_SELECT at a time, with one IN query in the
+    consolidated layout or one UNION ALL over the video tables in the
+    per-table layout, so a user with hundreds of videos still costs only a
+    handful of queries.
+    """
+    if _parquet_source is not None:
+        return _parquet_source.get_user_video_metrics(user_id, video_ids)
+    if _cache is not None:
+        return _cache.get_user_video_metrics(user_id, video_ids)
+    conn, layout = get_connection()
+    metrics = {video_id: [] for video_id in video_ids}
     
-    conn.close()
+    for start in range(0, len(video_ids), MAX_COMPOUND_SELECT):
+        chunk = video_ids[start:start + MAX_COMPOUND_SELECT]
+        if layout == CONSOLIDATED_LAYOUT:
+            query = user_video_metrics_sql(len(chunk))
+        else:
+            query = ' UNION ALL '.join(
+                f'SELECT ? AS video_id, day, day_views FROM video_metrics_{safe_id(video_id)}'
+                for video_id in chunk
+            ) + ' ORDER BY video_id, day'
+        for video_id, day, day_views in conn.execute(query, chunk):
+            metrics[video_id].append((day, day_views))
     return metrics
 
-def plot_user_videos(user_id, user_name, channel_name):
-    """Create a plot for all videos of a user."""
-    videos = get_user_videos(user_id)
+def get_user_video_metrics_range(user_id, video_ids, start_day=None, end_day=None):
+    """Get the metrics of some of a user's videos from ``start_day`` to ``end_day``, grouped by video id."""
+    low, high = _day_bounds(start_day, end_day)
+    if _parquet_source is not None or _cache is not None:
+        return {
+            video_id: [row for row in metrics if low <= row[0] < high]
+            for video_id, metrics in get_user_video_metrics(user_id, video_ids).items()
+        }
+    conn, layout = get_connection()
+    metrics = {video_id: [] for video_id in video_ids}
+    
+    for start in range(0, len(video_ids), MAX_COMPOUND_SELECT):
+        chunk = video_ids[start:start + MAX_COMPOUND_SELECT]
+        if layout == CONSOLIDATED_LAYOUT:
+            rows = conn.execute(user_video_metrics_sql(len(chunk), ranged=True), [*chunk, low, high])
+        else:
+            query = ' UNION ALL '.join(
+                f'SELECT ? AS video_id, day, day_views FROM video_metrics_{safe_id(video_id)} '
+                f'WHERE day >= ? AND day < ?'
+                for video_id in chunk
+            ) + ' ORDER BY video_id, day'
+            rows = conn.execute(query, [value for video_id in chunk for value in (video_id, low, high)])
+        for video_id, day, day_views in rows:
+            metrics[video_id].append((day, day_views))
+    return metrics
+
+def get_user_video_metric_arrays(user_id, video_ids):
+    """Get (days, daily views) arrays for a batch of a user's videos.
+
+    The analytics cache hands out views of its columns as they are; other
+    sources are converted from get_user_video_metrics with pandas.
+    """
+    if _cache is not None:
+        return _cache.get_user_video_metric_arrays(user_id, video_ids)
+    all_metrics = get_user_video_metrics(user_id, video_ids)
+    with profiling.span('plot.dataframe'):
+        arrays = {}
+        for video_id, metrics in all_metrics.items():
+            df = pd.DataFrame(metrics, columns=['day', 'views'])
+            arrays[video_id] = (pd.to_datetime(df['day']), df['views'])
+    return arrays
+
+def get_user_metrics_summary(user_id, video_ids):
+    """Get (row count, last day, total views) of each of a user's videos.
+
+    This is what incremental runs compare to decide whether a user's plot
+    is stale: appending days changes the count and last day, and edits to
+    existing days almost always change the view total.
+    """
+    if _parquet_source is not None:
+        return _parquet_source.get_user_metrics_summary(user_id, video_ids)
+    conn, layout = get_connection()
+    
+    if layout == CONSOLIDATED_LAYOUT:
+        rows = conn.execute('''
+            SELECT m.video_id, COUNT(*), MAX(m.day), SUM(m.day_views)
+            FROM videos v
+            JOIN video_metrics m ON m.video_id = v.video_id
+            WHERE v.user_id = ?
+            GROUP BY m.video_id
+        ''', (user_id,))
+        return {video_id: summary for video_id, *summary in rows}
     
-    # Create a figure with subplots for each video
+    summaries = {}
+    for start in range(0, len(video_ids), MAX_COMPOUND_SELECT):
+        chunk = video_ids[start:start + MAX_COMPOUND_SELECT]
+        query = ' UNION ALL '.join(
+            f'SELECT ?, COUNT(*), MAX(day), SUM(day_views) FROM video_metrics_{safe_id(video_id)}'
+            for video_id in chunk
+        )
+        for video_id, *summary in conn.execute(query, chunk):
+            summaries[video_id] = summary
+    return summaries
+
+def get_channel_rollup_summary(user_id):
+    """Get (days, last day, total views) of a channel from its daily rollup.
+
+    This reads one row per day of the channel rather than one per video
+    and day. Returns None when reading a Parquet export or a database
+    without rollups.
+    """
+    if _parquet_source is not None:
+        return None
+    conn, _ = get_connection()
+    if conn.execute('PRAGMA table_info(channel_daily_rollup)').fetchone() is None:
+        return None
+    return conn.execute('''
+        SELECT COUNT(*), MAX(day), COALESCE(SUM(views), 0)
+        FROM channel_daily_rollup
+        WHERE user_id = ?
+    ''', (user_id,)).fetchone()
+
+def user_plot_path(user_name, output_format='png', page=None):
+    """Return an output file of a user's video plot.
+
+    Paginated PNG, SVG and JSON plots are written one file per page;
+    ``page`` selects which. PDF plots keep all pages in one file.
+    """
+    safe_user_name = user_name.replace(' ', '_')
+    page_suffix = f'_p{page:03d}' if page is not None and output_format in PAGED_FORMATS else ''
+    return os.path.join(GRAPHS_DIR, f'{safe_user_name}_videos{page_suffix}.{output_format}')
+
+def user_plot_key(user_name, videos_per_page=None, output_format='png'):
+    """Return the manifest key of a user's plot: its (first) output file."""
+    return user_plot_path(user_name, output_format, 1 if videos_per_page else None)
+
+def fingerprint(*parts):
+    """Hash JSON-serializable plot inputs into a short hex digest."""
+    payload = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.sha256(payload).hexdigest()
+
+def user_plot_fingerprint(user, videos_per_page=None, output_format='png', overlays=False, renderer='standard'):
+    """Fingerprint everything a user's plot is drawn from.
+
+    Besides the videos and their totals, the metrics are summarized from
+    the channel's daily rollup where there is one, so a run does not scan
+    every metric row before drawing anything.
+    """
+    user_id, user_name, channel_name = user
+    videos = get_user_videos(user_id)
+    summary = get_channel_rollup_summary(user_id)
+    if summary is None:
+        summary = get_user_metrics_summary(user_id, [video[0] for video in videos])
+    return fingerprint(
+        PLOT_VERSION, PLOT_DPI, videos_per_page, output_format, overlays, renderer,
+        user_name, channel_name, videos, summary
+    )
+
+def get_users_total_views():
+    """Get (user_name, channel_name, total_views) of all users."""
+    if _parquet_source is not None:
+        return _parquet_source.get_users_total_views()
+    conn, _ = get_connection()
+    return conn.execute('SELECT user_name, channel_name, total_views FROM all_users ORDER BY user_id').fetchall()
+
+def get_top_channels(top=COMPARISON_TOP_CHANNELS):
+    """Get the top channels by total views and (count, total views) of the others.
+
+    The top channels are (user_name, channel_name, total_views), most viewed
+    first, read from the views index of all_users.
+    """
+    if _parquet_source is not None:
+        users = _parquet_source.get_users_total_views()
+        top_users = top_n(users, top, key=lambda user: user[2])
+        return top_users, (len(users) - len(top_users), sum(u[2] for u in users) - sum(u[2] for u in top_users))
+    conn, _ = get_connection()
+    top_users, others = top_channels_with_others(conn, 'views', top)
+    return [tuple(row[1:]) for row in top_users], others
+
+def comparison_plot_fingerprint(top=COMPARISON_TOP_CHANNELS):
+    """Fingerprint the data behind the comparison plot."""
+    return fingerprint(PLOT_VERSION, PLOT_DPI, top, get_top_channels(top))
+
+def load_manifest():
+    """Load the output -> fingerprint manifest of the last run."""
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(manifest):
+    """Write the manifest, replacing the old one atomically."""
+    os.makedirs(GRAPHS_DIR, exist_ok=True)
+    tmp_path = f'{MANIFEST_PATH}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def is_up_to_date(manifest, path, current_fingerprint):
+    """Return whether an output exists and was drawn from the current data."""
+    return manifest.get(path) == current_fingerprint and os.path.exists(path)
+
+def draw_video_page(title, videos, all_metrics, windows=None):
+    """Draw one figure with a subplot per video and return it.
+
+    ``all_metrics`` maps each video id to its (days, daily views) arrays.
+    With ``windows`` (a window_analytics.ChannelWindows of the page) each
+    subplot also gets the moving average and the flagged spikes and dips.
+    """
     fig, axes = plt.subplots(len(videos), 1, figsize=(12, 4*len(videos)))
     if len(videos) == 1:
         axes = [axes]
     
-    fig.suptitle(f'View Patterns for {channel_name} ({user_name})', fontsize=16)
+    fig.suptitle(title, fontsize=16)
     
     for idx, (video_id, video_name, total_views) in enumerate(videos):
-        metrics = get_video_metrics(video_id)
-        
-        # Convert metrics to pandas DataFrame for easier handling
-        df = pd.DataFrame(metrics, columns=['day', 'views'])
-        df['day'] = pd.to_datetime(df['day'])
+        days, views = all_metrics[video_id]
         
         # Plot the data
-        ax = axes[idx]
-        ax.plot(df['day'], df['views'], marker='o', linestyle='-', markersize=4)
-        ax.set_title(f'{video_name} (Total Views: {total_views:,})')
-        ax.set_xlabel('Date')
-        ax.set_ylabel('Daily Views')
-        ax.grid(True, linestyle='--', alpha=0.7)
-        
-        # Rotate x-axis labels for better readability
-        plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
+        with profiling.span('plot.draw'):
+            ax = axes[idx]
+            ax.plot(days, views, marker='o', linestyle='-', markersize=4)
+            if windows is not None:
+                avg_days, avg, spike_days, spike_views, dip_days, dip_views = windows.overlay(video_id)
+                ax.plot(avg_days, avg, linestyle='-', linewidth=2, label=f'{windows.window}-day average')
+                ax.scatter(spike_days, spike_views, marker='^', color='tab:red', zorder=3, label='spike')
+                ax.scatter(dip_days, dip_views, marker='v', color='tab:purple', zorder=3, label='dip')
+                ax.legend(loc='upper right')
+            ax.set_title(f'{video_name} (Total Views: {total_views:,})')
+            ax.set_xlabel('Date')
+            ax.set_ylabel('Daily Views')
+            ax.grid(True, linestyle='--', alpha=0.7)
+            
+            # Rotate x-axis labels for better readability
+            plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
     
-    plt.tight_layout()
+    with profiling.span('plot.layout'):
+        fig.tight_layout()
+    return fig
+
+def remove_stale_pages(user_name, page_count, output_format='png'):
+    """Delete numbered pages left over from a run with more pages."""
+    extension = f'.{output_format}'
+    pattern = glob.escape(user_plot_path(user_name, output_format)).replace(extension, f'_p*{extension}')
+    keep = {user_plot_path(user_name, output_format, page) for page in range(1, page_count + 1)}
+    for path in glob.glob(pattern):
+        if path not in keep:
+            os.remove(path)
+
+def get_fast_renderer():
+    """Return this process's fast renderer, whose figures are reused across plots."""
+    global _fast_renderer
+    if _fast_renderer is None:
+        _fast_renderer = FastRenderer()
+    return _fast_renderer
+
+def plot_user_videos(user_id, user_name, channel_name, videos_per_page=None, output_format='png',
+                     overlays=False, renderer='standard'):
+    """Create a plot for all videos of a user.
+
+    By default every video goes into one figure. With ``videos_per_page``
+    the videos are split into pages, written as numbered files or as pages
+    of one PDF. ``renderer='fast'`` (always used for JSON) draws through
+    fast_render's reused figures instead of a new figure per page. Each
+    page's metrics are fetched and its figure closed before the next page
+    starts, so peak memory depends on the page size rather than the
+    channel size. ``overlays`` adds moving averages and anomaly markers
+    from window_analytics.
+    """
+    with profiling.span('plot.query'):
+        videos = get_user_videos(user_id)
+    if not videos:
+        print(f"  {channel_name} has no videos, skipping.")
+        return
     
-    # Create directory if it doesn't exist
-    os.makedirs('graphs', exist_ok=True)
+    per_page = videos_per_page or len(videos)
+    pages = [videos[i:i + per_page] for i in range(0, len(videos), per_page)]
+    title = f'View Patterns for {channel_name} ({user_name})'
     
-    # Save the figure
-    safe_user_name = user_name.replace(' ', '_')
-    plt.savefig(f'graphs/{safe_user_name}_videos.png', bbox_inches='tight', dpi=300)
-    plt.close()
-
-def plot_all_users_comparison():
-    """Create a comparison plot of total views for all users."""
-    conn = sqlite3.connect('lib/DB/youtube_analytics.db')
-    cursor = conn.cursor()
+    # Create directory if it doesn't exist
+    os.makedirs(GRAPHS_DIR, exist_ok=True)
     
-    cursor.execute('SELECT user_name, channel_name, total_views FROM all_users')
-    users = cursor.fetchall()
+    pdf = PdfPages(user_plot_path(user_name, 'pdf')) if output_format == 'pdf' else None
+    try:
+        for page_number, page_videos in enumerate(pages, start=1):
+            with profiling.span('plot.query'):
+                all_metrics = get_user_video_metric_arrays(user_id, [video[0] for video in page_videos])
+            windows = None
+            if overlays:
+                with profiling.span('plot.windows'):
+                    windows = ChannelWindows.from_arrays(all_metrics)
+            page_title = title if len(pages) == 1 else f'{title} - page {page_number}/{len(pages)}'
+            path = user_plot_path(user_name, output_format, page_number if videos_per_page else None)
+            
+            if renderer == 'fast' or output_format == 'json':
+                with profiling.span('plot.fast'):
+                    get_fast_renderer().render_page(
+                        path, page_title, page_videos, all_metrics, output_format, windows
+                    )
+                continue
+            
+            fig = draw_video_page(page_title, page_videos, all_metrics, windows)
+            
+            # Save the figure
+            with profiling.span('plot.savefig'):
+                if pdf is not None:
+                    pdf.savefig(fig, bbox_inches='tight', dpi=PLOT_DPI)
+                else:
+                    fig.savefig(path, bbox_inches='tight', dpi=PLOT_DPI)
+            plt.close(fig)
+    finally:
+        if pdf is not None:
+            pdf.close()
     
-    conn.close()
+    if output_format in PAGED_FORMATS and videos_per_page:
+        remove_stale_pages(user_name, len(pages), output_format)
+
+def plot_all_users_comparison(top=COMPARISON_TOP_CHANNELS):
+    """Create a comparison plot of total views of the top channels.
+
+    Only the ``top`` most viewed channels get a bar of their own; all other
+    channels are summed into one "others" bar, so the plot stays readable
+    and cheap with any number of channels.
+    """
+    users, (others_count, others_views) = get_top_channels(top)
     
     # Create the comparison plot
     plt.figure(figsize=(12, 6))
     
-    # Sort users by total views
-    users.sort(key=lambda x: x[2], reverse=True)
+    labels = [f"{user[1]}\n({user[0]})" for user in users]
+    values = [user[2] for user in users]
+    if others_count:
+        labels.append(f"{others_count:,} others")
+        values.append(others_views)
     
     # Create bar chart
-    bars = plt.bar(
-        [f"{user[1]}\n({user[0]})" for user in users],
-        [user[2] for user in users]
-    )
+    bars = plt.bar(labels, values)
     
     # Add value labels on top of each bar
     for bar in bars:
@@ -125,27 +558,175 @@ def plot_all_users_comparison():
     plt.tight_layout()
     
     # Save the figure
-    os.makedirs('graphs', exist_ok=True)
-    plt.savefig('graphs/all_users_comparison.png', bbox_inches='tight', dpi=300)
+    os.makedirs(GRAPHS_DIR, exist_ok=True)
+    plt.savefig(COMPARISON_PLOT, bbox_inches='tight', dpi=PLOT_DPI)
     plt.close()
 
-def main():
+def render_user_plot(user, videos_per_page=None, output_format='png', overlays=False, renderer='standard'):
+    """Render one user's plot and return (user_name, seconds taken)."""
+    user_id, user_name, channel_name = user
+    started = time.perf_counter()
+    plot_user_videos(user_id, user_name, channel_name, videos_per_page, output_format, overlays, renderer)
+    elapsed = time.perf_counter() - started
+    
+    # Pool workers never run exit handlers, so they save their profile as they go
+    if multiprocessing.parent_process() is not None:
+        profiling.flush()
+    return user_name, elapsed
+
+def _init_render_worker(analytics_db, parquet_root, cache_mb):
+    """Set up a rendering process: headless backend, same data source."""
+    global ANALYTICS_DB
+    matplotlib.use('Agg')
+    ANALYTICS_DB = analytics_db
+    if parquet_root is not None:
+        use_parquet(parquet_root)
+    if cache_mb is not None:
+        use_cache(cache_mb)
+
+def render_user_plots(users, workers=1, videos_per_page=None, output_format='png', overlays=False,
+                      renderer='standard'):
+    """Render the plots of all users and return their render times.
+
+    With more than one worker the plots are spread over a pool of processes
+    that each draw one figure at a time. Returns a list of
+    (user_name, seconds) in completion order.
+    """
+    render = functools.partial(
+        render_user_plot, videos_per_page=videos_per_page, output_format=output_format,
+        overlays=overlays, renderer=renderer
+    )
+    
+    if workers <= 1:
+        timings = []
+        for user in users:
+            print(f"Generating plots for {user[2]} ({user[1]})...")
+            timings.append(render(user))
+        return timings
+    
+    # Spawned workers start clean instead of inheriting this process's
+    # SQLite connection, and behave the same on Windows and Linux.
+    ctx = multiprocessing.get_context('spawn')
+    timings = []
+    initargs = (ANALYTICS_DB, _parquet_source and _parquet_source.root, _cache and _cache.budget // 2**20)
+    with ctx.Pool(workers, initializer=_init_render_worker, initargs=initargs) as pool:
+        for user_name, seconds in pool.imap_unordered(render, users):
+            print(f"Generated plots for {user_name} in {seconds:.2f}s "
+                  f"({len(timings) + 1}/{len(users)})")
+            timings.append((user_name, seconds))
+    return timings
+
+def print_render_summary(timings, wall_time):
+    """Print a summary of per-plot render times."""
+    if not timings:
+        return
+    
+    seconds = sorted(t for _, t in timings)
+    slowest_name, slowest = max(timings, key=lambda t: t[1])
+    p95 = seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))]
+    print(f"Rendered {len(timings)} user plots in {wall_time:.1f}s "
+          f"(sum of render times {sum(seconds):.1f}s)")
+    print(f"  per plot: mean {sum(seconds) / len(seconds):.2f}s, "
+          f"median {seconds[len(seconds) // 2]:.2f}s, p95 {p95:.2f}s, "
+          f"slowest {slowest:.2f}s ({slowest_name})")
+
+def parse_args(argv=None):
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description='Generate view graphs for all users.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of rendering processes (1 renders in-process)')
+    parser.add_argument('--videos-per-page', type=int,
+                        help='split each user plot into pages of this many videos')
+    parser.add_argument('--format', dest='output_format', choices=('png', 'svg', 'pdf', 'json'), default='png',
+                        help='png, svg and json write one file per page, pdf one multi-page file per user; '
+                             'json writes downsampled series for the app instead of drawing')
+    parser.add_argument('--renderer', choices=RENDERERS, default='standard',
+                        help='fast reuses figures, downsamples long series and writes 100 dpi images')
+    parser.add_argument('--overlays', action='store_true',
+                        help='overlay moving averages and flagged spikes and dips on the video plots')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only redraw plots whose data changed since the last run')
+    parser.add_argument('--analytics-db', default=ANALYTICS_DB,
+                        help='path to the analytics database')
+    parser.add_argument('--top-channels', type=int, default=COMPARISON_TOP_CHANNELS,
+                        help='channels shown individually in the comparison plot; the rest are summed')
+    parser.add_argument('--parquet', metavar='DIR',
+                        help='read from a Parquet export (parquet_store.py) instead of the database')
+    parser.add_argument('--cache-mb', type=int, metavar='MB',
+                        help='serve videos and metrics from an in-memory cache of up to MB megabytes per process')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='write a JSON profile of the run (phase timings, SQL per call site) to PATH')
+    parser.add_argument('--profile-cpu', action='store_true',
+                        help='with --profile, also run under cProfile')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, also trace allocations with tracemalloc')
+    args = parser.parse_args(argv)
+    if args.renderer == 'fast' and args.output_format not in FAST_FORMATS:
+        parser.error(f"the fast renderer writes {', '.join(FAST_FORMATS)}")
+    return args
+
+def main(argv=None):
     """Main function to generate all graphs."""
+    global ANALYTICS_DB
+    args = parse_args(argv)
+    ANALYTICS_DB = args.analytics_db
+    if args.profile:
+        profiling.enable(args.profile, args.profile_cpu, args.profile_memory)
+    if args.parquet:
+        use_parquet(args.parquet)
+    elif args.cache_mb:
+        use_cache(args.cache_mb)
+    
     print("Generating graphs...")
     
     # Get all users
     users = get_all_users()
     
+    # Fingerprints are recorded on every run so a later incremental run
+    # knows what each existing plot was drawn from
+    manifest = load_manifest()
+    plot_options = {'videos_per_page': args.videos_per_page, 'output_format': args.output_format}
+    with profiling.span('graphs.fingerprints'):
+        fingerprints = {
+            user_plot_key(user[1], **plot_options): user_plot_fingerprint(
+                user, overlays=args.overlays, renderer=args.renderer, **plot_options
+            )
+            for user in users
+        }
+        comparison_fingerprint = comparison_plot_fingerprint(args.top_channels)
+    
+    if args.incremental:
+        stale_users = []
+        for user in users:
+            key = user_plot_key(user[1], **plot_options)
+            if not is_up_to_date(manifest, key, fingerprints[key]):
+                stale_users.append(user)
+        print(f"{len(stale_users)} of {len(users)} user plots are out of date.")
+        users = stale_users
+    
     # Create individual plots for each user's videos
-    for user_id, user_name, channel_name in users:
-        print(f"Generating plots for {channel_name} ({user_name})...")
-        plot_user_videos(user_id, user_name, channel_name)
+    started = time.perf_counter()
+    timings = render_user_plots(
+        users, args.workers, overlays=args.overlays, renderer=args.renderer, **plot_options
+    )
+    print_render_summary(timings, time.perf_counter() - started)
+    for user_name, _ in timings:
+        key = user_plot_key(user_name, **plot_options)
+        manifest[key] = fingerprints[key]
     
     # Create comparison plot
-    print("Generating comparison plot...")
-    plot_all_users_comparison()
+    if is_up_to_date(manifest, COMPARISON_PLOT, comparison_fingerprint):
+        print("Comparison plot is up to date.")
+    else:
+        print("Generating comparison plot...")
+        with profiling.span('graphs.comparison'):
+            plot_all_users_comparison(args.top_channels)
+        manifest[COMPARISON_PLOT] = comparison_fingerprint
+    
+    save_manifest(manifest)
+    close_connections()
     
     print("Graph generation completed! Check the 'graphs' directory for the output files.")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,537 @@
+"""Live ingestion of view events into the analytics database.
+
+The service reads newline-delimited JSON events from a local TCP socket
+and/or a file, a stand-in for a real event stream::
+
+    {"video_id": "...", "day": "2025-01-31", "views": 1, "watchtime": 240, "impressions": 12}
+
+Only ``video_id`` is required; ``day`` defaults to today and the counters
+to 1 view and nothing else. Events that are not valid JSON or have a
+malformed field, such as a ``video_id`` that is not a string, a ``day``
+that is not an ISO date or a counter that is not a non-negative integer,
+are counted as rejected. Events are summed in memory into one bucket
+per video and day, and every ``--flush-interval`` seconds (or sooner when
+the buckets fill up) the buckets are added onto the daily metric rows,
+video totals, channel totals and rollups. Each flush is split into short
+transactions of at most ``--buckets-per-transaction`` buckets and runs on a
+writer thread, so reading continues while SQLite writes. When the buckets
+fill up while a flush is still running, the readers stop reading until it
+finishes, which pushes back on the senders through TCP flow control.
+
+    python ingest_service.py serve --port 8765
+    python ingest_service.py produce --port 8765 --events 200000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import profiling
+from analytics_schema import ANALYTICS_DB, CONSOLIDATED_LAYOUT, detect_layout, safe_id
+from db_connections import connect_reader, connect_writer, with_busy_retry
+from rankings import apply_ranking_deltas, has_rankings
+from rollups import apply_metric_deltas
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_FLUSH_INTERVAL = 2.0
+DEFAULT_MAX_BUCKETS = 100000
+DEFAULT_BUCKETS_PER_TRANSACTION = 500
+READ_CHUNK_BYTES = 1 << 16
+FOLLOW_POLL_SECONDS = 0.2
+STATS_INTERVAL = 10.0
+
+# Minimum seconds between reloads of the per-table video map on unknown videos
+VIDEO_MAP_RELOAD_INTERVAL = 60.0
+
+
+class WriteError(Exception):
+    """A write that failed part way, with the buckets it did not write.
+
+    ``failed`` holds the buckets of the transaction that was rolled back and
+    ``remaining`` those of the transactions never started.
+    """
+
+    def __init__(self, written, unknown, failed, remaining):
+        super().__init__(f'{len(failed) + len(remaining)} buckets not written')
+        self.written = written
+        self.unknown = unknown
+        self.failed = failed
+        self.remaining = remaining
+
+
+def _counter(event, name, default):
+    """Return a non-negative integer counter of an event, raising ValueError otherwise."""
+    value = event.get(name, default)
+    if type(value) is not int or value < 0:
+        raise ValueError(f'{name} must be a non-negative integer')
+    return value
+
+
+class MetricsWriter:
+    """Adds aggregated buckets onto the metric tables; used from one thread only."""
+
+    def __init__(self, analytics_db=ANALYTICS_DB, buckets_per_transaction=DEFAULT_BUCKETS_PER_TRANSACTION):
+        self.analytics_db = analytics_db
+        self.buckets_per_transaction = buckets_per_transaction
+        self.conn = None
+        # video_id -> (user_id, time of day of its metric rows)
+        self.videos = {}
+        self.videos_loaded_at = None
+        self.max_transaction_seconds = 0.0
+
+    def open(self):
+        self.conn = connect_writer(self.analytics_db)
+        self.layout = detect_layout(self.conn)
+        self.update_rollups = (
+            self.conn.execute('PRAGMA table_info(channel_daily_rollup)').fetchone() is not None
+        )
+        self.update_rankings = has_rankings(self.conn)
+        if self.layout != CONSOLIDATED_LAYOUT:
+            self._load_per_table_videos()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    @staticmethod
+    def _time_of_day(creation_date):
+        # Metric rows of a video share its creation time, at microsecond precision
+        return datetime.fromisoformat(creation_date).strftime('T%H:%M:%S.%f')
+
+    def _load_per_table_videos(self):
+        """Map every video to its channel; the per-table layout has no reverse lookup."""
+        self.videos = {}
+        self.videos_loaded_at = time.monotonic()
+        for (user_id,) in self.conn.execute('SELECT user_id FROM all_users').fetchall():
+            for video_id, creation_date in self.conn.execute(
+                f'SELECT video_id, creation_date FROM user_{safe_id(user_id)}'
+            ):
+                self.videos[video_id] = (user_id, self._time_of_day(creation_date))
+
+    def _lookup_video(self, video_id):
+        if video_id not in self.videos and self.layout == CONSOLIDATED_LAYOUT:
+            row = self.conn.execute(
+                'SELECT user_id, creation_date FROM videos WHERE video_id = ?', (video_id,)
+            ).fetchone()
+            if row is not None:
+                self.videos[video_id] = (row[0], self._time_of_day(row[1]))
+        return self.videos.get(video_id)
+
+    def _add_to_day(self, video_id, day, time_of_day, views, watchtime, impressions):
+        """Add a bucket onto its metric row, inserting the row if the day is new."""
+        if self.layout == CONSOLIDATED_LAYOUT:
+            table, video_filter, video_params = 'video_metrics', 'video_id = ? AND ', (video_id,)
+        else:
+            table, video_filter, video_params = f'video_metrics_{safe_id(video_id)}', '', ()
+
+        # Days are stored as ISO timestamps, so a day is a range of strings
+        next_day = (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+        cursor = self.conn.execute(f'''
+            UPDATE {table}
+            SET day_views = day_views + ?,
+                watchtime = watchtime + ?,
+                impressions = impressions + ?,
+                ctr = COALESCE(round(CAST(day_views + ? AS REAL) / NULLIF(impressions + ?, 0), 4), 0)
+            WHERE {video_filter}day >= ? AND day < ?
+        ''', (views, watchtime, impressions, views, impressions) + video_params + (day, next_day))
+        if cursor.rowcount:
+            return
+
+        ctr = round(views / impressions, 4) if impressions else 0.0
+        row = (str(uuid.uuid4()), day + time_of_day, views, impressions, ctr, watchtime)
+        self.conn.execute(f'''
+            INSERT INTO {table} ({'video_id, ' if video_params else ''}metric_id, day, day_views, impressions, ctr, watchtime)
+            VALUES ({'?, ' if video_params else ''}?, ?, ?, ?, ?, ?)
+        ''', video_params + row)
+
+    def _write_transaction(self, buckets):
+        """Write one chunk of buckets and the totals they change, then commit."""
+        video_totals = {}
+        channel_days = {}
+        for (video_id, day), (views, watchtime, impressions) in buckets:
+            user_id, time_of_day = self.videos[video_id]
+            self._add_to_day(video_id, day, time_of_day, views, watchtime, impressions)
+            totals = video_totals.setdefault(video_id, [0, 0])
+            totals[0] += views
+            totals[1] += watchtime
+            channel_days.setdefault(user_id, []).append((video_id, day, views, watchtime, impressions))
+
+        if self.layout == CONSOLIDATED_LAYOUT:
+            self.conn.executemany(
+                'UPDATE videos SET views = views + ?, watchtime = watchtime + ? WHERE video_id = ?',
+                [(views, watchtime, video_id) for video_id, (views, watchtime) in video_totals.items()]
+            )
+        else:
+            for video_id, (views, watchtime) in video_totals.items():
+                self.conn.execute(
+                    f'UPDATE user_{safe_id(self.videos[video_id][0])} '
+                    f'SET views = views + ?, watchtime = watchtime + ? WHERE video_id = ?',
+                    (views, watchtime, video_id)
+                )
+
+        self.conn.executemany('''
+            UPDATE all_users
+            SET total_views = total_views + ?, total_watchtime = total_watchtime + ?
+            WHERE user_id = ?
+        ''', [
+            (sum(d[2] for d in days), sum(d[3] for d in days), user_id)
+            for user_id, days in channel_days.items()
+        ])
+
+        if self.update_rollups:
+            for user_id, days in channel_days.items():
+                apply_metric_deltas(self.conn, user_id, (d[1:] for d in days))
+        if self.update_rankings:
+            channel_videos = {}
+            for video_id, (views, watchtime) in video_totals.items():
+                channel_videos.setdefault(self.videos[video_id][0], []).append(
+                    (video_id, None, views, 0.0, watchtime)
+                )
+            for user_id, days in channel_days.items():
+                apply_ranking_deltas(self.conn, user_id, channel_videos[user_id], (d[:3] for d in days))
+        self.conn.commit()
+
+    def _try_transaction(self, items):
+        # Roll back a failed transaction, so a busy one can be retried and
+        # any other error leaves no half-written chunk behind
+        try:
+            self._write_transaction(items)
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def write(self, buckets):
+        """Add a dict of (video_id, day) -> [views, watchtime, impressions] buckets.
+
+        Returns (buckets written, buckets of unknown videos dropped). Raises
+        WriteError when a transaction fails; the ones before it stay committed.
+        """
+        if self.conn is None:
+            self.open()
+
+        # Pick up videos published since the per-table map was built
+        if (self.layout != CONSOLIDATED_LAYOUT
+                and time.monotonic() - self.videos_loaded_at > VIDEO_MAP_RELOAD_INTERVAL
+                and any(video_id not in self.videos for video_id, _ in buckets)):
+            self._load_per_table_videos()
+
+        known = [item for item in buckets.items() if self._lookup_video(item[0][0]) is not None]
+        for start in range(0, len(known), self.buckets_per_transaction):
+            end = start + self.buckets_per_transaction
+            started = time.perf_counter()
+            try:
+                with profiling.span('ingest.transaction'):
+                    with_busy_retry(self._try_transaction, known[start:end])
+            except Exception as error:
+                raise WriteError(start, len(buckets) - len(known), known[start:end], known[end:]) from error
+            self.max_transaction_seconds = max(self.max_transaction_seconds, time.perf_counter() - started)
+        return len(known), len(buckets) - len(known)
+
+
+class IngestService:
+    """Aggregates events into per-video, per-day buckets and flushes them periodically."""
+
+    def __init__(self, writer, flush_interval=DEFAULT_FLUSH_INTERVAL, max_buckets=DEFAULT_MAX_BUCKETS):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.today = date.today().isoformat()
+        # A single writer thread keeps the SQLite connection on one thread
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.flush_lock = asyncio.Lock()
+        self.flush_requested = asyncio.Event()
+        self.room = asyncio.Event()
+        self.room.set()
+        self.stopping = False
+        self.stats = {
+            'events': 0, 'rejected': 0, 'unknown': 0, 'buckets_written': 0,
+            'flushes': 0, 'failed_flushes': 0, 'lost_buckets': 0, 'flush_seconds': 0.0, 'max_flush_seconds': 0.0,
+            'backpressure_waits': 0,
+        }
+
+    def add_event(self, line):
+        """Parse one JSON event line and add it to its bucket."""
+        try:
+            event = json.loads(line)
+            video_id = event['video_id']
+            if not isinstance(video_id, str):
+                raise TypeError('video_id must be a string')
+            day = date.fromisoformat(event.get('day', self.today)[:10]).isoformat()
+            counts = (
+                _counter(event, 'views', 1),
+                _counter(event, 'watchtime', 0),
+                _counter(event, 'impressions', 0),
+            )
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.stats['rejected'] += 1
+            return
+
+        self._add_to_bucket((video_id, day), counts)
+        self.stats['events'] += 1
+
+    def _add_to_bucket(self, key, counts):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self.buckets[key] = list(counts)
+        else:
+            bucket[0] += counts[0]
+            bucket[1] += counts[1]
+            bucket[2] += counts[2]
+
+    def add_lines(self, data):
+        """Add the complete lines of ``data`` and return its unfinished last line."""
+        lines = data.split(b'\n')
+        for line in lines[:-1]:
+            if line.strip():
+                self.add_event(line)
+        return lines[-1]
+
+    async def wait_for_room(self):
+        """Block a reader while the buckets are full until a flush empties them."""
+        if len(self.buckets) < self.max_buckets:
+            return
+        self.stats['backpressure_waits'] += 1
+        self.room.clear()
+        self.flush_requested.set()
+        await self.room.wait()
+
+    async def flush(self):
+        """Hand the current buckets to the writer thread and wait for it."""
+        async with self.flush_lock:
+            if not self.buckets:
+                return
+            buckets, self.buckets = self.buckets, {}
+            self.room.set()
+            self.today = date.today().isoformat()
+
+            started = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            try:
+                written, unknown = await loop.run_in_executor(self.executor, self.writer.write, buckets)
+            except WriteError as error:
+                # Buckets of transactions never started go back into the queue.
+                # The rolled back transaction's are lost rather than retried, so
+                # a bucket the database rejects cannot fail every later flush
+                self.stats['buckets_written'] += error.written
+                self.stats['unknown'] += error.unknown
+                self.stats['lost_buckets'] += len(error.failed)
+                for key, counts in error.remaining:
+                    self._add_to_bucket(key, counts)
+                print(f"Flush lost {len(error.failed):,} buckets, "
+                      f"re-queued {len(error.remaining):,}")
+                raise
+            elapsed = time.perf_counter() - started
+
+            self.stats['flushes'] += 1
+            self.stats['buckets_written'] += written
+            self.stats['unknown'] += unknown
+            self.stats['flush_seconds'] += elapsed
+            self.stats['max_flush_seconds'] = max(self.stats['max_flush_seconds'], elapsed)
+
+    async def flush_periodically(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # Keep serving; flush() re-queued what it could
+                self.stats['failed_flushes'] += 1
+                print(f"Flush failed:\n{traceback.format_exc()}")
+
+    async def read_stream(self, reader):
+        """Consume events from a stream until it closes."""
+        pending = b''
+        while True:
+            data = await reader.read(READ_CHUNK_BYTES)
+            if not data:
+                break
+            pending = self.add_lines(pending + data)
+            await self.wait_for_room()
+        if pending.strip():
+            self.add_event(pending)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            await self.read_stream(reader)
+        finally:
+            writer.close()
+
+    async def read_file(self, path, follow=False):
+        """Consume events from a file; with ``follow``, keep reading as it grows."""
+        pending = b''
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(READ_CHUNK_BYTES)
+                if not data:
+                    if not follow:
+                        break
+                    await asyncio.sleep(FOLLOW_POLL_SECONDS)
+                    continue
+                pending = self.add_lines(pending + data)
+                await self.wait_for_room()
+                # Let socket readers and the flusher run between chunks
+                await asyncio.sleep(0)
+        if pending.strip():
+            self.add_event(pending)
+
+    async def report_periodically(self, started):
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            self.print_stats(started)
+
+    def print_stats(self, started):
+        s = self.stats
+        elapsed = time.perf_counter() - started
+        print(f"  {s['events']:,} events ({s['events'] / elapsed:,.0f}/s), "
+              f"{s['buckets_written']:,} buckets in {s['flushes']:,} flushes "
+              f"({s['failed_flushes']:,} failed, {s['lost_buckets']:,} buckets lost), "
+              f"longest flush {s['max_flush_seconds']:.2f}s, "
+              f"longest transaction {self.writer.max_transaction_seconds:.3f}s, "
+              f"{s['rejected']:,} rejected, {s['unknown']:,} unknown videos, "
+              f"{s['backpressure_waits']:,} backpressure waits")
+
+    async def run(self, host=None, port=None, files=(), follow=False):
+        """Serve until cancelled, or until all files are read when there is no socket."""
+        started = time.perf_counter()
+        flusher = asyncio.create_task(self.flush_periodically())
+        reporter = asyncio.create_task(self.report_periodically(started))
+        server = None
+        try:
+            if port is not None:
+                server = await asyncio.start_server(self.handle_connection, host, port)
+                print(f"Listening for events on {host}:{port}")
+            readers = [self.read_file(path, follow) for path in files]
+            await asyncio.gather(*readers)
+            if server is not None:
+                await server.serve_forever()
+        finally:
+            if server is not None:
+                server.close()
+            reporter.cancel()
+            
+            # Let a flush that is under way finish before the last one
+            self.stopping = True
+            self.flush_requested.set()
+            await flusher
+            await self.flush()
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.writer.close)
+            self.executor.shutdown()
+            self.print_stats(started)
+
+
+def sample_video_ids(analytics_db=ANALYTICS_DB, limit=10000):
+    """Return up to ``limit`` video ids to send events for."""
+    conn = connect_reader(analytics_db)
+    try:
+        if detect_layout(conn) == CONSOLIDATED_LAYOUT:
+            return [row[0] for row in conn.execute('SELECT video_id FROM videos LIMIT ?', (limit,))]
+        video_ids = []
+        for (user_id,) in conn.execute('SELECT user_id FROM all_users').fetchall():
+            video_ids += [row[0] for row in conn.execute(f'SELECT video_id FROM user_{safe_id(user_id)}')]
+            if len(video_ids) >= limit:
+                break
+        return video_ids[:limit]
+    finally:
+        conn.close()
+
+
+async def produce(host, port, video_ids, events, days=1, batch=1000, seed=None):
+    """Send random view events for ``video_ids`` to a running service.
+
+    Each event is one view of a random video on one of the last ``days``
+    days. Writes wait for the socket to drain, so a service applying
+    backpressure slows the producer down.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    day_names = [(today - timedelta(days=i)).isoformat() for i in range(days)]
+    reader, writer = await asyncio.open_connection(host, port)
+    started = time.perf_counter()
+    try:
+        for start in range(0, events, batch):
+            lines = [
+                json.dumps({
+                    'video_id': rng.choice(video_ids),
+                    'day': rng.choice(day_names),
+                    'views': 1,
+                    'watchtime': rng.randint(10, 600),
+                    'impressions': rng.randint(1, 20),
+                })
+                for _ in range(min(batch, events - start))
+            ]
+            writer.write(('\n'.join(lines) + '\n').encode())
+            await writer.drain()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    elapsed = time.perf_counter() - started
+    print(f"Sent {events:,} events in {elapsed:.1f}s ({events / elapsed:,.0f}/s)")
+
+
+def parse_args(argv=None):
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description='Ingest live view events into youtube_analytics.db.')
+    parser.add_argument('--analytics-db', default=ANALYTICS_DB,
+                        help='path to the analytics database')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='run the ingestion service')
+    serve.add_argument('--host', default=DEFAULT_HOST, help='address to listen on')
+    serve.add_argument('--port', type=int, help=f'TCP port to listen on (e.g. {DEFAULT_PORT})')
+    serve.add_argument('--file', action='append', default=[], metavar='PATH',
+                       help='read events from a JSON lines file (repeatable)')
+    serve.add_argument('--follow', action='store_true',
+                       help='keep reading files as they grow, like tail -f')
+    serve.add_argument('--flush-interval', type=float, default=DEFAULT_FLUSH_INTERVAL,
+                       help='seconds between flushes to the database')
+    serve.add_argument('--max-buckets', type=int, default=DEFAULT_MAX_BUCKETS,
+                       help='buckets held in memory before readers wait for a flush')
+    serve.add_argument('--buckets-per-transaction', type=int, default=DEFAULT_BUCKETS_PER_TRANSACTION,
+                       help='buckets written per transaction, bounding how long the write lock is held')
+
+    send = commands.add_parser('produce', help='send random events to a running service')
+    send.add_argument('--host', default=DEFAULT_HOST, help='address of the service')
+    send.add_argument('--port', type=int, default=DEFAULT_PORT, help='port of the service')
+    send.add_argument('--events', type=int, default=100000, help='number of events to send')
+    send.add_argument('--days', type=int, default=1, help='spread events over the last N days')
+    send.add_argument('--seed', type=int, help='seed for the random events')
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve' and args.port is None and not args.file:
+        parser.error('serve needs --port and/or --file')
+    return args
+
+
+def main(argv=None):
+    """Run the ingestion service or the test event producer."""
+    args = parse_args(argv)
+
+    if args.command == 'produce':
+        video_ids = sample_video_ids(args.analytics_db)
+        if not video_ids:
+            print("No videos to send events for.")
+            return
+        asyncio.run(produce(args.host, args.port, video_ids, args.events, args.days, seed=args.seed))
+        return
+
+    writer = MetricsWriter(args.analytics_db, args.buckets_per_transaction)
+    service = IngestService(writer, args.flush_interval, args.max_buckets)
+    try:
+        asyncio.run(service.run(args.host, args.port, args.file, args.follow))
+    except KeyboardInterrupt:
+        print("Stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Query plan checks and clustering of the consolidated metrics table.
+
+The graph queries of the consolidated layout (graph_views.py) read one
+video's days, a date range of them, or the newest day, through the
+(video_id, day) key of ``video_metrics``. Created as a WITHOUT ROWID table
+(see analytics_schema.py) the rows are stored in that key's order, so each
+query is a range scan of exactly the rows it returns, without a sort.
+
+``python metric_indexes.py`` runs EXPLAIN QUERY PLAN on every such query
+and exits with status 1 if one would scan the table or sort through a
+temporary B-tree. ``--cluster`` rebuilds a ``video_metrics`` table created
+before it was WITHOUT ROWID, which also makes its covering index redundant:
+
+    python metric_indexes.py --cluster --vacuum
+"""
+import argparse
+import sys
+import time
+
+import graph_views
+from analytics_schema import ANALYTICS_DB, CONSOLIDATED_LAYOUT, create_consolidated_tables, detect_layout
+from db_connections import connect_reader, connect_writer
+
+# Videos in the batched query checked; any count gives the same plan
+CHECK_BATCH_VIDEOS = 3
+
+
+def explain(conn, sql, params):
+    """Return the detail lines of a query's plan."""
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def plan_problems(details):
+    """Return the plan lines that scan a whole table or sort in a temporary B-tree."""
+    return [detail for detail in details if detail.startswith('SCAN') or 'TEMP B-TREE' in detail]
+
+
+def metric_queries():
+    """Return (name, sql, params) of the consolidated graph queries, with placeholder values."""
+    batch = [''] * CHECK_BATCH_VIDEOS
+    return [
+        ('get_video_metrics', graph_views.VIDEO_METRICS_SQL, ('',)),
+        ('get_video_metrics_range', graph_views.VIDEO_METRICS_RANGE_SQL, ('', '', '')),
+        ('get_latest_metric_day', graph_views.LATEST_METRIC_DAY_SQL, ('',)),
+        ('get_user_video_metrics', graph_views.user_video_metrics_sql(CHECK_BATCH_VIDEOS), batch),
+        ('get_user_video_metrics_range',
+         graph_views.user_video_metrics_sql(CHECK_BATCH_VIDEOS, ranged=True), batch + ['', '']),
+    ]
+
+
+def check_query_plans(conn):
+    """Return {query name: (plan lines, problem lines)} for the consolidated graph queries."""
+    plans = {}
+    for name, sql, params in metric_queries():
+        details = explain(conn, sql, params)
+        plans[name] = (details, plan_problems(details))
+    return plans
+
+
+def is_clustered(conn):
+    """Return whether video_metrics is stored as a WITHOUT ROWID table."""
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'video_metrics'").fetchone()
+    return row is not None and 'WITHOUT ROWID' in row[0].upper()
+
+
+def cluster_video_metrics(conn):
+    """Rebuild a rowid video_metrics table as the WITHOUT ROWID table, in one transaction.
+
+    The old table is renamed, the current definition created and the rows
+    copied over in key order; dropping the old table drops its indexes.
+    """
+    conn.execute('ALTER TABLE video_metrics RENAME TO video_metrics_unclustered')
+    create_consolidated_tables(conn)
+    conn.execute('''
+    INSERT INTO video_metrics (video_id, day, metric_id, day_views, impressions, ctr, watchtime)
+    SELECT video_id, day, metric_id, day_views, impressions, ctr, watchtime
+    FROM video_metrics_unclustered
+    ORDER BY video_id, day
+    ''')
+    conn.execute('DROP TABLE video_metrics_unclustered')
+    conn.commit()
+
+
+def print_plans(plans):
+    for name, (details, problems) in plans.items():
+        print(f"{name}: {'ok' if not problems else 'NOT INDEXED'}")
+        for detail in details:
+            print(f"    {detail}")
+
+
+def main(argv=None):
+    """Check the metric query plans, after clustering video_metrics with --cluster."""
+    parser = argparse.ArgumentParser(description='Check that the metric queries are served by the (video_id, day) key.')
+    parser.add_argument('--analytics-db', default=ANALYTICS_DB,
+                        help='path to the analytics database')
+    parser.add_argument('--cluster', action='store_true',
+                        help='first rebuild video_metrics as a WITHOUT ROWID table if it is not one')
+    parser.add_argument('--vacuum', action='store_true',
+                        help='with --cluster, VACUUM afterwards to return the freed space')
+    args = parser.parse_args(argv)
+
+    if args.cluster:
+        conn = connect_writer(args.analytics_db, bulk=True)
+        try:
+            if detect_layout(conn) != CONSOLIDATED_LAYOUT:
+                print("The per-table layout has no video_metrics table to cluster.")
+            elif is_clustered(conn):
+                print("video_metrics is already clustered.")
+            else:
+                started = time.perf_counter()
+                cluster_video_metrics(conn)
+                if args.vacuum:
+                    conn.execute('VACUUM')
+                print(f"Clustered video_metrics in {time.perf_counter() - started:.1f}s")
+        finally:
+            conn.close()
+
+    conn = connect_reader(args.analytics_db)
+    try:
+        if detect_layout(conn) != CONSOLIDATED_LAYOUT:
+            # Each per-table query scans and sorts one video's own table
+            print("Per-table layout: every metric query reads a single video's table.")
+            return 0
+        plans = check_query_plans(conn)
+    finally:
+        conn.close()
+
+    print_plans(plans)
+    if any(problems for _, problems in plans.values()):
+        print("Some metric queries scan video_metrics or sort; run with --cluster to fix.")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+import argparse
+import sqlite3
+import time
+
+from analytics_schema import (
+    ANALYTICS_DB,
+    CONSOLIDATED_LAYOUT,
+    create_consolidated_indexes,
+    create_consolidated_tables,
+    detect_layout,
+    safe_id,
+)
+from db_connections import connect_writer
+
+DEFAULT_USERS_PER_COMMIT = 100
+
+
+# Tables are filled under these names and renamed when every user is
+# copied, so until then readers keep seeing the complete per-table layout
+STAGING_PREFIX = 'migrating_'
+
+
+def has_table(conn, name):
+    """Return whether a table exists, through the parsed schema rather than a scan of sqlite_master."""
+    return conn.execute(f'PRAGMA table_info({name})').fetchone() is not None
+
+
+def migrate_user(cursor, user_id, prefix=''):
+    """Copy one user's per-table videos and metrics into the consolidated tables.
+
+    Rows are copied with INSERT ... SELECT so they never pass through
+    Python. Rows whose key is already present are skipped, such as a day
+    stored twice in a per-video table or rows copied by an interrupted
+    run. Returns the number of videos, metric rows copied and metric rows
+    skipped.
+    """
+    safe_user_id = safe_id(user_id)
+    cursor.execute(f'''
+    INSERT OR IGNORE INTO {prefix}videos (
+        video_id, user_id, video_name, views, subs, revenue,
+        comments, watchtime, creation_date
+    )
+    SELECT video_id, ?, video_name, views, subs, revenue,
+           comments, watchtime, creation_date
+    FROM user_{safe_user_id}
+    ''', (user_id,))
+
+    video_ids = [row[0] for row in cursor.execute(f'SELECT video_id FROM user_{safe_user_id}')]
+    metric_count = skipped = 0
+    for video_id in video_ids:
+        insert = f'''
+        INSERT {{}} INTO {prefix}video_metrics (
+            video_id, metric_id, day, day_views, impressions, ctr, watchtime
+        )
+        SELECT ?, metric_id, day, day_views, impressions, ctr, watchtime
+        FROM video_metrics_{safe_id(video_id)}
+        '''
+        try:
+            copied = cursor.execute(insert.format(''), (video_id,)).rowcount
+        except sqlite3.IntegrityError:
+            # Only the failed statement is undone; copy again without the duplicates
+            copied = cursor.execute(insert.format('OR IGNORE'), (video_id,)).rowcount
+            skipped += cursor.execute(
+                f'SELECT COUNT(*) FROM video_metrics_{safe_id(video_id)}'
+            ).fetchone()[0] - copied
+        metric_count += copied
+
+    return len(video_ids), metric_count, skipped
+
+
+def drop_user_tables(cursor, user_id):
+    """Drop one user's per-table video and metric tables."""
+    safe_user_id = safe_id(user_id)
+    for (video_id,) in cursor.execute(f'SELECT video_id FROM user_{safe_user_id}').fetchall():
+        cursor.execute(f'DROP TABLE IF EXISTS video_metrics_{safe_id(video_id)}')
+    cursor.execute(f'DROP TABLE user_{safe_user_id}')
+
+
+def _copy_users(conn, user_ids, prefix, drop_old_tables, users_per_commit):
+    """Copy users into the tables named with ``prefix``, committing every ``users_per_commit`` users."""
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    videos = metrics = skipped = 0
+
+    for done, user_id in enumerate(user_ids, start=1):
+        user_videos, user_metrics, user_skipped = migrate_user(cursor, user_id, prefix)
+        videos += user_videos
+        metrics += user_metrics
+        skipped += user_skipped
+        if drop_old_tables:
+            drop_user_tables(cursor, user_id)
+
+        if done % users_per_commit == 0 or done == len(user_ids):
+            conn.commit()
+            elapsed = time.perf_counter() - started
+            print(f"  {done:,}/{len(user_ids):,} users, {videos:,} videos, "
+                  f"{metrics:,} metric rows in {elapsed:.1f}s")
+
+    if skipped:
+        print(f"  Skipped {skipped:,} metric rows whose video and day were already copied")
+
+
+def _drop_old_tables(conn, user_ids, users_per_commit):
+    """Drop the per-table tables of users, committing every ``users_per_commit`` users."""
+    cursor = conn.cursor()
+    for done, user_id in enumerate(user_ids, start=1):
+        drop_user_tables(cursor, user_id)
+        if done % users_per_commit == 0 or done == len(user_ids):
+            conn.commit()
+            print(f"  Dropped the tables of {done:,}/{len(user_ids):,} users")
+
+
+def migrate(db_path=ANALYTICS_DB, drop_old_tables=True, vacuum=False,
+            users_per_commit=DEFAULT_USERS_PER_COMMIT):
+    """Convert a per-table layout analytics database to the consolidated layout.
+
+    Users are copied into staging tables, which replace nothing until they
+    are renamed to videos and video_metrics in the last transaction, and
+    the old tables are only dropped after that. An interrupted migration
+    is resumed by running it again: users already staged are not copied
+    twice, and old tables left over once the database is consolidated
+    are copied (skipping rows already there) and dropped.
+    """
+    conn = connect_writer(db_path, bulk=True)
+
+    try:
+        user_ids = [row[0] for row in conn.execute('SELECT user_id FROM all_users')]
+
+        if detect_layout(conn) == CONSOLIDATED_LAYOUT:
+            leftover = [user_id for user_id in user_ids if has_table(conn, f'user_{safe_id(user_id)}')]
+            if not leftover or not drop_old_tables:
+                print("Database already uses the consolidated layout, nothing to do.")
+                return
+            print(f"Migrating the {len(leftover):,} users left over by an interrupted migration...")
+            _copy_users(conn, leftover, '', True, users_per_commit)
+        else:
+            create_consolidated_tables(conn, STAGING_PREFIX)
+            staged = {row[0] for row in conn.execute(f'SELECT DISTINCT user_id FROM {STAGING_PREFIX}videos')}
+            if staged:
+                print(f"Resuming after {len(staged):,} users already copied...")
+            _copy_users(conn, [user_id for user_id in user_ids if user_id not in staged],
+                        STAGING_PREFIX, False, users_per_commit)
+
+            conn.execute(f'ALTER TABLE {STAGING_PREFIX}videos RENAME TO videos')
+            conn.execute(f'ALTER TABLE {STAGING_PREFIX}video_metrics RENAME TO video_metrics')
+            conn.commit()
+
+            if drop_old_tables:
+                print("Dropping the per-table tables...")
+                _drop_old_tables(conn, user_ids, users_per_commit)
+
+        print("Building indexes...")
+        create_consolidated_indexes(conn)
+        conn.commit()
+
+        if vacuum:
+            print("Vacuuming...")
+            conn.execute('VACUUM')
+
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    """Migrate the analytics database to the consolidated layout."""
+    parser = argparse.ArgumentParser(
+        description='Convert youtube_analytics.db from per-video tables to the consolidated layout.'
+    )
+    parser.add_argument('--db', default=ANALYTICS_DB, help='path to the analytics database')
+    parser.add_argument('--keep-old-tables', action='store_true',
+                        help='leave the user_* and video_metrics_* tables in place')
+    parser.add_argument('--vacuum', action='store_true',
+                        help='VACUUM afterwards to give the freed pages back to the file system')
+    parser.add_argument('--users-per-commit', type=int, default=DEFAULT_USERS_PER_COMMIT,
+                        help='users migrated per transaction')
+    args = parser.parse_args(argv)
+
+    print(f"Migrating {args.db} to the consolidated layout...")
+    migrate(args.db, not args.keep_old_tables, args.vacuum, args.users_per_commit)
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Columnar Parquet export of the analytics database, and a reader for it.
+
+The export is a directory with three parts:
+
+* ``all_users.parquet``
+* ``videos/user_id=<id>/`` - each channel's videos
+* ``video_metrics/user_id=<id>/month=<YYYY-MM>/`` - daily metrics,
+  partitioned by channel and month, with ``day`` stored as a timestamp
+
+Rows are streamed out of SQLite in Arrow record batches of bounded size,
+so exporting does not need memory proportional to the database. For
+offline analytics, open the whole metrics dataset with
+``open_metrics_dataset`` and scan it columnar; ``ParquetSource`` serves the
+lookups graph_views.py needs.
+"""
+import argparse
+import os
+import shutil
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from analytics_schema import ANALYTICS_DB, CONSOLIDATED_LAYOUT, MAX_COMPOUND_SELECT, detect_layout, safe_id
+from db_connections import connect_reader
+
+DEFAULT_EXPORT_DIR = 'exports/parquet'
+DEFAULT_BATCH_ROWS = 65536
+
+# Rows are exported one channel at a time, so a record batch spans at most
+# one channel's months and each partition's files are written in one go;
+# the limits only need to cover a single channel
+MAX_PARTITIONS = 4096
+MAX_OPEN_FILES = 512
+
+DAY_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+USERS_SCHEMA = pa.schema([
+    ('user_id', pa.string()),
+    ('user_name', pa.string()),
+    ('channel_creation_date', pa.string()),
+    ('channel_name', pa.string()),
+    ('total_views', pa.int64()),
+    ('total_subs', pa.int64()),
+    ('total_comments', pa.int64()),
+    ('total_watchtime', pa.int64()),
+    ('total_revenue', pa.float64()),
+    ('channel_image_link', pa.string()),
+    ('description', pa.string()),
+])
+
+VIDEOS_SCHEMA = pa.schema([
+    ('user_id', pa.string()),
+    ('video_id', pa.string()),
+    ('video_name', pa.string()),
+    ('views', pa.int64()),
+    ('subs', pa.int64()),
+    ('revenue', pa.float64()),
+    ('comments', pa.int64()),
+    ('watchtime', pa.int64()),
+    ('creation_date', pa.string()),
+])
+
+METRICS_SCHEMA = pa.schema([
+    ('user_id', pa.string()),
+    ('month', pa.string()),
+    ('video_id', pa.string()),
+    ('metric_id', pa.string()),
+    ('day', pa.timestamp('us')),
+    ('day_views', pa.int64()),
+    ('impressions', pa.int64()),
+    ('ctr', pa.float64()),
+    ('watchtime', pa.int64()),
+])
+
+VIDEOS_PARTITIONING = ds.partitioning(pa.schema([('user_id', pa.string())]), flavor='hive')
+METRICS_PARTITIONING = ds.partitioning(
+    pa.schema([('user_id', pa.string()), ('month', pa.string())]), flavor='hive'
+)
+
+
+def _to_array(values, field):
+    """Build an Arrow array for a column; ISO day strings become timestamps."""
+    if pa.types.is_timestamp(field.type):
+        return pa.array(values, pa.string()).cast(field.type)
+    return pa.array(values, field.type)
+
+
+def record_batches(cursor, schema, batch_rows=DEFAULT_BATCH_ROWS):
+    """Yield the rows of an executed cursor as record batches of ``schema``."""
+    while True:
+        rows = cursor.fetchmany(batch_rows)
+        if not rows:
+            return
+        columns = zip(*rows)
+        yield pa.RecordBatch.from_arrays(
+            [_to_array(list(values), field) for values, field in zip(columns, schema)],
+            schema=schema,
+        )
+
+
+def _video_batches(conn, layout, batch_rows):
+    """Yield every video, with its user id, as record batches."""
+    columns = 'video_id, video_name, views, subs, revenue, comments, watchtime, creation_date'
+    for (user_id,) in conn.execute('SELECT user_id FROM all_users').fetchall():
+        if layout == CONSOLIDATED_LAYOUT:
+            cursor = conn.execute(f'SELECT user_id, {columns} FROM videos WHERE user_id = ?', (user_id,))
+        else:
+            cursor = conn.execute(f'SELECT ?, {columns} FROM user_{safe_id(user_id)}', (user_id,))
+        yield from record_batches(cursor, VIDEOS_SCHEMA, batch_rows)
+
+
+def _metric_batches(conn, layout, batch_rows):
+    """Yield every metric row, with its user id and month, as record batches, one channel at a time."""
+    columns = 'metric_id, day, day_views, impressions, ctr, watchtime'
+    for (user_id,) in conn.execute('SELECT user_id FROM all_users').fetchall():
+        if layout == CONSOLIDATED_LAYOUT:
+            cursor = conn.execute(f'''
+                SELECT v.user_id, substr(m.day, 1, 7), m.video_id, {', '.join('m.' + c for c in columns.split(', '))}
+                FROM videos v
+                JOIN video_metrics m ON m.video_id = v.video_id
+                WHERE v.user_id = ?
+            ''', (user_id,))
+            yield from record_batches(cursor, METRICS_SCHEMA, batch_rows)
+            continue
+
+        video_ids = [row[0] for row in conn.execute(f'SELECT video_id FROM user_{safe_id(user_id)}')]
+        for start in range(0, len(video_ids), MAX_COMPOUND_SELECT):
+            chunk = video_ids[start:start + MAX_COMPOUND_SELECT]
+            query = ' UNION ALL '.join(
+                f'SELECT ?, substr(day, 1, 7), ?, {columns} FROM video_metrics_{safe_id(video_id)}'
+                for video_id in chunk
+            )
+            params = [value for video_id in chunk for value in (user_id, video_id)]
+            yield from record_batches(conn.execute(query, params), METRICS_SCHEMA, batch_rows)
+
+
+def _write_dataset(batches, schema, path, partitioning):
+    """Stream record batches into a partitioned Parquet dataset at ``path``."""
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    ds.write_dataset(
+        batches,
+        path,
+        schema=schema,
+        format='parquet',
+        partitioning=partitioning,
+        basename_template='part-{i}.parquet',
+        max_partitions=MAX_PARTITIONS,
+        max_open_files=MAX_OPEN_FILES,
+    )
+
+
+def export_database(out_dir=DEFAULT_EXPORT_DIR, db_path=ANALYTICS_DB, batch_rows=DEFAULT_BATCH_ROWS):
+    """Export users, videos and metrics of an analytics database to Parquet."""
+    # write_dataset pulls batches from one of Arrow's threads; the connection
+    # is still only used by one thread at a time
+    conn = connect_reader(db_path, check_same_thread=False)
+    try:
+        layout = detect_layout(conn)
+        os.makedirs(out_dir, exist_ok=True)
+
+        with pq.ParquetWriter(os.path.join(out_dir, 'all_users.parquet'), USERS_SCHEMA) as writer:
+            for batch in record_batches(conn.execute('SELECT * FROM all_users'), USERS_SCHEMA, batch_rows):
+                writer.write_batch(batch)
+
+        _write_dataset(
+            _video_batches(conn, layout, batch_rows), VIDEOS_SCHEMA,
+            os.path.join(out_dir, 'videos'), VIDEOS_PARTITIONING
+        )
+        _write_dataset(
+            _metric_batches(conn, layout, batch_rows), METRICS_SCHEMA,
+            os.path.join(out_dir, 'video_metrics'), METRICS_PARTITIONING
+        )
+    finally:
+        conn.close()
+
+
+def open_metrics_dataset(root=DEFAULT_EXPORT_DIR):
+    """Open the whole exported metrics dataset for columnar scans."""
+    return ds.dataset(os.path.join(root, 'video_metrics'), format='parquet', partitioning=METRICS_PARTITIONING)
+
+
+def _rows(table, columns):
+    """Return the given columns of a table as a list of tuples."""
+    return list(zip(*(table.column(c).to_pylist() for c in columns)))
+
+
+class ParquetSource:
+    """Reads an exported dataset with the same lookups graph_views.py uses.
+
+    Per-user lookups open only that user's partition directory, so they
+    never list or scan other channels' files.
+    """
+
+    def __init__(self, root=DEFAULT_EXPORT_DIR):
+        self.root = root
+        # video_id -> user_id, read from the videos dataset on first use
+        self.video_users = None
+
+    def _user_dataset(self, name, user_id, partitioning=None):
+        path = os.path.join(self.root, name, f'user_id={user_id}')
+        if not os.path.isdir(path):
+            return None
+        return ds.dataset(path, format='parquet', partitioning=partitioning)
+
+    def get_all_users(self):
+        table = pq.read_table(os.path.join(self.root, 'all_users.parquet'),
+                              columns=['user_id', 'user_name', 'channel_name'])
+        return _rows(table, ['user_id', 'user_name', 'channel_name'])
+
+    def get_users_total_views(self):
+        table = pq.read_table(os.path.join(self.root, 'all_users.parquet'),
+                              columns=['user_id', 'user_name', 'channel_name', 'total_views'])
+        table = table.sort_by('user_id')
+        return _rows(table, ['user_name', 'channel_name', 'total_views'])
+
+    def get_user_videos(self, user_id):
+        dataset = self._user_dataset('videos', user_id)
+        if dataset is None:
+            return []
+        table = dataset.to_table(columns=['video_id', 'video_name', 'views'])
+        return _rows(table, ['video_id', 'video_name', 'views'])
+
+    def _user_metrics(self, user_id, video_ids, columns):
+        dataset = self._user_dataset('video_metrics', user_id, ds.partitioning(
+            pa.schema([('month', pa.string())]), flavor='hive'
+        ))
+        if dataset is None:
+            return None
+        return dataset.to_table(
+            columns=columns, filter=pc.field('video_id').isin(list(video_ids))
+        )
+
+    def get_user_video_metrics(self, user_id, video_ids):
+        metrics = {video_id: [] for video_id in video_ids}
+        table = self._user_metrics(user_id, video_ids, ['video_id', 'day', 'day_views'])
+        if table is None:
+            return metrics
+        table = table.sort_by([('video_id', 'ascending'), ('day', 'ascending')])
+        days = pc.strftime(table.column('day'), format=DAY_FORMAT).to_pylist()
+        for video_id, day, day_views in zip(table.column('video_id').to_pylist(), days,
+                                            table.column('day_views').to_pylist()):
+            metrics[video_id].append((day, day_views))
+        return metrics
+
+    def _video_user(self, video_id):
+        if self.video_users is None:
+            table = ds.dataset(
+                os.path.join(self.root, 'videos'), format='parquet', partitioning=VIDEOS_PARTITIONING
+            ).to_table(columns=['video_id', 'user_id'])
+            self.video_users = dict(_rows(table, ['video_id', 'user_id']))
+        return self.video_users.get(video_id)
+
+    def get_video_metrics(self, video_id):
+        # Only the video's channel partition is read
+        user_id = self._video_user(video_id)
+        table = self._user_metrics(user_id, [video_id], ['day', 'day_views']) if user_id else None
+        if table is None:
+            return []
+        table = table.sort_by('day')
+        days = pc.strftime(table.column('day'), format=DAY_FORMAT).to_pylist()
+        return list(zip(days, table.column('day_views').to_pylist()))
+
+    def get_user_metrics_summary(self, user_id, video_ids):
+        table = self._user_metrics(user_id, video_ids, ['video_id', 'day', 'day_views'])
+        if table is None:
+            return {}
+        summary = table.group_by('video_id').aggregate(
+            [('day', 'count'), ('day', 'max'), ('day_views', 'sum')]
+        )
+        last_days = pc.strftime(summary.column('day_max'), format=DAY_FORMAT).to_pylist()
+        return {
+            video_id: [count, last_day, views]
+            for video_id, count, last_day, views in zip(
+                summary.column('video_id').to_pylist(), summary.column('day_count').to_pylist(),
+                last_days, summary.column('day_views_sum').to_pylist()
+            )
+        }
+
+
+def main(argv=None):
+    """Export the analytics database to a partitioned Parquet dataset."""
+    parser = argparse.ArgumentParser(description='Export youtube_analytics.db to Parquet.')
+    parser.add_argument('--analytics-db', default=ANALYTICS_DB,
+                        help='path to the analytics database')
+    parser.add_argument('--out', default=DEFAULT_EXPORT_DIR,
+                        help='directory to write the dataset to')
+    parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS,
+                        help='rows per Arrow record batch (bounds memory use)')
+    args = parser.parse_args(argv)
+
+    print(f"Exporting {args.analytics_db} to {args.out}...")
+    started = time.perf_counter()
+    export_database(args.out, args.analytics_db, args.batch_rows)
+    print(f"Export completed in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""Opt-in profiling of the data generation and graph scripts.
+
+Profiling is off by default. It is switched on with the ``--profile PATH``
+option of generate_dummy_data.py and graph_views.py, or for any entry point
+by setting environment variables:
+
+* ``VPA_PROFILE=<path>`` - write a JSON report to ``path`` at exit
+* ``VPA_PROFILE_CPU=1`` - also run the process under cProfile
+* ``VPA_PROFILE_MEMORY=1`` - also trace allocations with tracemalloc
+
+The report has wall time per named span (``with span('plot.savefig'):``),
+SQL statements, rows and time per call site for connections opened with
+``connect``, and the optional cProfile and tracemalloc summaries. Worker
+processes inherit the settings and write their own span and SQL report to
+``<path stem>.<pid>.json``, refreshed by ``flush`` after every task.
+
+When profiling is off, ``span`` returns a shared no-op context manager,
+``connect`` returns a plain sqlite3 connection and ``flush`` returns at
+once, so the hooks can stay in hot paths.
+"""
+import atexit
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import sqlite3
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+PROFILE_ENV = 'VPA_PROFILE'
+PROFILE_CPU_ENV = 'VPA_PROFILE_CPU'
+PROFILE_MEMORY_ENV = 'VPA_PROFILE_MEMORY'
+# Process id of the process that turned profiling on, to tell workers apart
+PROFILE_OWNER_ENV = 'VPA_PROFILE_OWNER'
+
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 20
+
+_NULL_SPAN = contextlib.nullcontext()
+
+# Collected data of this process while profiling is on, else None
+_state = None
+
+
+def enabled():
+    """Return whether profiling is on in this process."""
+    return _state is not None
+
+
+def _new_state(path, cpu, memory):
+    state = {
+        'path': path,
+        'started': time.time(),
+        'started_perf': time.perf_counter(),
+        # name -> [count, total seconds, max seconds]
+        'spans': defaultdict(lambda: [0, 0.0, 0.0]),
+        # call site -> [statements, rows, seconds]
+        'sql': defaultdict(lambda: [0, 0, 0.0]),
+        'cpu': None,
+        'memory': memory,
+    }
+    if cpu:
+        state['cpu'] = cProfile.Profile()
+        state['cpu'].enable()
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return state
+
+
+def enable(path, cpu=False, memory=False):
+    """Turn profiling on and write the report to ``path`` when the process exits.
+
+    The settings are also exported to the environment so worker processes
+    started afterwards profile themselves too.
+    """
+    global _state
+    os.environ[PROFILE_ENV] = path
+    os.environ[PROFILE_CPU_ENV] = '1' if cpu else ''
+    os.environ[PROFILE_MEMORY_ENV] = '1' if memory else ''
+    os.environ[PROFILE_OWNER_ENV] = str(os.getpid())
+    if _state is None:
+        atexit.register(flush)
+    elif _state['cpu'] is not None:
+        _state['cpu'].disable()
+    _state = _new_state(path, cpu, memory)
+
+
+def _worker_path(path):
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.{os.getpid()}{ext or ".json"}'
+
+
+def _enable_from_env():
+    """Turn profiling on at import if the environment asks for it."""
+    global _state
+    path = os.environ.get(PROFILE_ENV)
+    if not path:
+        return
+    owner = os.environ.get(PROFILE_OWNER_ENV)
+    if owner and owner != str(os.getpid()):
+        # A worker; cProfile and tracemalloc only cover the process that asked for them
+        _state = _new_state(_worker_path(path), False, False)
+    else:
+        enable(path, bool(os.environ.get(PROFILE_CPU_ENV)), bool(os.environ.get(PROFILE_MEMORY_ENV)))
+
+
+def _reset_after_fork():
+    """Start a forked child with an empty report of its own."""
+    global _state
+    if _state is None:
+        return
+    if _state['cpu'] is not None:
+        _state['cpu'].disable()
+    if _state['memory']:
+        tracemalloc.stop()
+    _state = _new_state(_worker_path(os.environ.get(PROFILE_ENV) or _state['path']), False, False)
+
+
+class _Span:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        if _state is not None:
+            entry = _state['spans'][self.name]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+        return False
+
+
+def span(name):
+    """Return a context manager that times a named phase of the run."""
+    if _state is None:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def _call_site():
+    """Return 'module.py:function' of the first caller outside this module."""
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        return '<unknown>'
+    return f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}'
+
+
+def _record_sql(site, statements, rows, seconds):
+    if _state is not None:
+        entry = _state['sql'][site]
+        entry[0] += statements
+        entry[1] += rows
+        entry[2] += seconds
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor that records statements, rows and time against its call site.
+
+    Rows changed by a statement are counted when it runs; rows of a query
+    are counted as they are fetched, against the site that ran the query.
+    """
+
+    _site = '<unknown>'
+
+    def _run(self, method, sql, params):
+        self._site = _call_site()
+        started = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            changed = self.rowcount if self.rowcount > 0 else 0
+            _record_sql(self._site, 1, changed, time.perf_counter() - started)
+
+    def execute(self, sql, params=()):
+        return self._run(super().execute, sql, params)
+
+    def executemany(self, sql, params):
+        return self._run(super().executemany, sql, params)
+
+    def _fetched(self, rows, started):
+        _record_sql(self._site, 0, rows, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(row is not None, started)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(len(rows), started)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(len(rows), started)
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        _record_sql(self._site, 0, 1, 0.0)
+        return row
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection whose cursors, including those of execute(), are profiled."""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    # The built-in shortcuts create their cursor without calling cursor()
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, params):
+        return self.cursor().executemany(sql, params)
+
+
+def connect(database, **kwargs):
+    """Open a SQLite connection, profiled when profiling is on."""
+    if _state is None:
+        return sqlite3.connect(database, **kwargs)
+    return sqlite3.connect(database, factory=ProfiledConnection, **kwargs)
+
+
+def _cpu_report(profiler):
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, function), (_, calls, total, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': f'{os.path.basename(filename)}:{line}({function})',
+            'calls': calls,
+            'total_seconds': round(total, 6),
+            'cumulative_seconds': round(cumulative, 6),
+        })
+    rows.sort(key=lambda row: row['cumulative_seconds'], reverse=True)
+    return rows[:TOP_FUNCTIONS]
+
+
+def _memory_report():
+    snapshot = tracemalloc.take_snapshot()
+    return {
+        'peak_mb': round(tracemalloc.get_traced_memory()[1] / 2**20, 3),
+        'top': [
+            {
+                'site': f'{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}',
+                'size_mb': round(stat.size / 2**20, 3),
+                'count': stat.count,
+            }
+            for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+        ],
+    }
+
+
+def report():
+    """Return the data collected so far as a JSON-serializable dict."""
+    if _state is None:
+        return None
+    data = {
+        'pid': os.getpid(),
+        'argv': sys.argv,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(_state['started'])),
+        'wall_seconds': round(time.perf_counter() - _state['started_perf'], 6),
+        'spans': {
+            name: {'count': count, 'total_seconds': round(total, 6), 'max_seconds': round(longest, 6)}
+            for name, (count, total, longest) in sorted(_state['spans'].items())
+        },
+        'sql': {
+            site: {'statements': statements, 'rows': rows, 'seconds': round(seconds, 6)}
+            for site, (statements, rows, seconds) in sorted(
+                _state['sql'].items(), key=lambda item: item[1][2], reverse=True
+            )
+        },
+    }
+    if _state['cpu'] is not None:
+        data['cpu'] = _cpu_report(_state['cpu'])
+    if _state['memory'] and tracemalloc.is_tracing():
+        data['memory'] = _memory_report()
+    return data
+
+
+def flush():
+    """Write the report of this process to its file, if profiling is on."""
+    if _state is None:
+        return
+    if _state['cpu'] is not None:
+        _state['cpu'].disable()
+    try:
+        directory = os.path.dirname(_state['path'])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(_state['path'], 'w') as f:
+            json.dump(report(), f, indent=2)
+    finally:
+        if _state['cpu'] is not None:
+            _state['cpu'].enable()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+_enable_from_env()
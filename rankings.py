@@ -0,0 +1,442 @@
+"""Leaderboards of the top channels and videos, and streaming top-N helpers.
+
+Channel leaderboards are indexes on the ``all_users`` totals (views,
+revenue, watch time), so they stay current with every update of those
+totals. ``channel_totals`` holds the channel count and the sums of those
+totals over all channels in one row, kept current by triggers on
+``all_users``. Videos get two tables that exist in both storage layouts:
+
+* ``video_leaderboard`` - every video's channel, name and lifetime views,
+  revenue and watch time, indexed per metric
+* ``video_period_views`` - views per video and week (starting Monday) or
+  month, indexed by period and views
+
+Top-N queries read the first N entries of an index instead of every
+``user_*`` table. The tables are built in bulk with ``build_rankings`` and
+kept up to date by passing the changes of a channel to
+``apply_ranking_deltas``.
+
+Metrics without a leaderboard are ranked with ``TopN``, a bounded min-heap
+fed one row at a time, so ad-hoc rankings such as ``top_videos_by`` use
+memory proportional to N rather than to the number of videos.
+"""
+import argparse
+import heapq
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from analytics_schema import ANALYTICS_DB, CONSOLIDATED_LAYOUT, MAX_COMPOUND_SELECT, detect_layout, safe_id
+from db_connections import connect_reader, connect_writer
+from rollups import PERIODS, period_start
+
+DEFAULT_TOP = 10
+
+# Leaderboard metric -> column of all_users / video_leaderboard
+CHANNEL_METRICS = {'views': 'total_views', 'revenue': 'total_revenue', 'watchtime': 'total_watchtime'}
+VIDEO_METRICS = ('views', 'revenue', 'watchtime')
+
+RANKING_TABLES = (
+    '''
+    CREATE TABLE IF NOT EXISTS video_leaderboard (
+        video_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        video_name TEXT NOT NULL,
+        views INTEGER NOT NULL,
+        revenue REAL NOT NULL,
+        watchtime INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS video_period_views (
+        period TEXT NOT NULL,
+        period_start TEXT NOT NULL,
+        video_id TEXT NOT NULL,
+        views INTEGER NOT NULL,
+        PRIMARY KEY (period, period_start, video_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS channel_totals (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        channels INTEGER NOT NULL,
+        total_views INTEGER NOT NULL,
+        total_revenue REAL NOT NULL,
+        total_watchtime INTEGER NOT NULL
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS channel_totals_insert AFTER INSERT ON all_users
+    BEGIN
+        UPDATE channel_totals SET
+            channels = channels + 1,
+            total_views = total_views + NEW.total_views,
+            total_revenue = round(total_revenue + NEW.total_revenue, 2),
+            total_watchtime = total_watchtime + NEW.total_watchtime;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS channel_totals_update
+    AFTER UPDATE OF total_views, total_revenue, total_watchtime ON all_users
+    BEGIN
+        UPDATE channel_totals SET
+            total_views = total_views + NEW.total_views - OLD.total_views,
+            total_revenue = round(total_revenue + NEW.total_revenue - OLD.total_revenue, 2),
+            total_watchtime = total_watchtime + NEW.total_watchtime - OLD.total_watchtime;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS channel_totals_delete AFTER DELETE ON all_users
+    BEGIN
+        UPDATE channel_totals SET
+            channels = channels - 1,
+            total_views = total_views - OLD.total_views,
+            total_revenue = round(total_revenue - OLD.total_revenue, 2),
+            total_watchtime = total_watchtime - OLD.total_watchtime;
+    END
+    ''',
+)
+
+RANKING_INDEXES = tuple(
+    f'CREATE INDEX IF NOT EXISTS idx_all_users_{metric} ON all_users ({column})'
+    for metric, column in CHANNEL_METRICS.items()
+) + tuple(
+    f'CREATE INDEX IF NOT EXISTS idx_video_leaderboard_{metric} ON video_leaderboard ({metric})'
+    for metric in VIDEO_METRICS
+) + (
+    'CREATE INDEX IF NOT EXISTS idx_video_leaderboard_user ON video_leaderboard (user_id, views)',
+    'CREATE INDEX IF NOT EXISTS idx_video_period_views ON video_period_views (period, period_start, views)',
+)
+
+_UPSERT_VIDEO = '''
+    INSERT INTO video_leaderboard (video_id, user_id, video_name, views, revenue, watchtime)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (video_id) DO UPDATE SET
+        views = views + excluded.views,
+        revenue = round(revenue + excluded.revenue, 2),
+        watchtime = watchtime + excluded.watchtime
+'''
+
+_UPSERT_PERIOD_VIEWS = '''
+    INSERT INTO video_period_views (period, period_start, video_id, views)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (period, period_start, video_id) DO UPDATE SET views = views + excluded.views
+'''
+
+# SQL expressions mapping a metric day to the start of its period, as period_start() does
+_PERIOD_START_SQL = {
+    'week': "date(substr(day, 1, 10), 'weekday 0', '-6 days')",
+    'month': "substr(day, 1, 7) || '-01'",
+}
+
+
+def create_ranking_tables(conn):
+    """Create the video leaderboard tables and the channel_totals table and triggers."""
+    for statement in RANKING_TABLES:
+        conn.execute(statement)
+
+
+def create_ranking_indexes(conn):
+    """Create the leaderboard indexes, including those on all_users."""
+    for statement in RANKING_INDEXES:
+        conn.execute(statement)
+
+
+def has_rankings(conn):
+    """Return whether an analytics database has the leaderboard tables."""
+    return conn.execute('PRAGMA table_info(video_leaderboard)').fetchone() is not None
+
+
+def _build_per_table(conn):
+    """Fill the video leaderboards from per-table layout tables."""
+    user_ids = [row[0] for row in conn.execute('SELECT user_id FROM all_users')]
+    for user_id in user_ids:
+        conn.execute(f'''
+            INSERT INTO video_leaderboard (video_id, user_id, video_name, views, revenue, watchtime)
+            SELECT video_id, ?, video_name, views, revenue, watchtime FROM user_{safe_id(user_id)}
+        ''', (user_id,))
+        video_ids = [row[0] for row in conn.execute(f'SELECT video_id FROM user_{safe_id(user_id)}')]
+
+        for start in range(0, len(video_ids), MAX_COMPOUND_SELECT):
+            chunk = video_ids[start:start + MAX_COMPOUND_SELECT]
+            union = ' UNION ALL '.join(
+                f'SELECT ? AS video_id, day, day_views FROM video_metrics_{safe_id(video_id)}'
+                for video_id in chunk
+            )
+            for period, start_sql in _PERIOD_START_SQL.items():
+                conn.execute(f'''
+                    INSERT INTO video_period_views (period, period_start, video_id, views)
+                    SELECT ?, {start_sql}, video_id, SUM(day_views)
+                    FROM ({union})
+                    GROUP BY 2, 3
+                ''', [period] + chunk)
+
+
+def _build_consolidated(conn):
+    """Fill the video leaderboards from the consolidated tables."""
+    conn.execute('''
+        INSERT INTO video_leaderboard (video_id, user_id, video_name, views, revenue, watchtime)
+        SELECT video_id, user_id, video_name, views, revenue, watchtime FROM videos
+    ''')
+    for period, start_sql in _PERIOD_START_SQL.items():
+        conn.execute(f'''
+            INSERT INTO video_period_views (period, period_start, video_id, views)
+            SELECT ?, {start_sql}, video_id, SUM(day_views)
+            FROM video_metrics
+            GROUP BY 2, 3
+        ''', (period,))
+
+
+def build_rankings(conn):
+    """Rebuild the video leaderboards and create all ranking indexes, in one transaction."""
+    create_ranking_tables(conn)
+    conn.execute('DELETE FROM video_leaderboard')
+    conn.execute('DELETE FROM video_period_views')
+    conn.execute('DELETE FROM channel_totals')
+    conn.execute('''
+        INSERT INTO channel_totals (id, channels, total_views, total_revenue, total_watchtime)
+        SELECT 0, COUNT(*), COALESCE(SUM(total_views), 0),
+               round(COALESCE(SUM(total_revenue), 0), 2), COALESCE(SUM(total_watchtime), 0)
+        FROM all_users
+    ''')
+
+    if detect_layout(conn) == CONSOLIDATED_LAYOUT:
+        _build_consolidated(conn)
+    else:
+        _build_per_table(conn)
+
+    create_ranking_indexes(conn)
+    conn.commit()
+
+
+def apply_ranking_deltas(conn, user_id, videos, metric_days):
+    """Add the changes of one channel to the video leaderboards.
+
+    ``videos`` is an iterable of (video_id, video_name, views, revenue,
+    watchtime) increments; ``video_name`` is only used for videos not on the
+    leaderboard yet. ``metric_days`` is an iterable of (video_id, day,
+    day_views) rows, summed per video and period in Python before one
+    upsert per bucket. The channel leaderboards are indexes on all_users
+    and need nothing extra. The caller commits.
+    """
+    conn.executemany(_UPSERT_VIDEO, [
+        (video_id, user_id, video_name or '', views, revenue, watchtime)
+        for video_id, video_name, views, revenue, watchtime in videos
+    ])
+
+    periods = defaultdict(int)
+    for video_id, day, day_views in metric_days:
+        for period in PERIODS:
+            periods[(period, period_start(day, period), video_id)] += day_views
+    conn.executemany(_UPSERT_PERIOD_VIEWS, [key + (views,) for key, views in periods.items()])
+
+
+def top_channels(conn, metric='views', limit=DEFAULT_TOP):
+    """Get (user_id, user_name, channel_name, total) of the top channels by a metric."""
+    column = CHANNEL_METRICS[metric]
+    return conn.execute(f'''
+        SELECT user_id, user_name, channel_name, {column}
+        FROM all_users
+        ORDER BY {column} DESC
+        LIMIT ?
+    ''', (limit,)).fetchall()
+
+
+def top_channels_with_others(conn, metric='views', limit=DEFAULT_TOP):
+    """Get the top channels by a metric and (count, total) of all remaining channels.
+
+    The totals over all channels come from ``channel_totals``; databases
+    built before it existed fall back to summing all_users.
+    """
+    top = top_channels(conn, metric, limit)
+    column = CHANNEL_METRICS[metric]
+    totals = None
+    if conn.execute('PRAGMA table_info(channel_totals)').fetchone() is not None:
+        totals = conn.execute(f'SELECT channels, {column} FROM channel_totals').fetchone()
+    if totals is None:
+        totals = conn.execute(f'SELECT COUNT(*), COALESCE(SUM({column}), 0) FROM all_users').fetchone()
+    count, total = totals
+    return top, (count - len(top), total - sum(row[3] for row in top))
+
+
+def top_videos(conn, metric='views', limit=DEFAULT_TOP, user_id=None):
+    """Get (video_id, video_name, channel_name, total) of the top videos by a metric.
+
+    With ``user_id`` only that channel's videos are ranked.
+    """
+    if metric not in VIDEO_METRICS:
+        raise ValueError(f"unknown video metric: {metric}")
+    where = 'WHERE v.user_id = ?' if user_id is not None else ''
+    params = (user_id, limit) if user_id is not None else (limit,)
+    return conn.execute(f'''
+        SELECT v.video_id, v.video_name, u.channel_name, v.{metric}
+        FROM video_leaderboard v
+        JOIN all_users u ON u.user_id = v.user_id
+        {where}
+        ORDER BY v.{metric} DESC
+        LIMIT ?
+    ''', params).fetchall()
+
+
+def top_videos_in_period(conn, period, start, limit=DEFAULT_TOP):
+    """Get (video_id, video_name, channel_name, views) of the most viewed videos of one period.
+
+    ``start`` is any day of the period; it is mapped to the period's first day.
+    """
+    return conn.execute('''
+        SELECT p.video_id, v.video_name, u.channel_name, p.views
+        FROM video_period_views p
+        JOIN video_leaderboard v ON v.video_id = p.video_id
+        JOIN all_users u ON u.user_id = v.user_id
+        WHERE p.period = ? AND p.period_start = ?
+        ORDER BY p.views DESC
+        LIMIT ?
+    ''', (period, period_start(start, period), limit)).fetchall()
+
+
+class TopN:
+    """Keeps the ``n`` highest scored items pushed into it, in a min-heap.
+
+    Each push costs O(log n) and items scored below the current N-th best
+    are dropped at once, so arbitrarily long streams rank in O(n) memory.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.heap = []
+        # Breaks score ties in push order, so items themselves are never compared
+        self.pushed = 0
+
+    def push(self, score, item):
+        entry = (score, self.pushed, item)
+        self.pushed += 1
+        if len(self.heap) < self.n:
+            heapq.heappush(self.heap, entry)
+        elif score > self.heap[0][0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def items(self):
+        """Return the kept (score, item) pairs, best first."""
+        return [(score, item) for score, _, item in sorted(self.heap, key=lambda e: (-e[0], e[1]))]
+
+
+def top_n(rows, n, key):
+    """Return the ``n`` rows with the highest ``key(row)``, best first, from any iterable."""
+    top = TopN(n)
+    for row in rows:
+        top.push(key(row), row)
+    return [row for _, row in top.items()]
+
+
+def stream_video_totals(conn, start_day=None, end_day=None):
+    """Yield (video_id, user_id, views, impressions, watchtime) of every video over a day range.
+
+    Rows are produced one video at a time from a cursor (per channel in the
+    per-table layout), never as one list.
+    """
+    # Days carry a time of day, so the range ends before the day after end_day
+    start_day = start_day or ''
+    end_day = (date.fromisoformat(end_day) + timedelta(days=1)).isoformat() if end_day else '9999-12-31'
+    if detect_layout(conn) == CONSOLIDATED_LAYOUT:
+        yield from conn.execute('''
+            SELECT m.video_id, v.user_id, SUM(m.day_views), SUM(m.impressions), SUM(m.watchtime)
+            FROM video_metrics m
+            JOIN videos v ON v.video_id = m.video_id
+            WHERE m.day >= ? AND m.day < ?
+            GROUP BY m.video_id
+        ''', (start_day, end_day))
+        return
+
+    for (user_id,) in conn.execute('SELECT user_id FROM all_users').fetchall():
+        video_ids = [row[0] for row in conn.execute(f'SELECT video_id FROM user_{safe_id(user_id)}')]
+        for start in range(0, len(video_ids), MAX_COMPOUND_SELECT):
+            chunk = video_ids[start:start + MAX_COMPOUND_SELECT]
+            query = ' UNION ALL '.join(
+                f'SELECT ?, ?, SUM(day_views), SUM(impressions), SUM(watchtime) '
+                f'FROM video_metrics_{safe_id(video_id)} WHERE day >= ? AND day < ?'
+                for video_id in chunk
+            )
+            params = [value for video_id in chunk for value in (video_id, user_id, start_day, end_day)]
+            for row in conn.execute(query, params):
+                if row[2] is not None:
+                    yield row
+
+
+# Scores of the ad-hoc video rankings, from a (video_id, user_id, views, impressions, watchtime) row
+AD_HOC_SCORES = {
+    'views': lambda row: row[2],
+    'ctr': lambda row: row[2] / row[3] if row[3] else 0.0,
+    'watchtime': lambda row: row[4],
+    'watchtime_per_view': lambda row: row[4] / row[2] if row[2] else 0.0,
+}
+
+
+def top_videos_by(conn, score, limit=DEFAULT_TOP, start_day=None, end_day=None, min_views=0):
+    """Rank videos by an ad-hoc score over a day range with a streaming top-N.
+
+    ``score`` is a name from AD_HOC_SCORES or a callable taking a
+    stream_video_totals row. Returns (score, row) pairs, best first.
+    """
+    score = AD_HOC_SCORES.get(score, score)
+    top = TopN(limit)
+    for row in stream_video_totals(conn, start_day, end_day):
+        if row[2] >= min_views:
+            top.push(score(row), row)
+    return top.items()
+
+
+def main(argv=None):
+    """Rebuild the leaderboards or print a ranking."""
+    parser = argparse.ArgumentParser(description='Build and query channel and video leaderboards.')
+    parser.add_argument('--analytics-db', default=ANALYTICS_DB,
+                        help='path to the analytics database')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='rebuild the leaderboard tables and indexes')
+    parser.add_argument('--channels', choices=CHANNEL_METRICS, metavar='METRIC',
+                        help='print the top channels by views, revenue or watchtime')
+    parser.add_argument('--videos', choices=VIDEO_METRICS, metavar='METRIC',
+                        help='print the top videos by views, revenue or watchtime')
+    parser.add_argument('--period', choices=PERIODS,
+                        help='with --videos views, rank views within one week or month')
+    parser.add_argument('--start', help='a day (YYYY-MM-DD) in the --period, or the first day for --by')
+    parser.add_argument('--end', help='last day (YYYY-MM-DD) for --by')
+    parser.add_argument('--by', choices=AD_HOC_SCORES,
+                        help='rank videos by an ad-hoc score over the metrics, streamed through a heap')
+    parser.add_argument('--min-views', type=int, default=0,
+                        help='with --by, skip videos with fewer views in the range')
+    parser.add_argument('-n', '--top', type=int, default=DEFAULT_TOP,
+                        help='number of entries to print')
+    args = parser.parse_args(argv)
+
+    # Only a rebuild writes; rankings are read through a read-only connection
+    conn = connect_writer(args.analytics_db) if args.rebuild else connect_reader(args.analytics_db)
+    try:
+        if args.rebuild:
+            started = time.perf_counter()
+            build_rankings(conn)
+            print(f"Rebuilt leaderboards in {time.perf_counter() - started:.1f}s")
+
+        if args.channels:
+            for rank, (_, user_name, channel_name, total) in enumerate(
+                    top_channels(conn, args.channels, args.top), start=1):
+                print(f"{rank:>4}. {channel_name} ({user_name}): {total:,}")
+
+        if args.videos:
+            if args.period:
+                if args.videos != 'views' or not args.start:
+                    parser.error('--period ranks views and needs --start')
+                rows = top_videos_in_period(conn, args.period, args.start, args.top)
+            else:
+                rows = top_videos(conn, args.videos, args.top)
+            for rank, (_, video_name, channel_name, total) in enumerate(rows, start=1):
+                print(f"{rank:>4}. {video_name} - {channel_name}: {total:,}")
+
+        if args.by:
+            rows = top_videos_by(conn, args.by, args.top, args.start, args.end, args.min_views)
+            for rank, (score, (video_id, _, views, _, _)) in enumerate(rows, start=1):
+                print(f"{rank:>4}. {video_id}: {score:,.4f} ({views:,} views)")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""Pre-aggregated channel-level rollups of the daily video metrics.
+
+``channel_daily_rollup`` holds one row per channel and calendar day, and
+``channel_period_rollup`` one row per channel and week (starting Monday) or
+month. Both store summed views, watch time and impressions plus the
+impression-weighted CTR (total views / total impressions), so dashboard
+queries read O(days) rows instead of every video's metrics.
+
+The rollups are built in bulk after data generation (``build_rollups``) and
+kept up to date by passing newly inserted metric days to
+``apply_metric_deltas``.
+"""
+import argparse
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from analytics_schema import ANALYTICS_DB, CONSOLIDATED_LAYOUT, MAX_COMPOUND_SELECT, detect_layout, safe_id
+from db_connections import connect_writer
+
+
+PERIODS = ('week', 'month')
+
+ROLLUP_TABLES = (
+    '''
+    CREATE TABLE IF NOT EXISTS channel_daily_rollup (
+        user_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        views INTEGER NOT NULL,
+        watchtime INTEGER NOT NULL,
+        impressions INTEGER NOT NULL,
+        ctr REAL,
+        PRIMARY KEY (user_id, day)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS channel_period_rollup (
+        user_id TEXT NOT NULL,
+        period TEXT NOT NULL,
+        period_start TEXT NOT NULL,
+        views INTEGER NOT NULL,
+        watchtime INTEGER NOT NULL,
+        impressions INTEGER NOT NULL,
+        ctr REAL,
+        PRIMARY KEY (user_id, period, period_start)
+    ) WITHOUT ROWID
+    ''',
+)
+
+# Add new totals onto an existing bucket and recompute its weighted CTR
+_ADD_TO_BUCKET = '''
+    DO UPDATE SET
+        views = views + excluded.views,
+        watchtime = watchtime + excluded.watchtime,
+        impressions = impressions + excluded.impressions,
+        ctr = CAST(views + excluded.views AS REAL) / NULLIF(impressions + excluded.impressions, 0)
+'''
+
+_UPSERT_DAILY = f'''
+    INSERT INTO channel_daily_rollup (user_id, day, views, watchtime, impressions, ctr)
+    VALUES (?, ?, ?, ?, ?, CAST(? AS REAL) / NULLIF(?, 0))
+    ON CONFLICT (user_id, day) {_ADD_TO_BUCKET}
+'''
+
+_UPSERT_PERIOD = f'''
+    INSERT INTO channel_period_rollup (user_id, period, period_start, views, watchtime, impressions, ctr)
+    VALUES (?, ?, ?, ?, ?, ?, CAST(? AS REAL) / NULLIF(?, 0))
+    ON CONFLICT (user_id, period, period_start) {_ADD_TO_BUCKET}
+'''
+
+# SQL expressions mapping a daily rollup day to the start of its period
+_PERIOD_START_SQL = {
+    'week': "date(day, 'weekday 0', '-6 days')",
+    'month': "strftime('%Y-%m-01', day)",
+}
+
+
+def create_rollup_tables(conn):
+    """Create the rollup tables."""
+    for statement in ROLLUP_TABLES:
+        conn.execute(statement)
+
+
+def period_start(day, period):
+    """Return the first day ('YYYY-MM-DD') of the week or month containing ``day``."""
+    if period == 'month':
+        return f'{day[:7]}-01'
+    d = date.fromisoformat(day[:10])
+    return (d - timedelta(days=d.weekday())).isoformat()
+
+
+def _build_daily_per_table(conn):
+    """Fill channel_daily_rollup from per-table layout video tables."""
+    user_ids = [row[0] for row in conn.execute('SELECT user_id FROM all_users')]
+    for user_id in user_ids:
+        video_ids = [row[0] for row in conn.execute(f'SELECT video_id FROM user_{safe_id(user_id)}')]
+
+        # Chunks of one user can share days, so later chunks add onto earlier ones
+        for start in range(0, len(video_ids), MAX_COMPOUND_SELECT):
+            union = ' UNION ALL '.join(
+                f'SELECT day, day_views, watchtime, impressions FROM video_metrics_{safe_id(video_id)}'
+                for video_id in video_ids[start:start + MAX_COMPOUND_SELECT]
+            )
+            conn.execute(f'''
+                INSERT INTO channel_daily_rollup (user_id, day, views, watchtime, impressions, ctr)
+                SELECT ?, substr(day, 1, 10), SUM(day_views), SUM(watchtime), SUM(impressions),
+                       CAST(SUM(day_views) AS REAL) / NULLIF(SUM(impressions), 0)
+                FROM ({union})
+                WHERE true
+                GROUP BY 2
+                ON CONFLICT (user_id, day) {_ADD_TO_BUCKET}
+            ''', (user_id,))
+
+
+def _build_daily_consolidated(conn):
+    """Fill channel_daily_rollup from the consolidated video_metrics table."""
+    conn.execute('''
+        INSERT INTO channel_daily_rollup (user_id, day, views, watchtime, impressions, ctr)
+        SELECT v.user_id, substr(m.day, 1, 10), SUM(m.day_views), SUM(m.watchtime),
+               SUM(m.impressions), CAST(SUM(m.day_views) AS REAL) / NULLIF(SUM(m.impressions), 0)
+        FROM video_metrics m
+        JOIN videos v ON v.video_id = m.video_id
+        GROUP BY 1, 2
+    ''')
+
+
+def build_rollups(conn):
+    """Rebuild all rollups from the metrics tables, in one transaction.
+
+    Weekly and monthly rollups are aggregated from the daily rollup rather
+    than from the raw metrics.
+    """
+    create_rollup_tables(conn)
+    conn.execute('DELETE FROM channel_daily_rollup')
+    conn.execute('DELETE FROM channel_period_rollup')
+
+    if detect_layout(conn) == CONSOLIDATED_LAYOUT:
+        _build_daily_consolidated(conn)
+    else:
+        _build_daily_per_table(conn)
+
+    for period, start_sql in _PERIOD_START_SQL.items():
+        conn.execute(f'''
+            INSERT INTO channel_period_rollup (user_id, period, period_start, views, watchtime, impressions, ctr)
+            SELECT user_id, ?, {start_sql}, SUM(views), SUM(watchtime), SUM(impressions),
+                   CAST(SUM(views) AS REAL) / NULLIF(SUM(impressions), 0)
+            FROM channel_daily_rollup
+            GROUP BY 1, 3
+        ''', (period,))
+    conn.commit()
+
+
+def apply_metric_deltas(conn, user_id, metric_days):
+    """Add newly inserted metric days of one channel to its rollups.
+
+    ``metric_days`` is an iterable of (day, day_views, watchtime,
+    impressions) rows, e.g. the new rows of several videos. They are summed
+    per day and period in Python and added onto the rollups with one upsert
+    per bucket. The caller commits, normally in the same transaction as the
+    metric rows themselves.
+    """
+    daily = defaultdict(lambda: [0, 0, 0])
+    for day, day_views, watchtime, impressions in metric_days:
+        bucket = daily[day[:10]]
+        bucket[0] += day_views
+        bucket[1] += watchtime
+        bucket[2] += impressions
+
+    periods = defaultdict(lambda: [0, 0, 0])
+    for day, totals in daily.items():
+        for period in PERIODS:
+            bucket = periods[(period, period_start(day, period))]
+            for i, value in enumerate(totals):
+                bucket[i] += value
+
+    conn.executemany(_UPSERT_DAILY, [
+        (user_id, day, views, watchtime, impressions, views, impressions)
+        for day, (views, watchtime, impressions) in daily.items()
+    ])
+    conn.executemany(_UPSERT_PERIOD, [
+        (user_id, period, start, views, watchtime, impressions, views, impressions)
+        for (period, start), (views, watchtime, impressions) in periods.items()
+    ])
+
+
+def get_channel_daily(conn, user_id, start_day=None, end_day=None):
+    """Get (day, views, watchtime, impressions, ctr) rows of a channel, oldest first."""
+    return conn.execute('''
+        SELECT day, views, watchtime, impressions, ctr
+        FROM channel_daily_rollup
+        WHERE user_id = ? AND day >= ? AND day <= ?
+        ORDER BY day
+    ''', (user_id, start_day or '', end_day or '9999-12-31')).fetchall()
+
+
+def get_channel_periods(conn, user_id, period='week'):
+    """Get (period_start, views, watchtime, impressions, ctr) rows of a channel."""
+    return conn.execute('''
+        SELECT period_start, views, watchtime, impressions, ctr
+        FROM channel_period_rollup
+        WHERE user_id = ? AND period = ?
+        ORDER BY period_start
+    ''', (user_id, period)).fetchall()
+
+
+def main(argv=None):
+    """Rebuild the rollup tables of an analytics database."""
+    parser = argparse.ArgumentParser(description='Rebuild the channel rollup tables.')
+    parser.add_argument('--analytics-db', default=ANALYTICS_DB,
+                        help='path to the analytics database')
+    args = parser.parse_args(argv)
+
+    conn = connect_writer(args.analytics_db)
+    try:
+        started = time.perf_counter()
+        build_rollups(conn)
+        print(f"Rebuilt rollups in {time.perf_counter() - started:.1f}s")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""Compressed, checksummed snapshots of the analytics and login databases.
+
+A test cycle that needs the same large dataset every time can restore it
+from a snapshot instead of regenerating it:
+
+    python generate_dummy_data.py --users 10000 --seed 42 --as-of 2025-01-01 --snapshot fixtures/10k.zip
+
+The first run generates the data and dumps it; later runs with the same
+options restore the archive. Snapshots can also be handled directly:
+
+    python snapshots.py dump fixtures/demo.zip
+    python snapshots.py verify fixtures/demo.zip
+    python snapshots.py restore fixtures/demo.zip
+
+A snapshot is a zip archive with both databases, deflated at zlib's
+fastest level, and a manifest.json recording the size and SHA-256 of each
+database and the options it was generated with. Dumps copy the live
+databases with SQLite's online backup API, ``BACKUP_PAGES`` pages per
+step. Restores stream each database out of the archive while hashing it
+and move it into place when nothing has the target open; otherwise the
+restored copy is written into the open database through the backup API.
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+
+import profiling
+from analytics_schema import ANALYTICS_DB, LOGIN_DB
+from db_connections import connect_reader, connect_writer, database_in_use
+
+SNAPSHOT_FORMAT = 1
+MANIFEST = 'manifest.json'
+BACKUP_PAGES = 4096
+COMPRESS_LEVEL = 1
+CHUNK_BYTES = 1 << 20
+
+
+def _temp_path(next_to, suffix):
+    """Create an empty temporary file in the directory of ``next_to``."""
+    directory = os.path.dirname(os.path.abspath(next_to))
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=f'{os.path.basename(next_to)}.', suffix=suffix, dir=directory)
+    os.close(fd)
+    return path
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def backup_database(db_path, copy_path, pages=BACKUP_PAGES):
+    """Copy a live database into ``copy_path`` with the online backup API."""
+    source = connect_reader(db_path)
+    target = profiling.connect(copy_path)
+    try:
+        source.backup(target, pages=pages, sleep=0)
+        # A single file without a WAL, whatever mode the source is in
+        target.execute('PRAGMA journal_mode = DELETE').fetchone()
+    finally:
+        target.close()
+        source.close()
+
+
+def dump_snapshot(archive_path, analytics_db=ANALYTICS_DB, login_db=LOGIN_DB, params=None):
+    """Write both databases to a snapshot archive and return its manifest.
+
+    ``params`` records how the data was generated, for restores to compare.
+    The archive is written next to ``archive_path`` and moved into place
+    once complete.
+    """
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'params': params or {},
+        'databases': {},
+    }
+    partial_path = _temp_path(archive_path, '.partial')
+    try:
+        with zipfile.ZipFile(partial_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as archive:
+            for name, db_path in (('analytics', analytics_db), ('login', login_db)):
+                copy_path = _temp_path(archive_path, '.db')
+                try:
+                    with profiling.span('snapshot.backup'):
+                        backup_database(db_path, copy_path)
+                    member = f'{name}.db'
+                    digest = hashlib.sha256()
+                    with profiling.span('snapshot.compress'):
+                        with open(copy_path, 'rb') as src, archive.open(member, 'w', force_zip64=True) as dst:
+                            for chunk in iter(functools.partial(src.read, CHUNK_BYTES), b''):
+                                digest.update(chunk)
+                                dst.write(chunk)
+                    manifest['databases'][name] = {
+                        'member': member,
+                        'bytes': os.path.getsize(copy_path),
+                        'sha256': digest.hexdigest(),
+                    }
+                finally:
+                    _remove(copy_path)
+            archive.writestr(MANIFEST, json.dumps(manifest, indent=2))
+        if os.path.exists(archive_path):
+            shutil.copymode(archive_path, partial_path)
+        os.replace(partial_path, archive_path)
+    finally:
+        _remove(partial_path)
+    return manifest
+
+
+def _read_manifest(archive):
+    manifest = json.loads(archive.read(MANIFEST))
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format: {manifest.get('format')}")
+    return manifest
+
+
+def read_manifest(archive_path):
+    """Return the manifest of a snapshot archive."""
+    with zipfile.ZipFile(archive_path) as archive:
+        return _read_manifest(archive)
+
+
+def _extract(archive, entry, out_path=None):
+    """Stream one database out of the archive, checking its size and checksum.
+
+    With ``out_path`` None the data is only checked. Raises ValueError if
+    it does not match the manifest.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    out = open(out_path, 'wb') if out_path is not None else None
+    try:
+        with archive.open(entry['member']) as src:
+            for chunk in iter(functools.partial(src.read, CHUNK_BYTES), b''):
+                digest.update(chunk)
+                size += len(chunk)
+                if out is not None:
+                    out.write(chunk)
+    finally:
+        if out is not None:
+            out.close()
+    if size != entry['bytes'] or digest.hexdigest() != entry['sha256']:
+        raise ValueError(f"Snapshot member {entry['member']} does not match its checksum")
+
+
+def verify_snapshot(archive_path):
+    """Check every database in a snapshot against its manifest and return the manifest."""
+    with zipfile.ZipFile(archive_path) as archive:
+        manifest = _read_manifest(archive)
+        for entry in manifest['databases'].values():
+            _extract(archive, entry)
+    return manifest
+
+
+def _install(restored_path, db_path):
+    """Put a restored database in place of ``db_path``; return how it was done."""
+    if os.path.exists(db_path) and database_in_use(db_path):
+        # Open connections keep the old file if it is replaced, so write into it
+        source = profiling.connect(restored_path)
+        target = connect_writer(db_path)
+        try:
+            source.backup(target, pages=BACKUP_PAGES, sleep=0)
+        finally:
+            target.close()
+            source.close()
+        return 'copied'
+
+    if os.path.exists(db_path):
+        shutil.copymode(db_path, restored_path)
+    os.replace(restored_path, db_path)
+    # A journal left next to the old file is stale
+    _remove(db_path + '-journal')
+    return 'replaced'
+
+
+def restore_snapshot(archive_path, analytics_db=ANALYTICS_DB, login_db=LOGIN_DB):
+    """Restore both databases from a snapshot and return its manifest.
+
+    Both databases are extracted and checked against the manifest before
+    either replaces the current one, so a damaged archive leaves the
+    databases untouched.
+    """
+    targets = (('analytics', analytics_db), ('login', login_db))
+    restored = {name: _temp_path(db_path, '.restore') for name, db_path in targets}
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            manifest = _read_manifest(archive)
+            for name, _ in targets:
+                with profiling.span('snapshot.extract'):
+                    _extract(archive, manifest['databases'][name], restored[name])
+
+        for name, db_path in targets:
+            started = time.perf_counter()
+            with profiling.span('snapshot.install'):
+                method = _install(restored[name], db_path)
+            size_mb = manifest['databases'][name]['bytes'] / 2**20
+            print(f"  {db_path}: {method}, {size_mb:,.1f} MB in {time.perf_counter() - started:.2f}s")
+    finally:
+        for path in restored.values():
+            _remove(path)
+    return manifest
+
+
+def main(argv=None):
+    """Dump, verify or restore a snapshot of the analytics and login databases."""
+    parser = argparse.ArgumentParser(description='Dump and restore snapshots of the databases.')
+    parser.add_argument('--analytics-db', default=ANALYTICS_DB,
+                        help='path to the analytics database')
+    parser.add_argument('--login-db', default=LOGIN_DB,
+                        help='path to the login database')
+    parser.add_argument('command', choices=('dump', 'verify', 'restore'))
+    parser.add_argument('archive', help='path to the snapshot archive')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    if args.command == 'dump':
+        manifest = dump_snapshot(args.archive, args.analytics_db, args.login_db)
+        archive_mb = os.path.getsize(args.archive) / 2**20
+        data_mb = sum(entry['bytes'] for entry in manifest['databases'].values()) / 2**20
+        print(f"Wrote {args.archive}: {data_mb:,.1f} MB of databases in {archive_mb:,.1f} MB")
+    elif args.command == 'verify':
+        verify_snapshot(args.archive)
+        print(f"{args.archive} matches its checksums")
+    else:
+        print(f"Restoring {args.archive}...")
+        restore_snapshot(args.archive, args.analytics_db, args.login_db)
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
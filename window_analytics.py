@@ -0,0 +1,309 @@
+"""Moving averages, growth rates, CTR trends and anomaly flags per video.
+
+All videos of a channel are laid out as one (videos x days) float array on
+a shared calendar axis, with NaN for days before a video was published, and
+every statistic is computed for the whole array at once from cumulative
+sums:
+
+* trailing moving averages of daily views (``window`` and ``long_window`` days)
+* day-over-day growth, and week-over-week growth of the trailing 7-day sums
+* impression-weighted CTR over both windows and its trend (short minus long)
+* z-scores of each day against the preceding ``window`` days, flagging
+  spikes and dips beyond ``z_threshold``
+
+The z-scores are taken of log views, since spikes and dips scale a video's
+views by a factor and its baseline decays over time. Per-video summaries
+and the flagged days can be stored in the analytics database with
+``persist``.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from analytics_cache import load_channel
+from analytics_schema import ANALYTICS_DB, detect_layout
+from db_connections import connect_reader, connect_writer
+
+DEFAULT_WINDOW = 7
+DEFAULT_LONG_WINDOW = 28
+DEFAULT_Z_THRESHOLD = 2.5
+WEEK = 7
+
+WINDOW_TABLES = (
+    '''
+    CREATE TABLE IF NOT EXISTS video_trend_summary (
+        user_id TEXT NOT NULL,
+        video_id TEXT NOT NULL,
+        last_day TEXT NOT NULL,
+        views_avg REAL,
+        views_avg_long REAL,
+        wow_growth REAL,
+        ctr REAL,
+        ctr_trend REAL,
+        spikes INTEGER NOT NULL,
+        dips INTEGER NOT NULL,
+        PRIMARY KEY (user_id, video_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS video_anomalies (
+        user_id TEXT NOT NULL,
+        video_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        views INTEGER NOT NULL,
+        zscore REAL NOT NULL,
+        PRIMARY KEY (user_id, video_id, day)
+    ) WITHOUT ROWID
+    ''',
+)
+
+
+def _cumulative(matrix):
+    """Return cumulative sums of a matrix along its days, with a leading zero column."""
+    out = np.zeros((matrix.shape[0], matrix.shape[1] + 1))
+    np.cumsum(matrix, axis=1, out=out[:, 1:])
+    return out
+
+
+def _window_differences(cumulative, window):
+    """Return trailing window totals from cumulative sums; the first days get partial windows."""
+    head = cumulative[:, 1:window]
+    return np.concatenate([head, cumulative[:, window:] - cumulative[:, :-window]], axis=1)
+
+
+def rolling_sum(matrix, window):
+    """Return trailing ``window``-day sums of the non-missing values and their counts."""
+    valid = ~np.isnan(matrix)
+    sums = _cumulative(np.where(valid, matrix, 0.0))
+    counts = _cumulative(valid.astype(np.float64))
+    return _window_differences(sums, window), _window_differences(counts, window)
+
+
+def rolling_mean(matrix, window, min_periods=None):
+    """Return trailing means, NaN where fewer than ``min_periods`` (default all) days exist."""
+    sums, counts = rolling_sum(matrix, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts >= (min_periods or window), sums / counts, np.nan)
+
+
+def shift(matrix, days):
+    """Return a matrix moved ``days`` columns later, with NaN shifted in."""
+    out = np.full_like(matrix, np.nan)
+    if days < matrix.shape[1]:
+        out[:, days:] = matrix[:, :matrix.shape[1] - days]
+    return out
+
+
+def growth(current, previous):
+    """Return the relative change from ``previous`` to ``current``, NaN where undefined."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(previous > 0, current / previous - 1.0, np.nan)
+
+
+def rolling_zscore(matrix, window):
+    """Return each day's z-score against the mean and spread of the ``window`` days before it."""
+    sums, counts = rolling_sum(matrix, window)
+    squares, _ = rolling_sum(matrix * matrix, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(counts >= window, sums / counts, np.nan)
+        variance = np.maximum(squares / counts - mean * mean, 0.0)
+        mean, std = shift(mean, 1), shift(np.sqrt(variance), 1)
+        return np.where(std > 0, (matrix - mean) / std, np.nan)
+
+
+class ChannelWindows:
+    """Windowed statistics of all videos of one channel as (videos x days) arrays.
+
+    ``days`` is the shared calendar axis (``datetime64[D]``) and row ``i`` of
+    every array belongs to ``video_ids[i]``. CTR statistics are NaN when
+    built without impressions.
+    """
+
+    def __init__(self, video_ids, days, views, impressions=None, window=DEFAULT_WINDOW,
+                 long_window=DEFAULT_LONG_WINDOW, z_threshold=DEFAULT_Z_THRESHOLD):
+        self.window = window
+        self.video_ids = list(video_ids)
+        self.rows = {video_id: row for row, video_id in enumerate(self.video_ids)}
+        self.days = days
+        self.views = views
+
+        self.views_avg = rolling_mean(views, window)
+        self.views_avg_long = rolling_mean(views, long_window)
+        self.dod_growth = growth(views, shift(views, 1))
+        week_sums, week_counts = rolling_sum(views, WEEK)
+        week_views = np.where(week_counts == WEEK, week_sums, np.nan)
+        self.wow_growth = growth(week_views, shift(week_views, WEEK))
+
+        if impressions is None:
+            impressions = np.full_like(views, np.nan)
+        self.ctr = self._weighted_ctr(views, impressions, window)
+        self.ctr_trend = self.ctr - self._weighted_ctr(views, impressions, long_window)
+
+        self.zscore = rolling_zscore(np.log1p(views), window)
+        self.spikes = self.zscore > z_threshold
+        self.dips = self.zscore < -z_threshold
+
+    @staticmethod
+    def _weighted_ctr(views, impressions, window):
+        view_sums, counts = rolling_sum(views, window)
+        impression_sums, _ = rolling_sum(impressions, window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where((counts >= window) & (impression_sums > 0), view_sums / impression_sums, np.nan)
+
+    @classmethod
+    def from_block(cls, block, **options):
+        """Build the statistics of an analytics_cache.ChannelBlock, CTR included."""
+        video_ids = list(block.spans)
+        days = block.days.astype('datetime64[D]')
+        if not len(days):
+            empty = np.empty((len(video_ids), 0))
+            return cls(video_ids, days, empty, empty, **options)
+
+        rows = np.empty(len(days), dtype=np.int64)
+        for row, (start, stop) in enumerate(block.spans.values()):
+            rows[start:stop] = row
+        first = days.min()
+        columns = (days - first).astype(np.int64)
+        shape = (len(video_ids), int(columns.max()) + 1)
+
+        views = np.full(shape, np.nan)
+        views[rows, columns] = block.day_views
+        impressions = np.full(shape, np.nan)
+        impressions[rows, columns] = block.impressions
+        return cls(video_ids, first + np.arange(shape[1]), views, impressions, **options)
+
+    @classmethod
+    def from_arrays(cls, metric_arrays, **options):
+        """Build view statistics from a {video_id: (days, day_views)} mapping."""
+        video_ids = list(metric_arrays)
+        all_days = [np.asarray(days, dtype='datetime64[D]') for days, _ in metric_arrays.values()]
+        non_empty = [days for days in all_days if len(days)]
+        if not non_empty:
+            return cls(video_ids, np.array([], dtype='datetime64[D]'), np.empty((len(video_ids), 0)), **options)
+
+        first = min(days.min() for days in non_empty)
+        last = max(days.max() for days in non_empty)
+        views = np.full((len(video_ids), int((last - first).astype(np.int64)) + 1), np.nan)
+        for row, (days, (_, day_views)) in enumerate(zip(all_days, metric_arrays.values())):
+            views[row, (days - first).astype(np.int64)] = np.asarray(day_views, dtype=np.float64)
+        return cls(video_ids, first + np.arange(views.shape[1]), views, **options)
+
+    def overlay(self, video_id):
+        """Return (days, moving average, spike days, spike views, dip days, dip views) of a video."""
+        row = self.rows[video_id]
+        spikes, dips = self.spikes[row], self.dips[row]
+        return (
+            self.days, self.views_avg[row],
+            self.days[spikes], self.views[row, spikes],
+            self.days[dips], self.views[row, dips],
+        )
+
+    def _last_valid(self, matrix):
+        """Return each video's last day with views and the value of ``matrix`` on it.
+
+        Videos without any data get day -1 and NaN.
+        """
+        has_data = ~np.isnan(self.views)
+        last = np.where(has_data.any(axis=1), matrix.shape[1] - 1 - np.argmax(has_data[:, ::-1], axis=1), -1)
+        values = np.full(matrix.shape[0], np.nan)
+        rows = np.flatnonzero(last >= 0)
+        values[rows] = matrix[rows, last[rows]]
+        return last, values
+
+    def summaries(self):
+        """Return one (video_id, last_day, views_avg, views_avg_long, wow_growth,
+        ctr, ctr_trend, spikes, dips) row per video with any data."""
+        last, _ = self._last_valid(self.views)
+        columns = [self._last_valid(m)[1] for m in
+                   (self.views_avg, self.views_avg_long, self.wow_growth, self.ctr, self.ctr_trend)]
+        spikes, dips = self.spikes.sum(axis=1), self.dips.sum(axis=1)
+        return [
+            (video_id, str(self.days[last[row]]), *(_optional(c[row]) for c in columns),
+             int(spikes[row]), int(dips[row]))
+            for row, video_id in enumerate(self.video_ids) if last[row] >= 0
+        ]
+
+    def anomalies(self):
+        """Return (video_id, day, 'spike' | 'dip', views, zscore) of every flagged day."""
+        rows, columns = np.nonzero(self.spikes | self.dips)
+        return [
+            (self.video_ids[row], str(self.days[column]), 'spike' if self.spikes[row, column] else 'dip',
+             int(self.views[row, column]), float(self.zscore[row, column]))
+            for row, column in zip(rows.tolist(), columns.tolist())
+        ]
+
+
+def _optional(value):
+    """Return a float, or None for NaN."""
+    return None if np.isnan(value) else float(value)
+
+
+def create_window_tables(conn):
+    """Create the trend summary and anomaly tables."""
+    for statement in WINDOW_TABLES:
+        conn.execute(statement)
+
+
+def persist(conn, user_id, windows):
+    """Replace a channel's stored trend summaries and anomalies. The caller commits."""
+    create_window_tables(conn)
+    conn.execute('DELETE FROM video_trend_summary WHERE user_id = ?', (user_id,))
+    conn.execute('DELETE FROM video_anomalies WHERE user_id = ?', (user_id,))
+    conn.executemany(
+        'INSERT INTO video_trend_summary VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [(user_id,) + row for row in windows.summaries()]
+    )
+    conn.executemany(
+        'INSERT INTO video_anomalies VALUES (?, ?, ?, ?, ?, ?)',
+        [(user_id,) + row for row in windows.anomalies()]
+    )
+
+
+def main(argv=None):
+    """Compute windowed statistics of every channel and optionally store them."""
+    parser = argparse.ArgumentParser(description='Compute moving averages, growth and anomaly flags per video.')
+    parser.add_argument('--analytics-db', default=ANALYTICS_DB,
+                        help='path to the analytics database')
+    parser.add_argument('--user', action='append', metavar='USER_ID',
+                        help='only analyze this channel (repeatable)')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW,
+                        help='days of the short moving window and of the z-score baseline')
+    parser.add_argument('--long-window', type=int, default=DEFAULT_LONG_WINDOW,
+                        help='days of the long moving window')
+    parser.add_argument('--z-threshold', type=float, default=DEFAULT_Z_THRESHOLD,
+                        help='z-score beyond which a day is flagged as a spike or dip')
+    parser.add_argument('--persist', action='store_true',
+                        help='store the summaries and anomalies in the database')
+    args = parser.parse_args(argv)
+    options = {'window': args.window, 'long_window': args.long_window, 'z_threshold': args.z_threshold}
+
+    # Only --persist writes; plain analysis reads through a read-only connection
+    conn = connect_writer(args.analytics_db) if args.persist else connect_reader(args.analytics_db)
+    try:
+        layout = detect_layout(conn)
+        user_ids = args.user or [row[0] for row in conn.execute('SELECT user_id FROM all_users')]
+        load_seconds = analyze_seconds = 0.0
+        spikes = dips = 0
+        for user_id in user_ids:
+            started = time.perf_counter()
+            block = load_channel(conn, layout, user_id)
+            loaded = time.perf_counter()
+            windows = ChannelWindows.from_block(block, **options)
+            analyze_seconds += time.perf_counter() - loaded
+            load_seconds += loaded - started
+            spikes += int(windows.spikes.sum())
+            dips += int(windows.dips.sum())
+            if args.persist:
+                persist(conn, user_id, windows)
+        if args.persist:
+            conn.commit()
+        print(f"Analyzed {len(user_ids)} channels: {spikes:,} spikes and {dips:,} dips flagged")
+        print(f"  load {load_seconds:.2f}s, analysis {analyze_seconds:.3f}s "
+              f"({analyze_seconds / max(len(user_ids), 1) * 1000:.2f} ms per channel)")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()